@@ -0,0 +1,211 @@
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user
+from sqlalchemy import or_, tuple_
+from werkzeug.datastructures import MultiDict
+
+from db_engine import read_session
+from forms import OrderEditForm
+from ingest import EXPECTED_COLUMNS, REQUIRED_COLUMNS, insert_records, validate_chunk
+from keygen import retry_key_collisions
+from models import db, CustomerSummary, DataVersion, Order, SupplierSummary, orders_changed
+from pagination import decode_cursor, encode_cursor
+from search import STATUS_CLOCK_SECONDS, apply_order_filters, parse_customer_query, status_clock
+from summaries import subtract_orders
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+EDITABLE_FIELDS = ['supplier_name', 'customer_name', 'amount', 'phone'] # Same fields as OrderEditForm
+MAX_PAGE_SIZE = 500
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to the login page."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return jsonify({'error': 'authentication required'}), 401
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def _error(message, status=400):
+    return jsonify({'error': message}), status
+
+
+# --- Conditional GET support ---
+
+def _validators():
+    """ETag/Last-Modified for the current request, derived from the order table's version counter.
+
+    Status filters (expired / expiring) change as time passes without any
+    write, so their validators also carry the same minute bucket index() uses.
+    """
+    version, updated_at = DataVersion.current('order')
+    clock = status_clock(request.args.get('status', ''))
+    fingerprint = hashlib.sha1(f'{version}|{clock}|{request.path}|{sorted(request.args.items(multi=True))}'.encode()).hexdigest()[:16]
+    if clock is not None:
+        bucket_started = datetime.utcfromtimestamp(clock * STATUS_CLOCK_SECONDS)
+        updated_at = max(updated_at, bucket_started) if updated_at else bucket_started
+    return f'orders-{version}-{fingerprint}', updated_at
+
+
+def conditional(view):
+    """Answers 304 from the version counter alone when the client already has the current data."""
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        etag, last_modified = _validators()
+        not_modified = (request.if_none_match.contains_weak(etag) if request.if_none_match
+                        else bool(last_modified and request.if_modified_since
+                                  and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)))
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code != 200: return response
+        response.set_etag(etag, weak=True)
+        if last_modified: response.last_modified = last_modified
+        response.cache_control.no_cache = True # Always revalidate; the 304 path is cheap
+        return response
+    return wrapped
+
+
+# --- Read endpoints ---
+
+@api.route('/orders', methods=['GET'])
+@api_login_required
+@conditional
+def list_orders():
+    """Cursor-paginated order list; accepts the same supplier_query/customer_query/status filters as index()."""
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PAGE_SIZE)
+    query = apply_order_filters(read_session().query(Order), request.args.get('supplier_query', '').strip(),
+                                parse_customer_query(request.args.get('customer_query', '').strip()),
+                                status_filter=request.args.get('status', ''))
+    position = decode_cursor(request.args.get('cursor'))
+    if request.args.get('cursor') and position is None: return _error('invalid cursor')
+    if position:
+        query = query.filter(tuple_(Order.upload_timestamp, Order.id) < tuple_(*position))
+    rows = query.order_by(Order.upload_timestamp.desc(), Order.id.desc()).limit(limit + 1).all()
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1].upload_timestamp, items[-1].id) if len(rows) > limit else None
+    return jsonify({'items': [order.to_dict() for order in items], 'next_cursor': next_cursor})
+
+
+@api.route('/orders/<key>', methods=['GET'])
+@api_login_required
+@conditional
+def get_order(key):
+    """Fetches one order by its order_id or coupon_code."""
+    order = read_session().query(Order).filter(or_(Order.order_id == key, Order.coupon_code == key)).first()
+    if order is None: return _error('order not found', 404)
+    return jsonify(order.to_dict())
+
+
+@api.route('/summary/<by>', methods=['GET'])
+@api_login_required
+@conditional
+def order_summary(by):
+    """Per-supplier (by=suppliers) or per-customer (by=customers) totals from the summary tables, by total amount."""
+    model = {'suppliers': SupplierSummary, 'customers': CustomerSummary}.get(by)
+    if model is None: return _error('expected /summary/suppliers or /summary/customers', 404)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    rows = read_session().query(model).order_by(model.amount_total.desc(), *model.__table__.primary_key.columns) \
+        .offset(offset).limit(limit).all()
+    return jsonify({'items': [row.to_dict() for row in rows], 'total': read_session().query(model).count()})
+
+
+# --- Bulk write endpoints ---
+
+def _json_list(field):
+    payload = request.get_json(silent=True)
+    items = payload.get(field) if isinstance(payload, dict) else None
+    return items if isinstance(items, list) else None
+
+
+@api.route('/orders', methods=['POST'])
+@api_login_required
+def create_orders():
+    """Bulk-creates orders from {"orders": [{supplier_name, customer_name, amount, issue_time, phone}, ...]}.
+
+    Items go through the same column-wise validation as Excel uploads; the
+    numbers in error messages are 1-based positions in the submitted list.
+    """
+    items = _json_list('orders')
+    if items is None: return _error('expected {"orders": [...]}')
+    if len(items) > current_app.config['API_MAX_BATCH']: return _error(f"at most {current_app.config['API_MAX_BATCH']} orders per request")
+    # Columns: the required ones plus any optional column that at least one item provides
+    columns = [col for col in EXPECTED_COLUMNS.values()
+               if col in REQUIRED_COLUMNS or any(isinstance(item, dict) and col in item for item in items)]
+    chunk = [(i, {col: item.get(col) if isinstance(item, dict) else None for col in columns})
+             for i, item in enumerate(items, start=1)]
+    for _, row in chunk: # Missing values are NaN for the validator, like blank Excel cells
+        for col, value in row.items():
+            if value is None or value == '': row[col] = float('nan')
+    records, errors, skipped = validate_chunk(chunk, columns) if chunk else ([], [], 0)
+    if records:
+        def write():
+            insert_records(records, source='api'); db.session.commit()
+        retry_key_collisions(write) # Re-allocates the keys if a concurrent upload took one of them
+        orders_changed.send(current_app._get_current_object())
+    return jsonify({'created': [{'order_id': r['order_id'], 'coupon_code': r['coupon_code']} for r in records],
+                    'skipped': skipped, 'errors': errors}), 201 if records else 200
+
+
+@api.route('/orders', methods=['PATCH'])
+@api_login_required
+def update_orders():
+    """Bulk-updates the OrderEditForm fields: {"orders": [{"order_id": ..., "customer_name": ..., ...}, ...]}."""
+    items = _json_list('orders')
+    if items is None: return _error('expected {"orders": [...]}')
+    if len(items) > current_app.config['API_MAX_BATCH']: return _error(f"at most {current_app.config['API_MAX_BATCH']} orders per request")
+    keys = [item.get('order_id') for item in items if isinstance(item, dict) and isinstance(item.get('order_id'), str)]
+    orders = {o.order_id: o for o in Order.query.filter(Order.order_id.in_(keys)).all()} if keys else {} # One query for the batch
+    updated = []; errors = []
+    for item in items:
+        if isinstance(item, dict) and 'order_id' in item and not isinstance(item['order_id'], str):
+            errors.append({'order_id': item['order_id'], 'errors': ['order_id must be a string']}); continue
+        order = orders.get(item.get('order_id')) if isinstance(item, dict) else None
+        if order is None:
+            errors.append({'order_id': item.get('order_id') if isinstance(item, dict) else None, 'errors': ['order not found']}); continue
+        # Validate with the same form the edit page uses; unspecified fields keep their current value
+        values = {field: item.get(field, getattr(order, field)) for field in EDITABLE_FIELDS}
+        form = OrderEditForm(formdata=MultiDict({k: '' if v is None else str(v) for k, v in values.items()}), meta={'csrf': False})
+        if not form.validate():
+            errors.append({'order_id': order.order_id, 'errors': dict(form.errors)}); continue
+        order.supplier_name = form.supplier_name.data.strip() if form.supplier_name.data else None
+        order.customer_name = form.customer_name.data.strip()
+        order.amount = form.amount.data
+        order.phone = form.phone.data.strip()
+        updated.append(order.order_id)
+    if updated:
+        DataVersion.bump('order')
+        db.session.commit()
+        orders_changed.send(current_app._get_current_object())
+    else:
+        db.session.rollback()
+    return jsonify({'updated': updated, 'errors': errors})
+
+
+@api.route('/orders', methods=['DELETE'])
+@api_login_required
+def delete_orders():
+    """Bulk-deletes orders given {"order_ids": [...]} (order_id strings) or {"ids": [...]} (database IDs)."""
+    order_ids = _json_list('order_ids'); ids = _json_list('ids')
+    if order_ids is None and ids is None: return _error('expected {"order_ids": [...]} or {"ids": [...]}')
+    if len(order_ids if order_ids is not None else ids) > current_app.config['API_MAX_BATCH']:
+        return _error(f"at most {current_app.config['API_MAX_BATCH']} orders per request")
+    try:
+        condition = Order.order_id.in_([str(k) for k in order_ids]) if order_ids is not None else Order.id.in_([int(i) for i in ids])
+    except (TypeError, ValueError):
+        return _error('ids must be integers')
+    subtract_orders(condition) # Supplier/customer totals, same transaction
+    num_deleted = Order.query.filter(condition).delete(synchronize_session=False)
+    if num_deleted:
+        DataVersion.bump('order')
+        db.session.commit()
+        orders_changed.send(current_app._get_current_object())
+    return jsonify({'deleted': num_deleted})
@@ -1,62 +1,155 @@
 import os
-import random
-import string
-import pandas as pd
+import sys
+import time
+_import_started = time.perf_counter() # Startup timing (see create_app); everything below counts as import time
 from datetime import datetime
-# Import 'or_' from sqlalchemy for complex OR queries
-from sqlalchemy import or_
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory, abort
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+import click
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, send_from_directory, abort, jsonify, Response, stream_with_context
+from flask.cli import AppGroup, FlaskGroup, with_appcontext
+from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
-from werkzeug.security import check_password_hash, generate_password_hash
 # Import WTForms csrf protection
 from flask_wtf.csrf import CSRFProtect
+from markupsafe import Markup
+from sqlalchemy import func
 
+# pandas/openpyxl (ingest.py, export.py) and Pillow (avatars.py) are imported inside the functions that
+# use them, so a worker that never handles an upload, export or avatar never loads them.
 from config import Config
-from models import db, User, Order
+from models import (db, User, Order, ArchivedOrder, CustomerSummary, DataVersion, OrderBulkJob, SupplierSummary, UploadJob,
+                    order_list_columns, orders_changed, upgrade_schema)
 from forms import RegistrationForm, LoginForm, ProfileUpdateForm, ExcelUploadForm, OrderEditForm
-
-# Initialize Flask App
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Initialize extensions
-db.init_app(app)
+import db_engine
+import keygen
+from api import api
+from auth import HashingBusy, PasswordHasher, UserCache
+from avatars import AVATAR_FORMATS, AvatarError, avatar_url, is_content_hash, process_avatar, thumbnail_name
+from db_engine import read_session
+from dedup import rebuild_row_keys
+from expiry import ExpirySweeper, backfill_expiry
+from export import EXPORT_FORMATS, ExportUnavailable, export_statement, stream_export
+from jobs import OrderBulkJobRunner, UploadJobRunner
+from metrics import Metrics
+from page_cache import ResultCache, current_data_version
+from pagination import CountCache, OffsetPage, paginate_keyset, restore_page
+from search import STATUS_FILTERS, apply_order_filters, ensure_search_index, parse_customer_query, status_clock
+import summaries
+_import_seconds = time.perf_counter() - _import_started
+
+# Extensions: created unbound here, bound to the app by create_app()
+# Per-route latency, SQL count/time, ingest and cache/pool numbers at /metrics (see metrics.py)
+request_metrics = Metrics()
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login' # Redirect to 'login' view if user is not logged in
 login_manager.login_message = '请先登录以访问此页面。'
 login_manager.login_message_category = 'info'
 
-# Enable CSRF protection globally (Ensure SECRET_KEY is set in Config)
-csrf = CSRFProtect(app)
+# CSRF protection for every form (Ensure SECRET_KEY is set in Config)
+csrf = CSRFProtect()
+# JSON API for downstream systems (see api.py); JSON clients don't carry a CSRF form token
+csrf.exempt(api)
+
+# Password hashing on a bounded worker pool + per-process user cache (see auth.py)
+password_hasher = PasswordHasher()
+user_cache = UserCache()
 
 # --- User Loader for Flask-Login ---
 @login_manager.user_loader
 def load_user(user_id):
-    """Loads user object from user ID stored in the session."""
-    return User.query.get(int(user_id))
+    """Loads user object from user ID stored in the session (from the user cache when possible)."""
+    return user_cache.get(int(user_id))
+
+# Cached total counts per search filter (invalidated by every write route; TTL set by create_app)
+order_counts = CountCache()
+
+# Cached list/search results (row IDs, total, rendered table), keyed on the order data version
+result_cache = ResultCache()
+
+# Background Excel import jobs (see jobs.py)
+upload_jobs = UploadJobRunner()
+
+# Chunked background deletes / archiving (see jobs.py, archive.py)
+bulk_jobs = OrderBulkJobRunner()
+
+# Marks orders past expires_at as 已过期 in batches (see expiry.py); started by start_background_tasks()
+expiry_sweeper = ExpirySweeper()
+
+AVATAR_CACHE_SECONDS = 365 * 24 * 3600
+PER_PAGE_OPTIONS = (10, 20, 50, 100, 200, 500) # Page sizes offered on the order list (any value up to ORDER_LIST_MAX_PER_PAGE works)
+
+# Views register themselves here with @route; create_app() adds them to the app under their function names
+_routes = []
+
+def route(rule, **options):
+    """Same as @app.route, for the app built by create_app()."""
+    def decorator(view):
+        _routes.append((rule, view, options)); return view
+    return decorator
+
+# --- Application Factory ---
+
+def create_app(config_class=Config):
+    """Builds the Flask app: config, extensions, views and CLI commands.
+
+    Cheap on purpose: nothing here touches the database (run `python app.py db
+    create` for that) or starts a thread (see start_background_tasks()), so
+    it can run once in a preloading server's master process. The time it took
+    is logged and exported as app_startup_seconds on /metrics.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Avatar thumbnails
+
+    # Initialize extensions
+    db_engine.init_app(app) # Engine profile (WAL/PRAGMAs/pool) + db.init_app + read-only session
+    request_metrics.init_app(app)
+    login_manager.init_app(app)
+    csrf.init_app(app)
+    app.register_blueprint(api)
+    password_hasher.init_app(app)
+    user_cache.init_app(app)
+    keygen.init_app(app) # Unique key allocators (order_id / coupon_code, see keygen.py)
+    order_counts.ttl = app.config['COUNT_CACHE_TTL']; app.extensions['order_counts'] = order_counts
+    orders_changed.connect(lambda sender: order_counts.invalidate(), sender=app, weak=False)
+    result_cache.init_app(app)
+    upload_jobs.init_app(app)
+    bulk_jobs.init_app(app)
+    expiry_sweeper.init_app(app)
+
+    # Avatar helpers for base.html / profile.html (see templates/_avatar.html)
+    app.jinja_env.globals.update(avatar_url=avatar_url, is_avatar_hash=is_content_hash, avatar_sizes=app.config['AVATAR_SIZES'])
+
+    for rule, view, options in _routes: app.add_url_rule(rule, view.__name__, view, **options)
+    for command in (db_cli, rebuild_summaries_command, archive_orders_command, expire_orders_command, rebuild_row_keys_command):
+        app.cli.add_command(command)
+
+    app.extensions['startup'] = {'import_seconds': _import_seconds, 'create_app_seconds': time.perf_counter() - started}
+    app.logger.info(f"App created in {app.extensions['startup']['create_app_seconds'] * 1000:.0f} ms "
+                    f"(module imports {_import_seconds * 1000:.0f} ms)")
+    return app
+
+def start_background_tasks(app, recover_jobs=True):
+    """Per-process background work: resumes interrupted jobs and starts the 已过期 sweep thread.
+
+    Call it in every serving process after any fork (gunicorn.conf.py does it
+    in post_fork). With several workers only one should pass recover_jobs=True,
+    or queued jobs would be picked up more than once.
+    """
+    with app.app_context():
+        if recover_jobs:
+            upload_jobs.recover() # Fail interrupted upload jobs, re-queue ones that never started
+            bulk_jobs.recover() # Resume interrupted chunked deletes / archiving
+    expiry_sweeper.start() # Periodic 已过期 status sweep (EXPIRY_SWEEP_INTERVAL)
+
+def reset_after_fork(app):
+    """Drops database connections inherited from a preloading parent process (never share them across a fork)."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+        app.extensions['read_engine'].dispose(close=False)
 
 # --- Helper Functions ---
 
-def generate_random_string(length):
-    """Generates a random string of lowercase letters and digits."""
-    characters = string.ascii_lowercase + string.digits
-    return ''.join(random.choices(characters, k=length))
-
-def generate_order_id():
-    """Generates a unique Order ID (NMCFxxxx)."""
-    while True:
-        order_id = 'NMCF' + generate_random_string(4)
-        if not Order.query.filter_by(order_id=order_id).first():
-            return order_id
-
-def generate_coupon_code():
-    """Generates a unique Coupon Code (CXxxxxxxx)."""
-    while True:
-        coupon_code = 'CX' + generate_random_string(7)
-        if not Order.query.filter_by(coupon_code=coupon_code).first():
-            return coupon_code
 
 def allowed_file(filename, allowed_extensions):
     """Checks if the file extension is allowed."""
@@ -65,93 +158,204 @@ def allowed_file(filename, allowed_extensions):
 
 # --- Routes ---
 
-@app.route('/')
-@app.route('/index')
+@route('/')
+@route('/index')
 @login_required
 def index():
     """Displays the main page with orders, search, and pagination.
        Hides supplier column if supplier name is searched (even with customer name)."""
     page = request.args.get('page', 1, type=int)
-    per_page = 10 # Records per page
+    # Records per page: ?per_page=, ORDER_LIST_PER_PAGE by default, at most ORDER_LIST_MAX_PER_PAGE
+    per_page = min(max(request.args.get('per_page', current_app.config['ORDER_LIST_PER_PAGE'], type=int), 1),
+                   current_app.config['ORDER_LIST_MAX_PER_PAGE'])
     # Get search terms from URL query parameters
     supplier_query = request.args.get('supplier_query', '').strip()
     customer_query_string = request.args.get('customer_query', '').strip()
-
-    # Start with a base query for all orders
-    query = Order.query
+    # archived=1 browses the archive tier instead of the current orders
+    archived = request.args.get('archived') == '1'
+    model = ArchivedOrder if archived else Order
+    # Status / expiry filter ('' = all, see search.STATUS_FILTERS)
+    status_filter = request.args.get('status', '')
+    if status_filter not in STATUS_FILTERS: status_filter = ''
 
     # Initialize flags/variables for template rendering
     hide_supplier_column = False
     searched_supplier_name = None
 
-    # --- Updated Search Logic ---
-
-    # 1. Handle Supplier Search & Column Hiding Condition
-    #    If supplier_query has *any* value, filter by it, set flag to hide the column,
-    #    and store the searched name for display.
+    # 1. Supplier search: if supplier_query has *any* value, filter by it, hide the
+    #    supplier column and store the searched name for display.
     if supplier_query:
-        query = query.filter(Order.supplier_name.ilike(f'%{supplier_query}%')) # Apply filter
         hide_supplier_column = True  # Set flag to hide column
         searched_supplier_name = supplier_query # Store name for display
 
-    # 2. Handle Customer Search (potentially multiple names)
-    #    This filter is applied *in addition* to the supplier filter if both are present.
-    if customer_query_string:
-        # Normalize delimiters (commas, semicolons, etc.) to spaces
-        normalized_query = customer_query_string.replace(',', ' ').replace(';', ' ')
-        # Add more .replace() if other delimiters like '|' are expected
-
-        # Split by space and clean up terms (remove empty strings)
-        customer_names = [name.strip() for name in normalized_query.split(' ') if name.strip()]
-
-        # If valid customer names were extracted, build and apply the OR condition
-        if customer_names:
-            # Create a list of individual ILIKE conditions
-            conditions = [Order.customer_name.ilike(f'%{name}%') for name in customer_names]
-            # Apply the OR conditions to the query (which might already be filtered by supplier)
-            query = query.filter(or_(*conditions)) # Use * to unpack list arguments
+    # --- Result cache: same filters + page/cursor at the same data version = same page ---
+    cursor = request.args.get('cursor')
+    direction = request.args.get('direction', 'next')
+    # Expiry filters depend on the clock too, so their entries also change every minute
+    clock = status_clock(status_filter)
+    data_version = current_data_version()
+    cache_key = result_cache.make_key(data_version, archived, supplier_query, customer_query_string,
+                                      status_filter, clock, page, cursor, direction, per_page)
+    cached = result_cache.get(cache_key)
+    if cached and cached.get('html') is not None:
+        return render_index(Markup(cached['html']), supplier_query, customer_query_string, archived, status_filter, per_page)
+
+    # Start with a base query for all orders (read-only session: never waits behind upload commits).
+    # Only the displayed columns, masked by the database, come back as Row tuples (no ORM objects).
+    query = read_session().query(*order_list_columns(model))
+
+    # --- Search Logic (served by the trigram search index, see search.py) ---
+
+    # 2. Customer search (potentially multiple names, OR'ed together), applied
+    #    *in addition* to the supplier filter if both are present.
+    customer_names = parse_customer_query(customer_query_string)
+    query = apply_order_filters(query, supplier_query, customer_names, model=model, status_filter=status_filter)
 
     # --- End Search Logic ---
 
-    # Apply ordering and pagination *after* all filtering is done
-    orders_pagination = query.order_by(Order.upload_timestamp.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    if cached:
+        # Cached IDs: one primary-key lookup instead of the filtered, ordered query and the count
+        by_id = {o.id: o for o in read_session().query(*order_list_columns(model)).filter(model.id.in_(cached['ids']))} if cached['ids'] else {}
+        orders_pagination = restore_page(cached['page'], [by_id[i] for i in cached['ids'] if i in by_id])
+    else:
+        # Total comes from the per-filter count cache instead of a fresh COUNT(*) on every page view.
+        # The data version is part of the key: writes made by other workers don't invalidate this one's cache.
+        count_key = (data_version, archived, supplier_query, tuple(customer_names), status_filter, clock)
+        total_records = order_counts.get_or_compute(count_key, lambda: query.with_entities(model.id).order_by(None).count())
+
+        # Apply ordering and pagination *after* all filtering is done
+        if cursor or total_records > current_app.config['SMALL_RESULT_SET_ROWS']:
+            # Large result sets: seek past the (upload_timestamp, id) cursor instead of OFFSET
+            orders_pagination = paginate_keyset(query, model, cursor, direction, page, per_page, total_records)
+        else:
+            # Small result sets keep the numbered page links
+            page = max(page, 1)
+            items = query.order_by(model.upload_timestamp.desc(), model.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+            orders_pagination = OffsetPage(items, page, per_page, total_records)
     orders = orders_pagination.items # Get the records for the current page
+    page = orders_pagination.page; total_records = orders_pagination.total
 
     # Calculate display information (e.g., "Showing 1 to 10 of 50 records")
-    total_records = orders_pagination.total
-    start_record = (page - 1) * per_page + 1 if total_records > 0 else 0
-    end_record = min(start_record + per_page - 1, total_records)
+    start_record = (page - 1) * per_page + 1 if orders else 0
+    end_record = min(start_record + len(orders) - 1, total_records) if orders else 0
     display_info = f"显示第 {start_record} 到第 {end_record} 条记录，总共 {total_records} 条记录"
 
-    # Render the main index template, passing all necessary data and flags
-    return render_template('index.html', title='客户订单管理系统',
-                           orders=orders,
-                           pagination=orders_pagination,
-                           display_info=display_info,
-                           hide_supplier_column=hide_supplier_column, # Template uses this flag
-                           searched_supplier_name=searched_supplier_name, # Template uses this value
+    # Render the table/pagination fragment, passing all necessary data and flags
+    results_html = render_template('_order_results.html',
+                                   orders=orders,
+                                   pagination=orders_pagination,
+                                   display_info=display_info,
+                                   hide_supplier_column=hide_supplier_column, # Template uses this flag
+                                   searched_supplier_name=searched_supplier_name, # Template uses this value
+                                   supplier_query=supplier_query, # For the pagination links
+                                   customer_query=customer_query_string, # Pass original string back
+                                   status_filter=status_filter, # For the pagination links
+                                   per_page_param=per_page_param(per_page), # For the pagination links
+                                   archived=archived) # Archive rows are read-only
+    result_cache.set(cache_key, {'ids': [o.id for o in orders], 'page': orders_pagination.cache_state(),
+                                 'html': results_html if result_cache.store_fragments else None})
+    return render_index(Markup(results_html), supplier_query, customer_query_string, archived, status_filter, per_page)
+
+def per_page_param(per_page):
+    """per_page for generated links; None (left out of the URL) when it is the default."""
+    return per_page if per_page != current_app.config['ORDER_LIST_PER_PAGE'] else None
+
+def render_index(results_html, supplier_query, customer_query, archived=False, status_filter='', per_page=None):
+    """Renders the main index page around the (possibly cached) results fragment."""
+    return render_template('index.html', title='订单归档' if archived else '客户订单管理系统',
+                           results_html=results_html,
                            supplier_query=supplier_query, # To pre-fill search boxes
-                           customer_query=customer_query_string) # Pass original string back
+                           customer_query=customer_query,
+                           status_filter=status_filter, status_filters=STATUS_FILTERS,
+                           per_page=per_page or current_app.config['ORDER_LIST_PER_PAGE'], per_page_options=PER_PAGE_OPTIONS,
+                           archived=archived)
+
+@route('/orders/cache_stats')
+@login_required
+def result_cache_stats():
+    """Hit/miss statistics of this worker's order list result cache."""
+    return jsonify(result_cache.stats())
+
+@route('/auth/stats')
+@login_required
+def auth_stats():
+    """This worker's user cache hit/miss counts and password hashing latency metrics."""
+    return jsonify({'user_cache': user_cache.stats(), 'password_hashing': password_hasher.stats()})
+
+# --- Supplier / customer totals (summary tables, see summaries.py) ---
+@route('/orders/summary')
+@login_required
+def order_summary():
+    """Per-supplier or per-customer totals; reads only the summary tables, never scans "order"."""
+    by = 'customer' if request.args.get('by') == 'customer' else 'supplier'
+    name_query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1); per_page = 50
+    model = CustomerSummary if by == 'customer' else SupplierSummary
+    name_column = model.customer_name if by == 'customer' else model.supplier_name
+    query = read_session().query(model)
+    if name_query: query = query.filter(name_column.contains(name_query, autoescape=True))
+    total = query.count()
+    rows = query.order_by(model.amount_total.desc(), name_column).offset((page - 1) * per_page).limit(per_page).all()
+    totals = read_session().query(*[func.coalesce(func.sum(getattr(SupplierSummary, c)), 0).label(c) for c in summaries.COUNTERS]).one()
+    return render_template('order_summary.html', title='订单汇总', by=by, name_query=name_query, totals=totals,
+                           pagination=OffsetPage(rows, page, per_page, total))
+
+@click.command('rebuild-summaries')
+@with_appcontext
+@click.option('--check', is_flag=True, help='Only compare the summary tables with a full recount.')
+def rebuild_summaries_command(check):
+    """Recomputes the supplier/customer summary tables from scratch (after verifying them)."""
+    upgrade_schema()
+    mismatches = summaries.verify()
+    for table, key, stored, expected in mismatches[:20]: print(f"{table} {key}: stored {stored}, expected {expected}")
+    print(f"{len(mismatches)} summary rows out of step with the order table.")
+    if check:
+        if mismatches: raise SystemExit(1)
+        return
+    print(f"Rebuilt: {summaries.rebuild()}")
+
+# --- Export Orders (same filters as index) ---
+@route('/orders/export')
+@login_required
+def export_orders():
+    """Streams the filtered orders as CSV, XLSX or Parquet without loading them all into memory."""
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS: abort(400)
+    supplier_query = request.args.get('supplier_query', '').strip()
+    customer_names = parse_customer_query(request.args.get('customer_query', '').strip())
+    status_filter = request.args.get('status', '')
+    masked = request.args.get('masked', '1') != '0' # Masked phone/coupon by default; masked=0 exports raw values
+
+    statement = export_statement(lambda stmt: apply_order_filters(stmt, supplier_query, customer_names, status_filter=status_filter),
+                                 masked=masked)
+    try:
+        body = stream_export(fmt, statement, current_app.config['EXPORT_BATCH_SIZE'])
+    except ExportUnavailable as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('index', supplier_query=supplier_query, customer_query=request.args.get('customer_query', '')))
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 # --- Delete All Orders add(2025-9-17) v1.1.0 by wxybabymichael ---
-@app.route('/orders/all_delete', methods=['POST'])
+@route('/orders/all_delete', methods=['POST'])
 @login_required
 def all_delete_orders():
-    """Deletes all orders from the database."""
+    """Deletes all orders in chunks as a background job (readers and other writers are not blocked)."""
     try:
-        num_deleted = Order.query.delete()
-        db.session.commit()
-        flash(f'成功删除了 {num_deleted} 条记录。', 'success')
+        job = bulk_jobs.enqueue('delete_all', user_id=current_user.id)
+        return redirect(url_for('order_bulk_job', job_id=job.id)) # Progress page
     except Exception as e:
         db.session.rollback()
+        flash(f'删除记录时发生错误: {e}', 'danger')
+        current_app.logger.error(f"Delete-all enqueue error: {e}")
     
     return redirect(url_for('index')) # Redirect back to the main list page
 # --- End Delete All Orders add(2025-9-17) v1.1.0 by wxybabymichael ---
 
 # --- NEW Batch Delete Route ---
-@app.route('/orders/batch_delete', methods=['POST'])
+@route('/orders/batch_delete', methods=['POST'])
 @login_required
 def batch_delete_orders():
     """Handles deletion of multiple orders based on selected checkboxes."""
@@ -169,14 +373,17 @@ def batch_delete_orders():
         flash('提交的记录 ID 包含无效值。', 'danger')
         return redirect(url_for('index'))
 
-    deleted_count = 0
     try:
-        # Perform bulk delete efficiently
-        num_deleted = Order.query.filter(Order.id.in_(valid_ids)).delete(synchronize_session='fetch')
-        db.session.commit() # Commit the transaction
-        deleted_count = num_deleted if num_deleted is not None else 0 # Get the count of deleted rows
-
-        if deleted_count > 0:
+        # A selection that fits in one chunk is deleted right away; larger ones run in the background
+        wait = len(valid_ids) <= current_app.config['BULK_BATCH_SIZE']
+        job = bulk_jobs.enqueue('delete_selected', user_id=current_user.id, ids=valid_ids, wait=wait)
+        if not job.finished:
+            return redirect(url_for('order_bulk_job', job_id=job.id)) # Progress page
+        deleted_count = job.processed
+
+        if job.state == 'failed':
+            flash(f'批量删除时发生错误: {job.message}', 'danger')
+        elif deleted_count > 0:
              flash(f'成功删除 {deleted_count} 条记录。', 'success')
         else:
              # This might happen if the records were already deleted between page load and submit
@@ -185,40 +392,96 @@ def batch_delete_orders():
     except Exception as e:
         db.session.rollback() # Rollback transaction on error
         flash(f'批量删除时发生错误: {e}', 'danger')
-        app.logger.error(f"Batch delete error for IDs {valid_ids}: {e}")
+        current_app.logger.error(f"Batch delete error for IDs {valid_ids}: {e}")
 
     return redirect(url_for('index')) # Redirect back to the main list page
 
+# --- Archive tier ---
+@route('/orders/archive', methods=['POST'])
+@login_required
+def archive_orders():
+    """Moves old/expired orders into the archive table in chunks, as a background job."""
+    try:
+        job = bulk_jobs.enqueue('archive', user_id=current_user.id)
+        return redirect(url_for('order_bulk_job', job_id=job.id))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'归档时发生错误: {e}', 'danger')
+        current_app.logger.error(f"Archive enqueue error: {e}")
+    return redirect(url_for('index'))
+
+@route('/orders/jobs/<int:job_id>')
+@login_required
+def order_bulk_job(job_id):
+    """Shows the progress of a chunked delete/archive job."""
+    job = OrderBulkJob.query.get_or_404(job_id)
+    return render_template('order_bulk_job.html', title=f'批量任务 #{job.id}', job=job)
+
+@route('/orders/jobs/<int:job_id>/status')
+@login_required
+def order_bulk_job_status(job_id):
+    """Returns a delete/archive job's progress as JSON (polled by order_bulk_job.html)."""
+    job = OrderBulkJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@click.command('archive-orders')
+@with_appcontext
+def archive_orders_command():
+    """Archives old/expired orders (for cron): flask --app app archive-orders"""
+    upgrade_schema() # Also works on a database the web app has not started against yet
+    job = bulk_jobs.enqueue('archive', wait=True)
+    print(f"Archive job #{job.id} {job.state}: {job.processed} orders archived. {job.message or ''}")
+
+@click.command('expire-orders')
+@with_appcontext
+def expire_orders_command():
+    """Marks every order past its expires_at as 已过期 (for cron, or with EXPIRY_SWEEP_INTERVAL=0)."""
+    upgrade_schema(); backfill_expiry()
+    print(f"{expiry_sweeper.sweep()} orders marked as expired.")
+
+@click.command('rebuild-row-keys')
+@with_appcontext
+def rebuild_row_keys_command():
+    """Recomputes every order's natural-key hash (run after changing UPLOAD_DEDUP_KEY)."""
+    upgrade_schema()
+    print(f"Updated the row key of {rebuild_row_keys(only_missing=False)} orders.")
+
 # --- User Authentication Routes (Unchanged) ---
-@app.route('/register', methods=['GET', 'POST'])
+@route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated: return redirect(url_for('index'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User(username=form.username.data, avatar='default_avatar.png'); user.set_password(form.password.data)
+        user = User(username=form.username.data, avatar='default_avatar.png')
+        try: user.set_password(form.password.data) # Runs on the bounded hashing pool
+        except HashingBusy as e: flash(str(e), 'warning'); return render_template('register.html', title='注册', form=form)
         db.session.add(user)
         try: db.session.commit(); flash('恭喜，您已成功注册！现在可以登录了。', 'success'); return redirect(url_for('login'))
-        except Exception as e: db.session.rollback(); flash(f'注册时出错: {e}', 'danger'); app.logger.error(f"Registration error: {e}")
+        except Exception as e: db.session.rollback(); flash(f'注册时出错: {e}', 'danger'); current_app.logger.error(f"Registration error: {e}")
     return render_template('register.html', title='注册', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated: return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data): flash('无效的用户名或密码。', 'danger'); return redirect(url_for('login'))
+        try:
+            if user is None or not user.check_password(form.password.data): flash('无效的用户名或密码。', 'danger'); return redirect(url_for('login'))
+            if user.password_needs_rehash(): # PASSWORD_HASH_METHOD changed: upgrade the stored hash transparently
+                user.set_password(form.password.data); db.session.commit(); user_cache.invalidate(user.id)
+        except HashingBusy as e: flash(str(e), 'warning'); return render_template('login.html', title='登录', form=form)
         login_user(user, remember=form.remember_me.data); flash(f'欢迎回来, {user.username}!', 'success')
         next_page = request.args.get('next');
         if not next_page or not next_page.startswith('/'): next_page = url_for('index')
         return redirect(next_page)
     return render_template('login.html', title='登录', form=form)
 
-@app.route('/logout')
+@route('/logout')
 @login_required
 def logout(): logout_user(); flash('您已成功登出。', 'info'); return redirect(url_for('login'))
 
-@app.route('/profile', methods=['GET', 'POST'])
+@route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
     form = ProfileUpdateForm(current_user.username)
@@ -226,123 +489,80 @@ def profile():
         updated = False
         if form.username.data != current_user.username: current_user.username = form.username.data; flash('用户名已更新。', 'success'); updated = True
         if form.current_password.data and form.new_password.data:
-            if current_user.check_password(form.current_password.data): current_user.set_password(form.new_password.data); flash('密码已成功修改。', 'success'); updated = True
-            else: flash('当前密码不正确，密码未修改。', 'danger'); db.session.rollback(); avatar_url = url_for('static', filename=f'uploads/avatars/{current_user.avatar}'); return render_template('profile.html', title='个人资料', form=form, avatar_url=avatar_url)
+            try:
+                password_ok = current_user.check_password(form.current_password.data)
+                if password_ok: current_user.set_password(form.new_password.data)
+            except HashingBusy as e: flash(str(e), 'warning'); db.session.rollback(); return redirect(url_for('profile'))
+            if password_ok: flash('密码已成功修改。', 'success'); updated = True
+            else: flash('当前密码不正确，密码未修改。', 'danger'); db.session.rollback(); return render_template('profile.html', title='个人资料', form=form)
         if form.avatar.data:
             file = form.avatar.data
-            if file and allowed_file(file.filename, app.config['ALLOWED_EXTENSIONS_AVATAR']):
-                _, f_ext = os.path.splitext(file.filename); filename = secure_filename(f"{current_user.id}_{int(datetime.utcnow().timestamp())}{f_ext}"); filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if current_user.avatar and current_user.avatar != 'default_avatar.png':
-                     old_avatar_path = os.path.join(app.config['UPLOAD_FOLDER'], current_user.avatar)
-                     if os.path.exists(old_avatar_path):
-                         try: os.remove(old_avatar_path)
-                         except OSError as e: app.logger.error(f"Error removing old avatar {old_avatar_path}: {e}")
-                try: file.save(filepath); current_user.avatar = filename; flash('头像已更新。', 'success'); updated = True
-                except Exception as e: flash(f'保存头像时出错: {e}', 'danger'); app.logger.error(f"Avatar save error: {e}")
+            if file and allowed_file(file.filename, current_app.config['ALLOWED_EXTENSIONS_AVATAR']):
+                # Resize/re-encode into content-addressed thumbnails (avatars.py); the original is not kept
+                try: digest = process_avatar(file, current_app.config)
+                except AvatarError as e: flash(str(e), 'warning'); digest = None
+                except Exception as e: flash(f'保存头像时出错: {e}', 'danger'); current_app.logger.error(f"Avatar save error: {e}"); digest = None
+                if digest:
+                    # Legacy (pre-thumbnail) files belong to one user and can go; thumbnails may be shared, so they stay
+                    if current_user.avatar and current_user.avatar != 'default_avatar.png' and not is_content_hash(current_user.avatar):
+                         old_avatar_path = os.path.join(current_app.config['UPLOAD_FOLDER'], secure_filename(current_user.avatar))
+                         if os.path.exists(old_avatar_path):
+                             try: os.remove(old_avatar_path)
+                             except OSError as e: current_app.logger.error(f"Error removing old avatar {old_avatar_path}: {e}")
+                    current_user.avatar = digest; flash('头像已更新。', 'success'); updated = True
             elif file.filename != '': flash('无效的头像文件格式。只允许 png, jpg, jpeg, gif。', 'warning')
         if updated:
-            try: db.session.commit()
-            except Exception as e: db.session.rollback(); flash(f'更新个人资料时出错: {e}', 'danger'); app.logger.error(f"Profile update commit error: {e}")
+            try: db.session.commit(); user_cache.invalidate(current_user.id) # Drop the cached copy with the old username/avatar
+            except Exception as e: db.session.rollback(); flash(f'更新个人资料时出错: {e}', 'danger'); current_app.logger.error(f"Profile update commit error: {e}")
         return redirect(url_for('profile'))
     elif request.method == 'GET': form.username.data = current_user.username
-    avatar_url = url_for('static', filename=f'uploads/avatars/{current_user.avatar}')
-    return render_template('profile.html', title='个人资料', form=form, avatar_url=avatar_url)
+    return render_template('profile.html', title='个人资料', form=form)
 
 # --- Data Management Routes (Upload/Edit remain the same) ---
-@app.route('/upload', methods=['GET', 'POST'])
+@route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
-    """Handles the upload and processing of Excel files."""
+    """Accepts one or more Excel files and queues them as a background upload job."""
     form = ExcelUploadForm()
     if form.validate_on_submit():
-        file = form.excel_file.data
-        if file and allowed_file(file.filename, app.config['ALLOWED_EXTENSIONS_EXCEL']):
+        files = [f for f in form.excel_files.data if f and f.filename]
+        if files and all(allowed_file(f.filename, current_app.config['ALLOWED_EXTENSIONS_EXCEL']) for f in files):
             try:
-                # Define expected Excel columns and their corresponding model attributes
-                expected_columns = {
-                    '供应商名称': 'supplier_name', '客户名称': 'customer_name',
-                    '金额': 'amount', '发放时间': 'issue_time', '电话': 'phone'
-                }
-                df = pd.read_excel(file, engine='openpyxl') # Read the Excel file
-
-                # Rename columns found in the DataFrame according to the mapping
-                rename_map = {k: v for k, v in expected_columns.items() if k in df.columns}
-                df.rename(columns=rename_map, inplace=True)
-
-                # Initialize counters and lists for processing results
-                processed_count = 0; skipped_count = 0; errors = []; new_orders = []
-
-                # Check if essential columns are present after renaming
-                required_cols_present = all(col in df.columns for col in ['customer_name', 'amount', 'phone'])
-                if not required_cols_present:
-                     flash('上传的文件缺少必要的列 (客户名称, 金额, 电话)。请检查文件标题行。', 'danger')
-                     return render_template('upload.html', title='上传 Excel 文件', form=form)
-
-                # Process each row in the DataFrame
-                for index, row in df.iterrows():
-                    row_num = index + 2 # For user-friendly error messages (Excel rows are 1-based, plus header)
-
-                    # Validate essential data presence for the current row
-                    if not all(pd.notna(row.get(col)) for col in ['customer_name', 'amount', 'phone']):
-                        errors.append(f"第 {row_num} 行：缺少必要数据 (客户名称, 金额, 电话)，已跳过。"); skipped_count += 1; continue
-
-                    # Parse '发放时间', default to now() if invalid or missing
-                    issue_time_val = row.get('issue_time'); issue_time_dt = datetime.utcnow()
-                    try:
-                        parsed_dt = pd.to_datetime(issue_time_val) # Pandas handles many formats
-                        if not pd.isna(parsed_dt): issue_time_dt = parsed_dt # Use parsed date if valid
-                        else: raise ValueError("Parsed date is NaT") # Treat NaT as invalid
-                    except (ValueError, TypeError, Exception):
-                        # Warn only if a value was present but couldn't be parsed
-                        if issue_time_val is not None: errors.append(f"第 {row_num} 行：发放时间 '{issue_time_val}' 无效或格式错误，已使用当前时间。")
-
-                    # Attempt to create the Order object
-                    try:
-                        new_order = Order(
-                            order_id=generate_order_id(),
-                            supplier_name=str(row.get('supplier_name', '')).strip(), # Handle optional supplier
-                            customer_name=str(row['customer_name']).strip(),
-                            amount=float(row['amount']), # Ensure amount is float
-                            issue_time=issue_time_dt,
-                            phone=str(row['phone']).strip(), # Ensure phone is string
-                            coupon_code=generate_coupon_code(),
-                            validity_months=12, # Fixed validity
-                            status='已激活' # Fixed status
-                        )
-                        new_orders.append(new_order) # Add to batch list
-                        processed_count += 1
-                    # Handle potential data type errors during object creation
-                    except (ValueError, TypeError) as data_err:
-                        errors.append(f"第 {row_num} 行：数据类型转换错误 (例如金额或电话)，已跳过。错误: {data_err}"); skipped_count += 1; continue
-                    # Catch any other unexpected errors for the row
-                    except Exception as e:
-                        errors.append(f"第 {row_num} 行：创建记录时发生未知错误，已跳过。错误: {e}"); skipped_count += 1; continue
-
-                # Commit all successfully created orders in one transaction
-                if new_orders:
-                    db.session.add_all(new_orders)
-                    db.session.commit()
-
-                # Provide summary feedback
-                flash(f'文件处理完成。成功添加 {processed_count} 条记录。跳过 {skipped_count} 条记录。', 'success')
-                # Show specific row-level warnings/errors
-                for error in errors: flash(error, 'warning')
-
-                return redirect(url_for('index')) # Go back to the main list
-
-            # Catch major errors during file reading or processing
+                # Save the files and hand them to the worker pool; the report is persisted on the job.
+                # Files identical to an earlier successful import are rejected without being parsed.
+                job, duplicates = upload_jobs.enqueue(files, user_id=current_user.id, all_sheets=form.all_sheets.data,
+                                                      allow_duplicates=form.allow_duplicate_files.data)
+                for filename, earlier_job_id in duplicates:
+                    flash(f'文件 {filename} 与之前已导入的文件完全相同' + (f' (上传任务 #{earlier_job_id})' if earlier_job_id else '') + '，已忽略。', 'warning')
+                if job is not None: return redirect(url_for('upload_job', job_id=job.id))
+                return redirect(url_for('upload'))
             except Exception as e:
-                db.session.rollback() # Rollback any partial changes
-                flash(f'处理 Excel 文件时发生严重错误: {e}', 'danger')
-                app.logger.error(f"Excel processing error: {e}") # Log detailed error
+                db.session.rollback()
+                flash(f'保存上传文件时发生错误: {e}', 'danger')
+                current_app.logger.error(f"Upload enqueue error: {e}")
         else:
             # This case should be rare due to WTForms validation but serves as a safeguard
             flash('无效的文件类型或未选择文件。请上传 .xlsx 或 .xls 文件。', 'warning')
 
-    # Render the upload page template
-    return render_template('upload.html', title='上传 Excel 文件', form=form)
+    # Render the upload page template with the most recent jobs
+    recent_jobs = UploadJob.query.order_by(UploadJob.created_at.desc()).limit(20).all()
+    return render_template('upload.html', title='上传 Excel 文件', form=form, recent_jobs=recent_jobs)
+
+@route('/upload/jobs/<int:job_id>')
+@login_required
+def upload_job(job_id):
+    """Shows the progress page / persisted report of an upload job."""
+    job = UploadJob.query.get_or_404(job_id)
+    return render_template('upload_job.html', title=f'上传任务 #{job.id}', job=job)
+
+@route('/upload/jobs/<int:job_id>/status')
+@login_required
+def upload_job_status(job_id):
+    """Returns an upload job's progress as JSON (polled by upload_job.html)."""
+    job = UploadJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
 
-@app.route('/order/edit/<int:order_id>', methods=['GET', 'POST'])
+@route('/order/edit/<int:order_id>', methods=['GET', 'POST'])
 @login_required
 def edit_order(order_id):
     """Displays and handles editing of a specific order."""
@@ -356,38 +576,69 @@ def edit_order(order_id):
         order.phone = form.phone.data.strip()
         # Add other fields here if they become editable
         try:
+            DataVersion.bump('order')
             db.session.commit() # Save changes
+            orders_changed.send(current_app._get_current_object())
             flash(f'订单 {order.order_id} 已成功更新！', 'success')
             return redirect(url_for('index')) # Redirect to main list
         except Exception as e:
             db.session.rollback()
             flash(f'更新订单时出错: {e}', 'danger')
-            app.logger.error(f"Error updating order {order_id}: {e}")
+            current_app.logger.error(f"Error updating order {order_id}: {e}")
 
     # Get masked values for display reference in the template
     masked_phone = order.masked_phone; masked_coupon = order.masked_coupon_code
     return render_template('edit_order.html', title=f'编辑订单 {order.order_id}', form=form, order=order,
                            masked_phone=masked_phone, masked_coupon=masked_coupon)
 
-# --- Static file serving (for avatars - Unchanged) ---
-@app.route('/static/uploads/avatars/<path:filename>')
+# --- Static file serving (for avatars) ---
+@route('/avatars/<digest>-<int:size>.<ext>')
+def avatar_thumbnail(digest, size, ext):
+    """Serves a content-addressed avatar thumbnail: the URL never changes content, so it is cached forever."""
+    if not is_content_hash(digest) or size not in current_app.config['AVATAR_SIZES'] or ext not in AVATAR_FORMATS: abort(404)
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], thumbnail_name(digest, size, ext),
+                                   mimetype=AVATAR_FORMATS[ext][1], etag=f'{digest}-{size}.{ext}',
+                                   max_age=AVATAR_CACHE_SECONDS, conditional=True) # 304 on If-None-Match
+    response.cache_control.public = True; response.cache_control.immutable = True
+    return response
+
+@route('/static/uploads/avatars/<path:filename>')
 def uploaded_avatar(filename):
-    safe_path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-    if not safe_path.startswith(os.path.abspath(app.config['UPLOAD_FOLDER'])): abort(404)
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Legacy avatars (original uploads from before the thumbnail pipeline)."""
+    safe_path = os.path.abspath(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
+    if not safe_path.startswith(os.path.abspath(current_app.config['UPLOAD_FOLDER'])): abort(404)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, max_age=3600) # Revalidated with ETag after an hour
 
-# --- Database Initialization (Unchanged) ---
+# --- Database Initialization ---
 def initialize_database():
-     with app.app_context():
-         db.create_all()
-         if not User.query.first():
-             try:
-                 default_user = User(username='admin', avatar='default_avatar.png'); default_user.set_password('password') # CHANGE THIS!
-                 db.session.add(default_user); db.session.commit()
-                 print("*"*60); print("Default user 'admin' with password 'password' created."); print("IMPORTANT: Change the default password immediately via the profile page!"); print("*"*60)
-             except Exception as e: db.session.rollback(); print(f"Error creating default user: {e}"); app.logger.error(f"Error creating default user: {e}")
+     """Creates/upgrades the schema, backfills derived columns and creates the default user (needs an app context)."""
+     upgrade_schema() # Creates tables, columns and indexes missing from an existing database
+     rebuild_row_keys(only_missing=True) # Natural-key hashes for rows that predate the row_key column
+     backfill_expiry() # expires_at for rows that predate the column
+     summaries.ensure_summaries() # Supplier/customer totals for a database that predates them
+     ensure_search_index() # FTS5 trigram index for supplier/customer search (SQLite only)
+     if not User.query.first():
+         try:
+             default_user = User(username='admin', avatar='default_avatar.png'); default_user.set_password('password') # CHANGE THIS!
+             db.session.add(default_user); db.session.commit()
+             print("*"*60); print("Default user 'admin' with password 'password' created."); print("IMPORTANT: Change the default password immediately via the profile page!"); print("*"*60)
+         except Exception as e: db.session.rollback(); print(f"Error creating default user: {e}"); current_app.logger.error(f"Error creating default user: {e}")
+
+db_cli = AppGroup('db', help='Database setup.')
+
+@db_cli.command('create')
+def db_create_command():
+    """Creates the database, or upgrades an existing one to the current schema (safe to re-run)."""
+    initialize_database()
+    print("Database is up to date.")
 
 # --- Main Execution Block ---
 if __name__ == '__main__':
-    initialize_database() # Ensure DB and default user exist before starting server
-    app.run(debug=False, host='0.0.0.0', port=5000) # Run development server
+    if len(sys.argv) > 1:
+        # python app.py db create / expire-orders / routes ... (same commands as `flask --app app ...`)
+        FlaskGroup(create_app=create_app).main()
+    else:
+        app = create_app()
+        with app.app_context(): initialize_database() # Development convenience; production runs `db create` once per deploy
+        start_background_tasks(app)
+        app.run(debug=False, host='0.0.0.0', port=5000) # Run development server (production: see wsgi.py / gunicorn.conf.py)
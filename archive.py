@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, literal, or_, select
+
+from models import db, ArchivedOrder, DataVersion, ORDER_FIELD_NAMES, Order
+from summaries import subtract_orders
+
+
+# --- Which orders are cold ---
+
+def archive_condition(config, now=None):
+    """WHERE clause selecting orders to archive: uploaded more than ARCHIVE_AFTER_DAYS ago, or expired.
+
+    Returns None when both criteria are switched off.
+    """
+    now = now or datetime.utcnow()
+    conditions = []
+    if config['ARCHIVE_AFTER_DAYS'] > 0:
+        conditions.append(Order.upload_timestamp < now - timedelta(days=config['ARCHIVE_AFTER_DAYS']))
+    if config['ARCHIVE_EXPIRED']:
+        conditions.append(Order.expires_at < now) # Indexed, see expiry.py
+    return or_(*conditions) if conditions else None
+
+
+# --- One bounded batch each; the caller commits between batches ---
+
+def next_id_batch(batch_size, condition=None):
+    """IDs of the next `batch_size` orders matching `condition` (all orders if None), lowest first."""
+    statement = select(Order.id).order_by(Order.id).limit(batch_size)
+    if condition is not None: statement = statement.where(condition)
+    return list(db.session.execute(statement).scalars())
+
+
+def delete_batch(ids):
+    """Deletes the orders with these IDs (plain DELETE ... WHERE id IN, no session synchronisation)."""
+    if not ids: return 0
+    subtract_orders(Order.id.in_(ids)) # Supplier/customer totals, same transaction
+    deleted = db.session.execute(delete(Order).where(Order.id.in_(ids))).rowcount
+    if deleted: DataVersion.bump('order')
+    return deleted
+
+
+def archive_batch(ids, now=None):
+    """Copies the orders with these IDs into archived_order and deletes them from "order"."""
+    if not ids: return 0
+    columns = [getattr(Order, name) for name in ORDER_FIELD_NAMES]
+    db.session.execute(insert(ArchivedOrder).from_select(
+        ORDER_FIELD_NAMES + ['original_id', 'archived_at'],
+        select(*columns, Order.id, literal(now or datetime.utcnow(), ArchivedOrder.archived_at.type)).where(Order.id.in_(ids))))
+    return delete_batch(ids)
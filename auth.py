@@ -0,0 +1,143 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from metrics import LATENCY_BUCKETS
+from models import db, User
+from page_cache import MemoryBackend
+
+
+# --- Per-process user cache ---
+
+class UserCache:
+    """TTL cache of User rows for Flask-Login's user_loader.
+
+    Holds a detached snapshot of each user; get() merges it into the request's
+    session without a SELECT, so current_user still behaves like a normal ORM
+    object (profile() can modify and commit it). profile() calls invalidate()
+    after changing the username, avatar or password; other workers pick the
+    change up within USER_CACHE_TTL seconds.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0; self.misses = 0
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = MemoryBackend(ttl=app.config['USER_CACHE_TTL'], max_entries=app.config['USER_CACHE_MAX_ENTRIES'])
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        snapshot = self.backend.get(user_id) if self.backend.ttl > 0 else None
+        if snapshot is not None:
+            self.hits += 1
+            return db.session.merge(snapshot, load=False) # No SQL: the snapshot's attributes are trusted
+        self.misses += 1
+        user = db.session.get(User, user_id)
+        if user is not None: self.backend.set(user_id, self._snapshot(user))
+        return user
+
+    @staticmethod
+    def _snapshot(user):
+        snapshot = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+        make_transient_to_detached(snapshot) # Detached object with an identity key, as if loaded and expunged
+        return snapshot
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend),
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None}
+
+
+# --- Password hashing pool ---
+
+class HashingBusy(RuntimeError):
+    """Raised when more password hashes are waiting than PASSWORD_HASH_MAX_PENDING allows."""
+
+
+class PasswordHasher:
+    """Runs password hashing/verification on a small bounded thread pool.
+
+    scrypt and PBKDF2 are deliberately slow and release the GIL while they run,
+    so a pool of PASSWORD_HASH_WORKERS threads caps how many CPU cores a login
+    storm can take without serialising everything. When more than
+    PASSWORD_HASH_MAX_PENDING calls are queued, new ones fail fast with
+    HashingBusy instead of piling up request threads. PASSWORD_HASH_METHOD is
+    the werkzeug method string (KDF and cost); hashes made with another method
+    are upgraded on the next successful login (see needs_rehash()).
+    """
+
+    def __init__(self, app=None):
+        self.method = None
+        self.max_pending = 0
+        self._executor = None
+        self._slots = None
+        self._method_prefix = None
+        self._lock = threading.Lock()
+        self._metrics = {}
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self._executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'], thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        app.extensions['password_hasher'] = self
+
+    def _submit(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self._record(operation, None, None)
+            raise HashingBusy('登录请求过多，请稍后再试。')
+        queued_at = time.perf_counter()
+
+        def timed():
+            started_at = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(operation, time.perf_counter() - started_at, started_at - queued_at)
+        try:
+            return self._executor.submit(timed).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Returns a new hash of `password` using the configured method/cost."""
+        return self._submit('hash', generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._submit('verify', check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if `password_hash` was made with a different KDF or cost than PASSWORD_HASH_METHOD."""
+        if self._method_prefix is None: # Normalised form of the configured method, e.g. 'pbkdf2' -> 'pbkdf2:sha256:1000000'
+            self._method_prefix = self.hash('').split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._method_prefix
+
+    # --- Latency metrics ---
+
+    def _record(self, operation, duration, wait):
+        with self._lock:
+            m = self._metrics.setdefault(operation, {'count': 0, 'rejected': 0, 'seconds_sum': 0.0, 'seconds_max': 0.0,
+                                                     'wait_seconds_sum': 0.0, 'buckets': [0] * len(LATENCY_BUCKETS)})
+            if duration is None:
+                m['rejected'] += 1; return
+            m['count'] += 1; m['seconds_sum'] += duration; m['wait_seconds_sum'] += wait
+            m['seconds_max'] = max(m['seconds_max'], duration)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound: m['buckets'][i] += 1 # Cumulative, like a Prometheus histogram
+
+    def stats(self):
+        """Per-operation ('hash' / 'verify') counts, latency sum/max/histogram and queue wait."""
+        with self._lock:
+            metrics = {op: {**m, 'buckets': dict(zip(LATENCY_BUCKETS, m['buckets']))} for op, m in self._metrics.items()}
+        for m in metrics.values():
+            m['seconds_avg'] = round(m['seconds_sum'] / m['count'], 4) if m['count'] else None
+        return {'method': self.method, 'max_pending': self.max_pending, 'operations': metrics}
@@ -0,0 +1,76 @@
+import hashlib
+import io
+import os
+import re
+
+from flask import url_for
+
+# Thumbnails are stored by the SHA-256 of the uploaded file: <folder>/<aa>/<digest>-<size>.<ext>.
+# The same image uploaded twice (by anyone) is processed and stored once, and a
+# URL never changes its content, so browsers may cache it forever.
+AVATAR_FORMATS = {'webp': ('WEBP', 'image/webp'), 'png': ('PNG', 'image/png')} # WebP + PNG fallback
+DIGEST_LENGTH = 32
+_DIGEST_RE = re.compile(rf'^[0-9a-f]{{{DIGEST_LENGTH}}}$')
+
+
+class AvatarError(ValueError):
+    """The upload is not an image we can (or want to) process; the message is shown to the user."""
+
+
+def is_content_hash(value):
+    """True if a User.avatar value is a content hash (processed avatar) rather than a legacy filename."""
+    return bool(value and _DIGEST_RE.match(value))
+
+
+def thumbnail_name(digest, size, ext):
+    """Path of a thumbnail relative to UPLOAD_FOLDER (as send_from_directory expects it)."""
+    return f'{digest[:2]}/{digest}-{size}.{ext}'
+
+
+def thumbnail_path(folder, digest, size, ext):
+    return os.path.join(folder, *thumbnail_name(digest, size, ext).split('/'))
+
+
+def process_avatar(file_storage, config):
+    """Validates an uploaded image and writes its square thumbnails; returns the content hash.
+
+    Every size in AVATAR_SIZES is written as WebP and PNG. If thumbnails for
+    the same file already exist they are reused without decoding it again.
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError # Imported on first avatar upload, not at app start
+    data = file_storage.stream.read(config['AVATAR_MAX_BYTES'] + 1)
+    if len(data) > config['AVATAR_MAX_BYTES']:
+        raise AvatarError(f"头像文件过大（最大 {config['AVATAR_MAX_BYTES'] // (1024 * 1024)} MB）。")
+    digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+    folder = config['UPLOAD_FOLDER']; sizes = config['AVATAR_SIZES']
+    targets = [(size, ext) for size in sizes for ext in AVATAR_FORMATS]
+    if all(os.path.exists(thumbnail_path(folder, digest, size, ext)) for size, ext in targets):
+        return digest # Deduplicated: identical file processed before
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.width * image.height > config['AVATAR_MAX_PIXELS']:
+            raise AvatarError('头像图片分辨率过大。')
+        image.draft('RGB', (max(sizes) * 2, max(sizes) * 2)) # JPEG: decode at reduced scale, much faster for photos
+        image = ImageOps.exif_transpose(image) # Honour the camera's rotation flag
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB') # First frame only for GIFs
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError):
+        raise AvatarError('无法识别的图片文件。')
+
+    os.makedirs(os.path.dirname(thumbnail_path(folder, digest, 0, 'png')), exist_ok=True)
+    for size in sizes:
+        thumb = ImageOps.fit(image, (size, size), Image.LANCZOS) # Centre-crop to a square, then downscale
+        for ext, (pil_format, _) in AVATAR_FORMATS.items():
+            path = thumbnail_path(folder, digest, size, ext)
+            tmp_path = f'{path}.{os.getpid()}.tmp' # Write + rename: readers never see a half-written file
+            options = {'quality': config['AVATAR_WEBP_QUALITY'], 'method': 4} if pil_format == 'WEBP' else {'optimize': True}
+            thumb.save(tmp_path, pil_format, **options)
+            os.replace(tmp_path, path)
+    return digest
+
+
+def avatar_url(avatar, size, ext='webp'):
+    """URL of a user's avatar at `size` px (Jinja global). Legacy filenames fall back to the original file."""
+    if is_content_hash(avatar):
+        return url_for('avatar_thumbnail', digest=avatar, size=size, ext=ext)
+    return url_for('uploaded_avatar', filename=avatar or 'default_avatar.png')
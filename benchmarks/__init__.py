@@ -0,0 +1,6 @@
+"""Benchmarks for the upload, list/search and delete paths.
+
+    python -m benchmarks.generate --rows 50000 -o orders.xlsx   # synthetic workbook / CSV
+    python -m benchmarks.run --sizes 10000,100000               # timings -> benchmarks/results/*.json
+    python -m benchmarks.compare old.json new.json              # side-by-side comparison of two runs
+"""
@@ -0,0 +1,47 @@
+"""Compares two benchmarks.run result files metric by metric.
+
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+
+Lower is better for times (*_ms, seconds), higher for rows_per_second.
+"""
+import argparse
+import json
+
+HIGHER_IS_BETTER = ('rows_per_second',)
+REPORTED = ('rows_per_second', 'seconds', 'peak_python_bytes', 'p50_ms', 'p95_ms', 'p99_ms', 'ms')
+
+
+def flatten(results):
+    """{'10000 upload.rows_per_second': value, ...} for the metrics worth comparing."""
+    metrics = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items(): walk(f'{prefix}.{key}' if prefix else key, item)
+        elif isinstance(value, (int, float)) and prefix.rsplit('.', 1)[-1] in REPORTED:
+            metrics[prefix] = value
+    walk('startup', {k: v for k, v in (results.get('startup') or {}).items() if k != 'runs'})
+    for level in results.get('sizes', []):
+        # Keyed on the requested size: the exact row count differs a little between runs
+        walk(f"{level['target']:>8}", {k: v for k, v in level.items() if k not in ('target', 'orders')})
+    walk('delete_all', results.get('delete_all', {}))
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('before'); parser.add_argument('after')
+    args = parser.parse_args(argv)
+    with open(args.before, encoding='utf-8') as f: before = flatten(json.load(f))
+    with open(args.after, encoding='utf-8') as f: after = flatten(json.load(f))
+    print(f"{'metric':<60} {'before':>12} {'after':>12} {'change':>9}")
+    for name in sorted(set(before) & set(after)):
+        old, new = before[name], after[name]
+        change = (new - old) / old * 100 if old else 0.0
+        better = change > 0 if name.endswith(HIGHER_IS_BETTER) else change < 0
+        flag = '' if abs(change) < 5 else (' +' if better else ' -') # Mark changes beyond 5% as better (+) / worse (-)
+        print(f'{name:<60} {old:>12.3f} {new:>12.3f} {change:>8.1f}%{flag}')
+
+
+if __name__ == '__main__':
+    main()
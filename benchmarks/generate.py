@@ -0,0 +1,115 @@
+"""Synthetic order workbooks/CSV files with a controllable share of dirty rows.
+
+Rows use the upload headers (供应商名称/客户名称/金额/发放时间/电话). With the same
+--seed the output is identical, so runs can be compared file for file.
+
+    python -m benchmarks.generate --rows 100000 --missing-phone 0.02 --bad-date 0.01 --bad-amount 0.01 -o orders.xlsx
+"""
+import argparse
+import csv
+import random
+from datetime import datetime, timedelta
+
+HEADER = ['供应商名称', '客户名称', '金额', '发放时间', '电话']
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍红鹏飞宇浩然子轩梓涵欣怡晨阳思远嘉琪'
+SUPPLIER_WORDS = ['华联', '永辉', '百盛', '天虹', '大润发', '物美', '苏宁', '国美', '京东', '盒马', '美宜佳', '罗森', '全家', '便利蜂']
+SUPPLIER_SUFFIXES = ['商贸有限公司', '超市', '便利店', '连锁', '贸易公司']
+
+
+class DirtyRatios:
+    """Share of rows (0-1) to corrupt in each way; a row gets at most one defect."""
+
+    def __init__(self, missing_phone=0.0, bad_date=0.0, bad_amount=0.0, missing_supplier=0.0):
+        self.missing_phone = missing_phone; self.bad_date = bad_date
+        self.bad_amount = bad_amount; self.missing_supplier = missing_supplier
+
+    def as_dict(self):
+        return {'missing_phone': self.missing_phone, 'bad_date': self.bad_date,
+                'bad_amount': self.bad_amount, 'missing_supplier': self.missing_supplier}
+
+
+def supplier_names(count=200, seed=0):
+    rng = random.Random(seed)
+    names = {f'{rng.choice(SUPPLIER_WORDS)}{rng.choice(SUPPLIER_SUFFIXES)}{i:03d}' for i in range(count)}
+    return sorted(names)
+
+
+def customer_name(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choices(GIVEN_NAMES, k=rng.choice((1, 2))))
+
+
+def generate_rows(rows, ratios=None, seed=42, suppliers=200, start=datetime(2025, 1, 1)):
+    """Yields `rows` rows (lists in HEADER order); dirty rows are mixed in according to `ratios`."""
+    ratios = ratios or DirtyRatios()
+    rng = random.Random(seed)
+    pool = supplier_names(suppliers, seed)
+    # Cumulative thresholds so each row draws one random number for its defect
+    defects = []; total = 0.0
+    for name, share in ratios.as_dict().items():
+        total += share; defects.append((total, name))
+    for i in range(rows):
+        issue_time = start + timedelta(minutes=rng.randrange(0, 365 * 24 * 60))
+        row = [rng.choice(pool), customer_name(rng), round(rng.uniform(1, 2000), 2),
+               issue_time if i % 2 else issue_time.strftime('%Y-%m-%d %H:%M:%S'), # Real date cells and date strings
+               f'1{rng.choice("3456789")}{rng.randrange(10 ** 8, 10 ** 9)}']
+        roll = rng.random(); defect = next((name for bound, name in defects if roll < bound), None)
+        if defect == 'missing_phone': row[4] = None
+        elif defect == 'bad_date': row[3] = rng.choice(['2025-13-45', '不详', 'N/A'])
+        elif defect == 'bad_amount': row[2] = rng.choice(['abc', '十元', '1,2.3'])
+        elif defect == 'missing_supplier': row[0] = None
+        yield row
+
+
+def write_xlsx(path, rows, sheets=1):
+    """Writes the rows with openpyxl's write-only workbook, split evenly over `sheets` worksheets."""
+    from openpyxl import Workbook
+    rows = list(rows) if sheets > 1 else rows
+    workbook = Workbook(write_only=True)
+    if sheets > 1:
+        per_sheet = -(-len(rows) // sheets)
+        parts = [rows[i:i + per_sheet] for i in range(0, len(rows), per_sheet)]
+    else:
+        parts = [rows]
+    for n, part in enumerate(parts, start=1):
+        sheet = workbook.create_sheet(f'订单{n}')
+        sheet.append(HEADER)
+        for row in part: sheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f: # BOM for Excel, like the CSV export
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for row in rows:
+            writer.writerow(['' if v is None else (v.strftime('%Y-%m-%d %H:%M:%S') if isinstance(v, datetime) else v) for v in row])
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic order workbook or CSV file.')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--format', choices=['xlsx', 'csv'], default=None, help='default: from the output extension')
+    parser.add_argument('--sheets', type=int, default=1, help='worksheets per workbook (xlsx only)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--suppliers', type=int, default=200, help='distinct supplier names')
+    parser.add_argument('--missing-phone', type=float, default=0.0)
+    parser.add_argument('--bad-date', type=float, default=0.0)
+    parser.add_argument('--bad-amount', type=float, default=0.0)
+    parser.add_argument('--missing-supplier', type=float, default=0.0)
+    parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args(argv)
+
+    ratios = DirtyRatios(args.missing_phone, args.bad_date, args.bad_amount, args.missing_supplier)
+    rows = generate_rows(args.rows, ratios, seed=args.seed, suppliers=args.suppliers)
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'xlsx')
+    if fmt == 'csv': write_csv(args.output, rows)
+    else: write_xlsx(args.output, rows, sheets=args.sheets)
+    print(f'Wrote {args.rows} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Times upload, list/search and delete against a throwaway SQLite database.
+
+Grows the order table to each size in --sizes by uploading synthetic workbooks
+through the Flask test client (the same /upload route users hit), then
+measures at that size:
+
+* upload throughput (rows/s) and the Python heap peak of one probe upload,
+* list/search latency percentiles for a fixed set of index()/API requests,
+* the cost of a 100-row batch delete,
+
+and finally the chunked delete-all of the whole table. Before all that it
+times cold starts: a fresh interpreter importing wsgi (module imports +
+create_app()), --startup-runs times. Results are written as JSON
+(benchmarks/results/<timestamp>.json by default) for benchmarks.compare.
+
+    python -m benchmarks.run --sizes 10000,100000,1000000 --repeats 30
+    python -m benchmarks.run --startup-only
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.generate import DirtyRatios, generate_rows, supplier_names, write_xlsx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- Helpers ---
+
+def percentiles(samples):
+    """Summary of latency samples (seconds) in milliseconds."""
+    ordered = sorted(samples)
+
+    def rank(p): # Nearest-rank percentile
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))] * 1000
+    return {'count': len(ordered), 'min_ms': round(ordered[0] * 1000, 3), 'p50_ms': round(rank(50), 3),
+            'p90_ms': round(rank(90), 3), 'p95_ms': round(rank(95), 3), 'p99_ms': round(rank(99), 3),
+            'max_ms': round(ordered[-1] * 1000, 3), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(args, workdir):
+    """Environment for the app under test; must be set before `app` is imported (Config reads it at import)."""
+    os.environ.update({
+        'DATABASE_URL': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'UPLOAD_JOB_WORKERS': '0', # Jobs run inside the request, so the POST returns when the rows are in
+        'UPLOAD_PARSE_PROCESSES': str(args.parse_processes),
+        'BULK_JOB_WORKERS': '0',
+        'BULK_BATCH_PAUSE': str(args.bulk_pause),
+        'ORDER_ID_LENGTH': '8', # The default 4 chars (1.68M keys) would be 60% full at 1M orders
+        'RESULT_CACHE_PATH': os.path.join(workdir, 'result_cache.sqlite3'),
+    })
+    if args.cache == 'none': # Measure the queries themselves, not the caches in front of them
+        os.environ.update({'RESULT_CACHE_BACKEND': 'none', 'COUNT_CACHE_TTL': '0'})
+    else:
+        os.environ['RESULT_CACHE_BACKEND'] = args.cache
+
+
+# Run in a fresh interpreter per sample: what a new worker pays before it can serve its first request
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from wsgi import app
+total = time.perf_counter() - started
+print(json.dumps({'total': total, **app.extensions['startup'],
+                  'heavy_modules': [m for m in ('pandas', 'openpyxl', 'PIL') if m in sys.modules]}))
+'''
+
+
+def startup(runs):
+    """Cold-start percentiles: whole `import wsgi`, module imports and create_app() alone."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {'runs': runs, 'total': percentiles([s['total'] for s in samples]),
+            'import': percentiles([s['import_seconds'] for s in samples]),
+            'create_app': percentiles([s['create_app_seconds'] for s in samples]),
+            'heavy_modules_loaded': samples[-1]['heavy_modules']} # Should stay empty: they load on first use
+
+
+class Bench:
+    def __init__(self, args, workdir):
+        import app as order_app # Imported here: the environment above has to be in place first
+        self.args = args; self.workdir = workdir
+        self.module = order_app; self.app = order_app.create_app()
+        self.app.config['UPLOAD_JOB_FOLDER'] = os.path.join(workdir, 'upload_jobs')
+        os.makedirs(self.app.config['UPLOAD_JOB_FOLDER'], exist_ok=True)
+        with self.app.app_context(): order_app.initialize_database()
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'admin', 'password': 'password'})
+        self.ratios = DirtyRatios(args.missing_phone, args.bad_date, args.bad_amount, args.missing_supplier)
+        self.files_uploaded = 0
+
+    def order_count(self):
+        with self.app.app_context():
+            return self.module.Order.query.count()
+
+    # --- Upload ---
+
+    def _workbook(self, rows):
+        path = os.path.join(self.workdir, f'upload_{self.files_uploaded}.xlsx')
+        write_xlsx(path, generate_rows(rows, self.ratios, seed=self.args.seed + self.files_uploaded))
+        self.files_uploaded += 1
+        return path
+
+    def _upload(self, path):
+        with open(path, 'rb') as f:
+            started = time.perf_counter()
+            response = self.client.post('/upload', data={'excel_files': [(f, os.path.basename(path))]},
+                                        content_type='multipart/form-data')
+            elapsed = time.perf_counter() - started
+        os.remove(path)
+        if response.status_code != 302: raise RuntimeError(f'upload failed with HTTP {response.status_code}')
+        with self.app.app_context():
+            job = self.module.UploadJob.query.order_by(self.module.UploadJob.id.desc()).first()
+            if job.state != 'done': raise RuntimeError(f'upload job failed: {job.message}')
+            return elapsed, job.rows_processed, job.rows_skipped
+
+    def grow_to(self, target):
+        """Uploads workbooks until the table holds `target` orders; returns the upload measurements."""
+        result = {'files': 0, 'rows_inserted': 0, 'rows_skipped': 0, 'seconds': 0.0}
+        # Probe: one small upload under tracemalloc for the Python heap peak (kept out of the throughput figure)
+        probe_rows = min(self.args.memory_probe_rows, max(target - self.order_count(), 0))
+        if probe_rows:
+            path = self._workbook(probe_rows)
+            tracemalloc.start()
+            try:
+                _, inserted, _ = self._upload(path)
+                result['memory_probe'] = {'rows': probe_rows, 'peak_python_bytes': tracemalloc.get_traced_memory()[1]}
+            finally:
+                tracemalloc.stop()
+        while (missing := target - self.order_count()) > 0:
+            # Oversize the file a little to make up for the rows the validator will skip
+            rows = min(self.args.workbook_rows, int(missing * 1.05) + 10)
+            path = self._workbook(rows)
+            elapsed, inserted, skipped = self._upload(path)
+            result['files'] += 1; result['rows_inserted'] += inserted; result['rows_skipped'] += skipped
+            result['seconds'] += elapsed
+        submitted = result['rows_inserted'] + result['rows_skipped']
+        result['rows_per_second'] = round(submitted / result['seconds'], 1) if result['seconds'] else None
+        result['seconds'] = round(result['seconds'], 3)
+        try:
+            import resource # POSIX only
+            scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is bytes on macOS, KiB on Linux
+            result['process_peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        except ImportError:
+            pass
+        return result
+
+    # --- List / search latency ---
+
+    def scenarios(self):
+        """The requests timed at every size: (name, url)."""
+        rng = random.Random(self.args.seed)
+        suppliers = supplier_names(200, self.args.seed)
+        with self.app.app_context():
+            customers = [name for (name,) in self.module.db.session.query(self.module.Order.customer_name).limit(50)]
+        first = self.client.get('/').get_data(as_text=True)
+        match = re.search(r'href="([^"]+cursor=[^"]+)" aria-label="下一页"', first)
+        deep = match.group(1).replace('&amp;', '&') if match else '/?page=2'
+        return [
+            ('list_first_page', '/'),
+            ('list_next_page', deep),
+            ('list_first_page_500_rows', '/?per_page=500'),
+            ('search_supplier_exact', f'/?supplier_query={rng.choice(suppliers)}'),
+            ('search_supplier_partial', '/?supplier_query=华联'),
+            ('search_customers', '/?customer_query=' + '+'.join(rng.sample(customers, min(3, len(customers))))),
+            ('search_short_term', '/?customer_query=王'), # 1 char: ILIKE path, no trigram index
+            ('search_supplier_and_customer', f'/?supplier_query=超市&customer_query={customers[0] if customers else "王"}'),
+            ('api_list', '/api/orders?limit=100'),
+        ]
+
+    def latency(self):
+        results = {}
+        for name, url in self.scenarios():
+            self.client.get(url) # Warm-up (templates, statement cache, page cache of the DB file)
+            samples = []
+            for _ in range(self.args.repeats):
+                started = time.perf_counter()
+                response = self.client.get(url)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200: raise RuntimeError(f'{url} returned HTTP {response.status_code}')
+            results[name] = {'url': url, **percentiles(samples)}
+        return results
+
+    # --- Deletes ---
+
+    def batch_delete(self, rows=100):
+        with self.app.app_context():
+            ids = [i for (i,) in self.module.db.session.query(self.module.Order.id).order_by(self.module.Order.id.desc()).limit(rows)]
+        started = time.perf_counter()
+        self.client.post('/orders/batch_delete', data={'order_ids': [str(i) for i in ids]})
+        return {'rows': len(ids), 'ms': round((time.perf_counter() - started) * 1000, 3)}
+
+    def delete_all(self):
+        rows = self.order_count()
+        started = time.perf_counter()
+        self.client.post('/orders/all_delete')
+        elapsed = time.perf_counter() - started
+        return {'rows': rows, 'seconds': round(elapsed, 3), 'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+                'remaining': self.order_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark upload, list/search and delete on a temporary SQLite DB.')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated order counts to measure at')
+    parser.add_argument('--repeats', type=int, default=30, help='timed requests per list/search scenario')
+    parser.add_argument('--workbook-rows', type=int, default=50000, help='rows per uploaded workbook')
+    parser.add_argument('--memory-probe-rows', type=int, default=10000, help='rows in the tracemalloc probe upload (0 = skip)')
+    parser.add_argument('--parse-processes', type=int, default=0, help='UPLOAD_PARSE_PROCESSES for the app under test')
+    parser.add_argument('--bulk-pause', type=float, default=0.0, help='BULK_BATCH_PAUSE for the app under test')
+    parser.add_argument('--cache', choices=['none', 'memory', 'sqlite'], default='none',
+                        help="result/count caches; 'none' times the queries themselves")
+    parser.add_argument('--startup-runs', type=int, default=10, help='cold starts timed in fresh interpreters (0 = skip)')
+    parser.add_argument('--startup-only', action='store_true', help='only time cold starts (no database is filled)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--missing-phone', type=float, default=0.01)
+    parser.add_argument('--bad-date', type=float, default=0.01)
+    parser.add_argument('--bad-amount', type=float, default=0.01)
+    parser.add_argument('--missing-supplier', type=float, default=0.02)
+    parser.add_argument('--keep', action='store_true', help='keep the temporary database directory')
+    parser.add_argument('-o', '--output', help='result file (default: benchmarks/results/<timestamp>.json)')
+    args = parser.parse_args(argv)
+    sizes = sorted(int(s) for s in args.sizes.split(',') if s.strip())
+
+    workdir = tempfile.mkdtemp(prefix='simple_order_bench_')
+    configure_environment(args, workdir)
+    if REPO_DIR not in sys.path: sys.path.insert(0, REPO_DIR)
+    started_at = datetime.now()
+    levels = []; delete_all = {}; config = {}; startup_result = None
+    try:
+        if args.startup_runs or args.startup_only:
+            print('timing cold starts...', flush=True)
+            startup_result = startup(args.startup_runs or 10)
+            print(f"startup p50 {startup_result['total']['p50_ms']} ms", flush=True)
+        if not args.startup_only: delete_all, config = run_sizes(args, workdir, sizes, levels)
+    finally:
+        if args.keep: print(f'Database kept in {workdir}')
+        else: shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        'meta': {'started_at': started_at.isoformat(timespec='seconds'), 'git_commit': git_commit(),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'sqlite': sqlite3.sqlite_version, 'args': vars(args), 'config': config},
+        'startup': startup_result,
+        'sizes': levels,
+        'delete_all': delete_all,
+    }
+    output = args.output or os.path.join(REPO_DIR, 'benchmarks', 'results', f"{started_at:%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'Results written to {output}')
+    return results
+
+
+def run_sizes(args, workdir, sizes, levels):
+    """Grows the table through each size, appending to `levels`; returns (delete_all result, app config)."""
+    bench = Bench(args, workdir)
+    for size in sizes:
+        print(f'[{size} orders] uploading...', flush=True)
+        upload = bench.grow_to(size)
+        print(f'[{size} orders] {upload["rows_per_second"]} rows/s; timing list/search...', flush=True)
+        levels.append({'target': size, 'orders': bench.order_count(), 'upload': upload, 'latency': bench.latency(),
+                       'batch_delete': bench.batch_delete()})
+    print('delete all...', flush=True)
+    delete_all = bench.delete_all()
+    config = {key: bench.app.config[key] for key in (
+        'DB_ENGINE_PROFILE', 'UPLOAD_CHUNK_SIZE', 'UPLOAD_PARSE_PROCESSES', 'BULK_BATCH_SIZE', 'BULK_BATCH_PAUSE',
+        'RESULT_CACHE_BACKEND', 'COUNT_CACHE_TTL', 'SMALL_RESULT_SET_ROWS', 'ORDER_ID_LENGTH')}
+    return delete_all, config
+
+
+if __name__ == '__main__':
+    main()
@@ -19,12 +19,84 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'points.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False # Disable modification tracking to save resources
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL') # Optional replica for list/search/export; defaults to DATABASE_URL
+
+    # Engine profile (see db_engine.py): 'production' = WAL + PRAGMAs + pooled connections
+    # for SQLite, tuned pool for PostgreSQL; 'basic' = SQLAlchemy defaults.
+    DB_ENGINE_PROFILE = os.environ.get('DB_ENGINE_PROFILE', 'production')
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') == '1' # Server databases only
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800)) # Seconds; server databases only
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+
+    # Authentication (see auth.py)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60)) # Seconds a loaded user is reused by load_user(); 0 = no cache
+    USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 1024))
+    # werkzeug method string = KDF + cost, e.g. 'scrypt:32768:8:1' (werkzeug's default) or 'pbkdf2:sha256:600000'.
+    # Changing it upgrades existing hashes on each user's next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2)) # Hashes computed at the same time (CPU cores used)
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 32)) # Beyond this, logins fail fast with "try again"
 
     # File upload configuration
     UPLOAD_FOLDER = os.path.join(basedir, 'static/uploads/avatars')
     ALLOWED_EXTENSIONS_EXCEL = {'xlsx', 'xls'}
     ALLOWED_EXTENSIONS_AVATAR = {'png', 'jpg', 'jpeg', 'gif'}
+    AVATAR_SIZES = (32, 64, 256) # Square thumbnail sizes (px) generated for each avatar, as WebP + PNG
+    AVATAR_MAX_BYTES = 5 * 1024 * 1024 # Avatar uploads above this are rejected (MAX_CONTENT_LENGTH is sized for Excel)
+    AVATAR_MAX_PIXELS = 40_000_000 # Refuse to decode images larger than this (decompression bombs)
+    AVATAR_WEBP_QUALITY = 85
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024 # 16 MB max upload size (adjust as needed)
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1000)) # Excel rows validated and committed per transaction
+    # Re-upload handling (see dedup.py). MODE: 'skip' rows whose natural key already exists, 'upsert' = also
+    # update their non-key columns (only meaningful if the key leaves some out), 'off' = insert everything.
+    # After changing the key, run `flask rebuild-row-keys`.
+    UPLOAD_DEDUP_MODE = os.environ.get('UPLOAD_DEDUP_MODE', 'skip')
+    UPLOAD_DEDUP_KEY = os.environ.get('UPLOAD_DEDUP_KEY', 'supplier_name,customer_name,phone,amount,issue_time').split(',')
+    UPLOAD_JOB_FOLDER = os.path.join(basedir, 'instance/upload_jobs') # Queued Excel files wait here until processed
+    UPLOAD_JOB_WORKERS = int(os.environ.get('UPLOAD_JOB_WORKERS', 2)) # Background import threads; 0 = process inline in the request
+    UPLOAD_PARSE_PROCESSES = int(os.environ.get('UPLOAD_PARSE_PROCESSES', os.cpu_count() or 1)) # Sheet parsing processes; 0 = parse in the job thread
+
+    # Unique key allocation (see keygen.py). MODE is 'random' or 'sequence'.
+    # The default NMCF + 4 chars only has 36^4 ~ 1.68M order IDs; raise the length as the table grows.
+    ORDER_ID_PREFIX = 'NMCF'
+    ORDER_ID_LENGTH = int(os.environ.get('ORDER_ID_LENGTH', 4)) # Max 12 (order_id column is 16 chars)
+    ORDER_ID_MODE = os.environ.get('ORDER_ID_MODE', 'random')
+    COUPON_CODE_PREFIX = 'CX'
+    COUPON_CODE_LENGTH = int(os.environ.get('COUPON_CODE_LENGTH', 7)) # Max 13 (coupon_code column is 15 chars)
+    COUPON_CODE_MODE = 'random' # Keep coupon codes unguessable
+    KEY_SPACE_WARN_RATIO = 0.5 # Log a warning once a key space is this full
 
-    # Ensure the upload folder exists
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
\ No newline at end of file
+    # Order list pagination
+    ORDER_LIST_PER_PAGE = int(os.environ.get('ORDER_LIST_PER_PAGE', 10)) # Rows per page unless ?per_page= asks for another size
+    ORDER_LIST_MAX_PER_PAGE = int(os.environ.get('ORDER_LIST_MAX_PER_PAGE', 500))
+    SMALL_RESULT_SET_ROWS = int(os.environ.get('SMALL_RESULT_SET_ROWS', 500)) # Up to this many rows: numbered pages; above: cursor (keyset) pages
+    COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 30)) # Seconds a cached "total records" count stays valid
+    # Order list/search result cache (see page_cache.py). BACKEND: 'memory' (per worker),
+    # 'sqlite' (memory + a cache file shared by all workers on this host) or 'none'.
+    RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 300)) # Seconds; writes invalidate entries immediately anyway
+    RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', 512)) # Per-worker LRU size
+    RESULT_CACHE_SHARED_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_SHARED_MAX_ENTRIES', 10000))
+    RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH') or os.path.join(basedir, 'instance/result_cache.sqlite3')
+    RESULT_CACHE_FRAGMENTS = os.environ.get('RESULT_CACHE_FRAGMENTS', '1') == '1' # Also keep the rendered table HTML
+    # Bulk writes on the order table (see jobs.OrderBulkJobRunner / archive.py)
+    BULK_JOB_WORKERS = int(os.environ.get('BULK_JOB_WORKERS', 1)) # 1 = one background thread runs bulk jobs in turn; 0 = inline
+    BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 1000)) # Rows deleted/archived per transaction
+    BULK_BATCH_PAUSE = float(os.environ.get('BULK_BATCH_PAUSE', 0.05)) # Seconds between chunks, so other writers get the lock
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365)) # Archive orders uploaded longer ago than this; 0 = never by age
+    ARCHIVE_EXPIRED = os.environ.get('ARCHIVE_EXPIRED', '1') == '1' # Also archive orders past issue_time + validity_months
+    # Instrumentation (see metrics.py): per-process metrics at /metrics in the Prometheus text format
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # If set, scrapers must send "Authorization: Bearer <token>"
+    METRICS_SLOW_REQUEST_MS = int(os.environ.get('METRICS_SLOW_REQUEST_MS', 1000)) # Log slower requests with their SQL; 0 = off
+    # Coupon expiry (see expiry.py): a background thread marks orders past expires_at as 已过期
+    EXPIRY_SWEEP_INTERVAL = int(os.environ.get('EXPIRY_SWEEP_INTERVAL', 3600)) # Seconds between sweeps; 0 = only `flask expire-orders`
+    EXPIRY_SWEEP_BATCH = int(os.environ.get('EXPIRY_SWEEP_BATCH', 1000)) # Orders flipped per transaction
+    EXPIRING_SOON_DAYS = int(os.environ.get('EXPIRING_SOON_DAYS', 30)) # Window of the "即将过期" list filter
+    API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 1000)) # Max orders per bulk create/update/delete request on /api/orders
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000)) # Rows fetched from the DB per batch when exporting
+    # Folders (UPLOAD_FOLDER, UPLOAD_JOB_FOLDER) are created by create_app(), not when this module is imported
\ No newline at end of file
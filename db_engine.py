@@ -0,0 +1,90 @@
+from flask import current_app, g
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from models import db
+
+
+# --- Engine profiles ---
+
+def _sqlite_pragmas(config):
+    """PRAGMAs run on every new SQLite connection under the 'production' profile."""
+    return {
+        'journal_mode': 'WAL', # Readers no longer block behind an upload's write transaction
+        'synchronous': 'NORMAL', # Safe with WAL, far fewer fsyncs than FULL
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT_MS'], # Wait for the write lock instead of "database is locked"
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        'cache_size': -config['SQLITE_CACHE_SIZE_KB'], # Negative = KiB
+        'temp_store': 'MEMORY',
+    }
+
+
+def engine_options(uri, config):
+    """Returns create_engine() keyword arguments for `uri` under DB_ENGINE_PROFILE."""
+    if config['DB_ENGINE_PROFILE'] != 'production': return {}
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'): return {} # In-memory DBs can't share a pool
+        return {'poolclass': QueuePool, 'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW'],
+                'connect_args': {'check_same_thread': False, 'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000}}
+    # PostgreSQL (and other server databases): tunable pool with liveness checks
+    return {'pool_size': config['DB_POOL_SIZE'], 'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_recycle': config['DB_POOL_RECYCLE']}
+
+
+def _install_connect_hooks(engine, config, read_only=False):
+    """Applies the profile's per-connection settings (SQLite PRAGMAs, read-only mode) on connect."""
+    backend = engine.url.get_backend_name()
+    pragmas = _sqlite_pragmas(config) if backend == 'sqlite' and config['DB_ENGINE_PROFILE'] == 'production' else {}
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if backend == 'sqlite':
+                for name, value in pragmas.items(): cursor.execute(f'PRAGMA {name}={value}')
+                if read_only: cursor.execute('PRAGMA query_only=ON')
+            elif backend == 'postgresql' and read_only:
+                cursor.execute('SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY')
+        finally:
+            cursor.close()
+
+
+# --- Application wiring ---
+
+def init_app(app):
+    """Applies the engine profile, initialises Flask-SQLAlchemy and sets up the read-only session.
+
+    db.session stays the write session (upload/edit/delete). read_session()
+    gives list/search/export code a separate pooled, read-only connection, so
+    page views never queue behind a long upload transaction on the write pool.
+    """
+    config = app.config
+    options = engine_options(config['SQLALCHEMY_DATABASE_URI'], config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    db.init_app(app)
+
+    with app.app_context():
+        _install_connect_hooks(db.engine, config)
+        read_uri = config.get('DATABASE_READ_URL') or config['SQLALCHEMY_DATABASE_URI']
+        if make_url(read_uri).database in (None, '', ':memory:'):
+            read_engine = db.engine # A second engine would open a different, empty in-memory DB
+        else:
+            read_engine = create_engine(read_uri, **engine_options(read_uri, config))
+            _install_connect_hooks(read_engine, config, read_only=True)
+    app.extensions['read_engine'] = read_engine
+    app.extensions['read_session_factory'] = sessionmaker(bind=read_engine)
+
+    @app.teardown_appcontext
+    def close_read_session(exc):
+        session = g.pop('read_session', None)
+        if session is not None: session.close()
+
+
+def read_session():
+    """Returns this app context's read-only session (created on first use)."""
+    if 'read_session' not in g:
+        g.read_session = current_app.extensions['read_session_factory']()
+    return g.read_session
@@ -0,0 +1,123 @@
+import hashlib
+from collections.abc import Mapping
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select, update
+
+from expiry import refresh_expiry
+from keygen import IN_CLAUSE_SIZE
+from models import db, ArchivedOrder, Order
+from summaries import add_orders, subtract_orders
+
+# Uploaded columns; UPLOAD_DEDUP_KEY picks the ones that identify an order (its "natural key")
+UPLOAD_FIELDS = ['supplier_name', 'customer_name', 'phone', 'amount', 'issue_time']
+
+
+def key_fields():
+    """The natural-key columns from UPLOAD_DEDUP_KEY (default: every uploaded column)."""
+    return current_app.config['UPLOAD_DEDUP_KEY']
+
+
+def _normalise(field, value):
+    if value is None: return ''
+    if field == 'amount': return f'{float(value):.2f}'
+    if field == 'issue_time': return value.strftime('%Y-%m-%d %H:%M:%S') # datetime or pandas Timestamp; seconds precision
+    return str(value).strip()
+
+
+def row_key(values, fields=None):
+    """SHA-1 of a row's natural-key values (dict or ORM object), as stored in the indexed row_key column."""
+    fields = fields or key_fields()
+    get = values.get if isinstance(values, Mapping) else lambda name: getattr(values, name)
+    return hashlib.sha1('\x1f'.join(_normalise(f, get(f)) for f in fields).encode()).hexdigest()
+
+
+def classify(records, mode):
+    """Splits a chunk of validated upload records into new rows, duplicates and updates.
+
+    Every record gets its row_key. Existing keys are looked up with one IN
+    query per IN_CLAUSE_SIZE keys on each of Order and ArchivedOrder, never
+    per row. A record matching an existing order is a duplicate, unless
+    `mode` is 'upsert' and one of its non-key columns differs, in which case
+    it becomes an update ({'id': ..., column: new value}) of that order.
+    Repeats of a key within the chunk count as duplicates of the first.
+    Returns (new_records, duplicate_count, updates).
+    """
+    fields = key_fields()
+    for record in records: record['row_key'] = row_key(record, fields)
+    if mode == 'off': return records, 0, []
+
+    keys = list({record['row_key'] for record in records})
+    value_fields = [f for f in UPLOAD_FIELDS if f not in fields]
+    existing = {}; archived = set()
+    for i in range(0, len(keys), IN_CLAUSE_SIZE):
+        batch = keys[i:i + IN_CLAUSE_SIZE]
+        columns = [Order.row_key, Order.id] + [getattr(Order, f) for f in value_fields]
+        for row in db.session.execute(select(*columns).where(Order.row_key.in_(batch))):
+            existing.setdefault(row.row_key, row) # Keep the first if older data already holds duplicates
+        archived.update(db.session.execute(select(ArchivedOrder.row_key).where(ArchivedOrder.row_key.in_(batch))).scalars())
+
+    new_records = []; updates = []; duplicates = 0; seen = set()
+    for record in records:
+        key = record['row_key']
+        if key in seen or key in archived:
+            duplicates += 1; continue
+        seen.add(key)
+        current = existing.get(key)
+        if current is None:
+            new_records.append(record); continue
+        # A blank/invalid issue_time keeps the stored one instead of overwriting it with the upload time
+        changed = {f: record[f] for f in value_fields if _normalise(f, record.get(f)) != _normalise(f, getattr(current, f))
+                   and not (f == 'issue_time' and record.get(f) is None)}
+        if mode == 'upsert' and changed: updates.append({'id': current.id, **changed})
+        else: duplicates += 1
+    return new_records, duplicates, updates
+
+
+def apply_updates(updates):
+    """Writes upsert changes as one executemany UPDATE by primary key; the caller bumps DataVersion and commits."""
+    if not updates: return 0
+    changed = Order.id.in_([u['id'] for u in updates])
+    subtract_orders(changed) # Re-count the touched orders in the supplier/customer totals
+    db.session.execute(update(Order), updates)
+    if any('issue_time' in u for u in updates): refresh_expiry(changed)
+    add_orders(changed)
+    return len(updates)
+
+
+def rebuild_row_keys(only_missing=True, batch_size=1000):
+    """(Re)computes row_key on Order and ArchivedOrder in batches of `batch_size`, committing each batch.
+
+    Runs at startup for rows that predate the column (only_missing=True); run
+    `flask rebuild-row-keys` after changing UPLOAD_DEDUP_KEY. Returns the number of rows updated.
+    """
+    fields = key_fields(); total = 0
+    for model in (Order, ArchivedOrder):
+        last_id = 0
+        while True:
+            query = select(model.id, *[getattr(model, f) for f in fields]).where(model.id > last_id)
+            if only_missing: query = query.where(model.row_key.is_(None))
+            rows = db.session.execute(query.order_by(model.id).limit(batch_size)).all()
+            if not rows: break
+            db.session.execute(update(model), [{'id': row.id, 'row_key': row_key(row._mapping, fields)} for row in rows])
+            db.session.commit()
+            total += len(rows); last_id = rows[-1].id
+    return total
+
+
+@event.listens_for(Order, 'before_insert')
+def _set_row_key(mapper, connection, target):
+    """Sets row_key on orders created through the ORM."""
+    if has_app_context(): target.row_key = row_key(target)
+
+
+@event.listens_for(Order, 'before_update')
+def _refresh_row_key(mapper, connection, target):
+    """Keeps row_key in step when a key column is edited through the ORM (edit page, JSON API).
+
+    Edits that leave the key columns alone keep the stored key: it may have
+    been hashed from a blank issue_time that was stored as the upload time.
+    """
+    if has_app_context():
+        state = inspect(target)
+        if any(state.attrs[f].history.has_changes() for f in key_fields()): target.row_key = row_key(target)
@@ -0,0 +1,133 @@
+import calendar
+import threading
+import time
+from datetime import datetime
+
+from flask import has_app_context
+from sqlalchemy import event, select, update
+
+from models import db, ArchivedOrder, DataVersion, Order, orders_changed
+from summaries import ACTIVE_STATUS, EXPIRED_STATUS, add_orders, subtract_orders
+
+
+def add_months(moment, months):
+    """`moment` + `months` calendar months, clamped to the last day of a shorter month (Jan 31 + 1 = Feb 28/29)."""
+    month = moment.month - 1 + months
+    year = moment.year + month // 12; month = month % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
+
+
+def compute_expires_at(issue_time, validity_months):
+    """When a coupon issued at `issue_time` stops being valid (None if either value is missing)."""
+    if issue_time is None or validity_months is None: return None
+    if hasattr(issue_time, 'to_pydatetime'): issue_time = issue_time.to_pydatetime() # pandas Timestamp from an upload
+    return add_months(issue_time, validity_months)
+
+
+@event.listens_for(Order, 'before_insert')
+@event.listens_for(Order, 'before_update')
+def _refresh_expires_at(mapper, connection, target):
+    """Keeps expires_at in step with issue_time / validity_months for ORM inserts and edits."""
+    if has_app_context(): target.expires_at = compute_expires_at(target.issue_time, target.validity_months)
+
+
+def refresh_expiry(condition):
+    """Recomputes expires_at for the orders matching `condition` (Core updates that changed issue_time)."""
+    rows = db.session.execute(select(Order.id, Order.issue_time, Order.validity_months).where(condition)).all()
+    if rows:
+        db.session.execute(update(Order), [{'id': row.id, 'expires_at': compute_expires_at(row.issue_time, row.validity_months)}
+                                           for row in rows])
+
+
+def backfill_expiry(batch_size=1000):
+    """Fills expires_at for rows that predate the column, in id order, committing each batch."""
+    total = 0
+    for model in (Order, ArchivedOrder):
+        last_id = 0
+        while True:
+            rows = db.session.execute(select(model.id, model.issue_time, model.validity_months)
+                                      .where(model.id > last_id, model.expires_at.is_(None)).order_by(model.id).limit(batch_size)).all()
+            if not rows: break
+            db.session.execute(update(model), [{'id': row.id, 'expires_at': compute_expires_at(row.issue_time, row.validity_months)}
+                                               for row in rows])
+            db.session.commit()
+            total += len(rows); last_id = rows[-1].id
+    return total
+
+
+# --- Status sweeper ---
+
+def expire_batch(batch_size, now=None):
+    """Flips up to `batch_size` active orders whose expires_at has passed to 已过期; the caller commits.
+
+    The candidates come from the (status, expires_at) index, so each batch
+    reads only rows that actually change. Returns the number of orders flipped.
+    """
+    now = now or datetime.utcnow()
+    ids = list(db.session.execute(select(Order.id).where(Order.status == ACTIVE_STATUS, Order.expires_at <= now)
+                                  .order_by(Order.expires_at).limit(batch_size)).scalars())
+    if not ids: return 0
+    changed = Order.id.in_(ids)
+    subtract_orders(changed) # Move the rows from the active to the expired count in the summary tables
+    flipped = db.session.execute(update(Order).where(changed, Order.status == ACTIVE_STATUS)
+                                 .values(status=EXPIRED_STATUS).execution_options(synchronize_session=False)).rowcount
+    add_orders(changed)
+    if flipped: DataVersion.bump('order')
+    return flipped
+
+
+class ExpirySweeper:
+    """Periodically marks expired coupons, in bounded batches, on a daemon thread.
+
+    Every EXPIRY_SWEEP_INTERVAL seconds it runs expire_batch() until nothing
+    is left, committing after each EXPIRY_SWEEP_BATCH rows and pausing
+    BULK_BATCH_PAUSE seconds between batches so uploads still get the write
+    lock. Several workers may sweep at once: the UPDATE only touches rows
+    that are still active, so they never double-count. Interval 0 = only
+    via `flask expire-orders`.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_run = None; self.last_expired = 0
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['expiry_sweeper'] = self
+
+    def start(self):
+        if self.app.config['EXPIRY_SWEEP_INTERVAL'] <= 0 or (self._thread and self._thread.is_alive()): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='expiry-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context(): self.sweep()
+            except Exception as e:
+                self.app.logger.error(f"Expiry sweep failed: {e}")
+            self._stop.wait(self.app.config['EXPIRY_SWEEP_INTERVAL'])
+
+    def sweep(self):
+        """Expires every overdue order, one committed batch at a time; returns how many were flipped."""
+        total = 0
+        try:
+            while not self._stop.is_set():
+                flipped = expire_batch(self.app.config['EXPIRY_SWEEP_BATCH'])
+                db.session.commit()
+                if not flipped: break
+                total += flipped
+                orders_changed.send(self.app)
+                time.sleep(self.app.config['BULK_BATCH_PAUSE'])
+        except Exception:
+            db.session.rollback(); raise
+        self.last_run = datetime.utcnow(); self.last_expired = total
+        if total: self.app.logger.info(f"Expiry sweep: {total} orders marked {EXPIRED_STATUS}")
+        return total
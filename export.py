@@ -0,0 +1,104 @@
+import csv
+import io
+import os
+import tempfile
+
+from sqlalchemy import select
+
+from db_engine import read_session
+from models import Order, masked_coupon_code_expression, masked_phone_expression
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+EXPORT_HEADERS = ['订单编号', '供应商名称', '客户名称', '金额', '发放时间', '电话', '券码', '有效期 (月)', '状态']
+EXPORT_COLUMNS = [Order.order_id, Order.supplier_name, Order.customer_name, Order.amount, Order.issue_time,
+                  Order.phone, Order.coupon_code, Order.validity_months, Order.status]
+# Masked exports let the database mask phone / coupon code (see models.masked_phone_expression)
+MASKED_EXPORT_COLUMNS = EXPORT_COLUMNS[:5] + [masked_phone_expression(Order.phone), masked_coupon_code_expression(Order.coupon_code)] + EXPORT_COLUMNS[7:]
+FILE_CHUNK_SIZE = 64 * 1024 # Bytes per yielded piece when streaming a finished XLSX/Parquet file
+
+
+class ExportUnavailable(RuntimeError):
+    """Raised when the requested format needs an optional package that is not installed."""
+
+
+def export_statement(apply_filters, masked=True):
+    """Builds the column-only SELECT for an export; `apply_filters` adds the index() search filters."""
+    statement = apply_filters(select(*(MASKED_EXPORT_COLUMNS if masked else EXPORT_COLUMNS)))
+    return statement.order_by(Order.upload_timestamp.desc(), Order.id.desc())
+
+
+def iter_row_batches(statement, batch_size):
+    """Reads the export rows from the DB in fixed-size batches (server-side cursor / fetchmany)."""
+    result = read_session().execute(statement.execution_options(yield_per=batch_size))
+    for partition in result.partitions(batch_size):
+        yield [tuple(r) for r in partition]
+
+
+def _format_time(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+# --- Format writers: each is a generator of bytes ---
+
+def stream_csv(batches):
+    buffer = io.StringIO(); writer = csv.writer(buffer)
+    buffer.write('\ufeff') # BOM so Excel opens the UTF-8 CSV with the right encoding
+    writer.writerow(EXPORT_HEADERS)
+    for batch in batches:
+        writer.writerows((r[:4] + (_format_time(r[4]),) + r[5:]) for r in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0); buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _stream_file(path):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(FILE_CHUNK_SIZE)
+                if not data: return
+                yield data
+    finally:
+        os.remove(path)
+
+
+def stream_xlsx(batches):
+    """Writes rows through openpyxl's write-only workbook (constant memory), then streams the file."""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('订单')
+    sheet.append(EXPORT_HEADERS)
+    for batch in batches:
+        for row in batch: sheet.append(list(row))
+    fd, path = tempfile.mkstemp(suffix='.xlsx'); os.close(fd)
+    workbook.save(path)
+    yield from _stream_file(path)
+
+
+def stream_parquet(batches):
+    """Writes one Parquet row group per batch (needs the optional pyarrow package), then streams the file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(name, typ) for name, typ in zip(EXPORT_HEADERS, [
+        pa.string(), pa.string(), pa.string(), pa.float64(), pa.timestamp('us'),
+        pa.string(), pa.string(), pa.int32(), pa.string()])])
+    fd, path = tempfile.mkstemp(suffix='.parquet'); os.close(fd)
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_HEADERS, row)) for row in batch], schema=schema))
+    yield from _stream_file(path)
+
+
+def stream_export(fmt, statement, batch_size):
+    """Returns a bytes generator for `fmt`; raises ExportUnavailable if Parquet support is missing."""
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet # noqa: F401
+        except ImportError:
+            raise ExportUnavailable('Parquet 导出需要安装 pyarrow。')
+    writer = {'csv': stream_csv, 'xlsx': stream_xlsx, 'parquet': stream_parquet}[fmt]
+    return writer(iter_row_batches(statement, batch_size))
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed, FileRequired
+from flask_wtf.file import FileField, FileAllowed, FileRequired, MultipleFileField
 from wtforms import StringField, PasswordField, SubmitField, BooleanField, FloatField, DateTimeField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional
 from models import User # Import User model to check uniqueness
@@ -53,10 +53,12 @@ class ProfileUpdateForm(FlaskForm):
             raise ValidationError('请输入当前密码以设置新密码。')
 
 class ExcelUploadForm(FlaskForm):
-    excel_file = FileField('选择 Excel 文件 (.xlsx, .xls)', validators=[
-        FileRequired(message='请选择一个文件！'),
+    excel_files = MultipleFileField('选择 Excel 文件 (.xlsx, .xls，可多选)', validators=[
+        FileRequired(message='请选择至少一个文件！'),
         FileAllowed(['xlsx', 'xls'], '只允许 Excel 文件！')
     ])
+    all_sheets = BooleanField('处理每个工作表 (默认只处理第一个工作表)')
+    allow_duplicate_files = BooleanField('重新导入之前已上传过的相同文件 (已存在的订单行仍会被跳过)')
     submit = SubmitField('上传并处理')
 
 
@@ -0,0 +1,33 @@
+"""Gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+preload_app imports the app (and builds it with create_app()) once in the
+master; workers are forked from it and share those pages copy-on-write, so
+adding a worker costs a fork rather than a full import. Every setting can be
+overridden with the GUNICORN_* environment variables below or on the command line.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) # Request threads per worker (gthread)
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120)) # Exports of large tables stream for a while
+graceful_timeout = 30
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0)) # Recycle workers after N requests; 0 = never
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+
+
+def post_fork(server, worker):
+    """Runs in each new worker: fresh DB connections, then the per-process background work.
+
+    Only the first worker of this master resumes interrupted upload/bulk jobs
+    (a respawned worker must not run them again); every worker runs the
+    已过期 sweep, which is safe to run concurrently.
+    """
+    from app import reset_after_fork, start_background_tasks
+    from wsgi import app
+    reset_after_fork(app)
+    start_background_tasks(app, recover_jobs=worker.age == 1)
@@ -0,0 +1,260 @@
+import math
+import os
+import pickle
+from datetime import datetime
+from itertools import islice
+
+from dedup import apply_updates, classify, row_key
+from expiry import compute_expires_at
+from keygen import generate_coupon_code, generate_order_id
+from metrics import inc
+from summaries import add_records
+from models import db, DataVersion, Order
+
+# Excel header -> Order attribute mapping used by the upload route
+EXPECTED_COLUMNS = {
+    '供应商名称': 'supplier_name', '客户名称': 'customer_name',
+    '金额': 'amount', '发放时间': 'issue_time', '电话': 'phone'
+}
+REQUIRED_COLUMNS = ['customer_name', 'amount', 'phone']
+
+# Blank cells are reported as NaN, exactly like pd.read_excel did before streaming
+BLANK = math.nan
+
+
+class ExcelRowReader:
+    """Streams the rows of one worksheet through openpyxl's read-only iterator.
+
+    Only the current row (plus any run of blank rows still pending) is held in
+    memory, so the footprint stays flat no matter how large the workbook is.
+    """
+
+    def __init__(self, file, sheet_name=None):
+        from openpyxl import load_workbook # Imported on first upload, not at app start
+        self.workbook = load_workbook(file, read_only=True, data_only=True)
+        self.sheet = self.workbook[sheet_name] if sheet_name else self.workbook.worksheets[0]
+        self._rows = self.sheet.iter_rows(values_only=True)
+        header = next(self._rows, None) or ()
+        # Map each header cell to its model attribute (unknown headers keep their own name)
+        self.columns = [EXPECTED_COLUMNS.get(str(h).strip(), str(h).strip()) if h is not None else None
+                        for h in header]
+
+    def has_columns(self, names):
+        """Returns True if every name in `names` is present in the header row."""
+        return all(name in self.columns for name in names)
+
+    def __iter__(self):
+        """Yields (row_num, row_dict) pairs; row_num is the 1-based Excel row."""
+        pending_blank = [] # Blank rows are only reported if real data follows them (pandas trims trailing ones)
+        for row_num, values in enumerate(self._rows, start=2):
+            row = {}
+            for col, value in zip(self.columns, values):
+                if col is None: continue
+                if isinstance(value, str) and value == '': value = None
+                row[col] = BLANK if value is None else value
+            for col in self.columns: # Short rows: openpyxl omits trailing empty cells
+                if col is not None and col not in row: row[col] = BLANK
+            if all(v is BLANK for v in row.values()):
+                pending_blank.append((row_num, row)); continue
+            yield from pending_blank; pending_blank.clear()
+            yield row_num, row
+
+    def close(self):
+        """Releases the file handle held by the read-only workbook."""
+        self.workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_chunks(iterable, size):
+    """Splits an iterable into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk: return
+        yield chunk
+
+
+# --- Column-wise validation ---
+
+def _parse_datetime(value):
+    """Parses one issue time like the old per-row loop did; unparsable values become NaT."""
+    import pandas as pd
+    try: parsed = pd.to_datetime(value)
+    except (TypeError, ValueError, OverflowError): return pd.NaT
+    return parsed.tz_localize(None) if not pd.isna(parsed) and parsed.tzinfo is not None else parsed
+
+
+def _parse_datetimes(values):
+    """Parses a whole column of issue times at once; unparsable values become NaT.
+
+    Timezone-aware values keep their wall-clock time (the column is naive).
+    If pandas rejects the column as a whole, e.g. 'Mixed timezones detected'
+    when aware and naive values share a chunk, each value is parsed on its own.
+    """
+    import pandas as pd
+    try:
+        try:
+            parsed = pd.to_datetime(values, errors='coerce', format='mixed') # pandas >= 2.0
+        except (TypeError, ValueError):
+            parsed = pd.to_datetime(values, errors='coerce')
+    except (TypeError, ValueError):
+        return pd.Series([_parse_datetime(v) for v in values], index=values.index, dtype='datetime64[ns]')
+    return parsed.dt.tz_localize(None) if parsed.dt.tz is not None else parsed
+
+
+def _cell_text(value):
+    """str() of a cell, without the '.0' of whole numbers stored as floats (e.g. phone numbers)."""
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value).strip()
+
+
+def validate_chunk(chunk, columns):
+    """Validates a chunk of (row_num, row_dict) pairs column-at-a-time.
+
+    Returns (records, errors, skipped_count) where `records` are insert-ready
+    dicts for the valid rows (without order_id/coupon_code; issue_time is
+    None where it is missing or invalid) and `errors` holds
+    the same per-row messages the row-by-row loop used to produce, in row order.
+    """
+    import pandas as pd # Imported on first upload/API create, not at app start (it is the slowest import by far)
+    row_nums = [row_num for row_num, _ in chunk]
+    # dtype=object: a blank cell must not turn a column of integer phone numbers into float64 ('13800138000.0')
+    df = pd.DataFrame([row for _, row in chunk], columns=[c for c in dict.fromkeys(columns) if c is not None], dtype=object)
+    messages = [] # (row_num, sequence within row, message)
+
+    # 1. Rows missing any required value are skipped outright
+    present = df[REQUIRED_COLUMNS].notna().all(axis=1).to_numpy()
+    for i in (~present).nonzero()[0]:
+        messages.append((row_nums[i], 0, f"第 {row_nums[i]} 行：缺少必要数据 (客户名称, 金额, 电话)，已跳过。"))
+
+    # 2. '发放时间': missing or unparsable -> None (warning only, row is kept). insert_records() stores
+    #    the current time instead, after the row key is hashed, so re-uploads of the row still match it.
+    if 'issue_time' in df.columns:
+        raw_times = df['issue_time']
+        parsed_times = _parse_datetimes(raw_times)
+        bad_time = (parsed_times.isna().to_numpy() & present)
+        for i in bad_time.nonzero()[0]:
+            messages.append((row_nums[i], 1, f"第 {row_nums[i]} 行：发放时间 '{raw_times.iat[i]}' 无效或格式错误，已使用当前时间。"))
+        issue_times = parsed_times.astype(object).where(parsed_times.notna(), None).tolist()
+    else:
+        issue_times = [None] * len(df)
+
+    # 3. '金额' must convert to a number
+    raw_amounts = df['amount']
+    amounts = pd.to_numeric(raw_amounts.map(lambda v: v.strip() if isinstance(v, str) else v), errors='coerce')
+    bad_amount = amounts.isna().to_numpy() & present
+    for i in bad_amount.nonzero()[0]:
+        messages.append((row_nums[i], 2, f"第 {row_nums[i]} 行：数据类型转换错误 (例如金额或电话)，已跳过。错误: could not convert string to float: {raw_amounts.iat[i]!r}"))
+
+    valid = present & ~bad_amount
+    skipped_count = int(len(df) - valid.sum())
+    messages.sort(key=lambda m: (m[0], m[1]))
+
+    # 4. Build the insert dicts for the valid rows in bulk
+    suppliers = df['supplier_name'] if 'supplier_name' in df.columns else pd.Series([BLANK] * len(df), dtype=object)
+    out = pd.DataFrame({
+        'supplier_name': suppliers.astype(str).str.strip().astype(object).where(suppliers.notna(), None), # Optional supplier
+        'customer_name': df['customer_name'].astype(str).str.strip(),
+        'amount': amounts.astype(float),
+        'phone': df['phone'].map(_cell_text),
+    })[valid]
+    records = out.to_dict('records')
+    for record, issue_time in zip(records, (t for t, ok in zip(issue_times, valid) if ok)):
+        record['issue_time'] = issue_time
+        record['validity_months'] = 12 # Fixed validity
+        record['status'] = '已激活' # Fixed status
+    return records, [m[2] for m in messages], skipped_count
+
+
+# --- Sheet parsing (runs in worker processes) and coordinated inserts ---
+
+MISSING_COLUMNS_MESSAGE = '上传的文件缺少必要的列 (客户名称, 金额, 电话)。请检查文件标题行。'
+
+
+def list_sheets(path):
+    """Returns the worksheet names of a workbook without reading any rows."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try: return workbook.sheetnames
+    finally: workbook.close()
+
+
+def parse_sheet(path, sheet_name, chunk_size, spool_path):
+    """Validates one worksheet and spools its insert-ready chunks to `spool_path`.
+
+    Runs in a worker process, so it never touches the database: the
+    coordinator reads the spool back chunk by chunk (iter_spool) and does
+    the key allocation and inserts. Only the summary and the row-level
+    messages travel back over the process boundary.
+    """
+    summary = {'valid': 0, 'skipped': 0, 'errors': [], 'message': None}
+    with ExcelRowReader(path, sheet_name) as reader:
+        # Check if essential columns are present after renaming
+        if not reader.has_columns(REQUIRED_COLUMNS):
+            summary['message'] = MISSING_COLUMNS_MESSAGE; return summary
+        with open(spool_path, 'wb') as spool:
+            for chunk in iter_chunks(reader, chunk_size):
+                records, chunk_errors, chunk_skipped = validate_chunk(chunk, reader.columns)
+                summary['errors'].extend(chunk_errors); summary['skipped'] += chunk_skipped
+                if records:
+                    pickle.dump(records, spool, protocol=pickle.HIGHEST_PROTOCOL); summary['valid'] += len(records)
+    return summary
+
+
+def iter_spool(spool_path):
+    """Yields the record chunks written by parse_sheet()."""
+    if not os.path.exists(spool_path): return
+    with open(spool_path, 'rb') as spool:
+        while True:
+            try: yield pickle.load(spool)
+            except EOFError: return
+
+
+def insert_records(records, source='upload'):
+    """Allocates keys for a chunk of validated records and inserts it.
+
+    order_id, coupon_code, row_key and expires_at are written back into
+    `records`; a missing issue_time is only filled in on the inserted copy,
+    so a retry (or classify() running again) still hashes the row as uploaded.
+    The caller commits, through keygen.retry_key_collisions() so that a key
+    taken by a concurrent writer in the meantime only costs a retry.
+    """
+    now = datetime.utcnow()
+    # Allocate all keys for the chunk at once (unique within the batch and against the DB)
+    for record, order_id, coupon_code in zip(records, generate_order_id(len(records)), generate_coupon_code(len(records))):
+        record['order_id'] = order_id; record['coupon_code'] = coupon_code
+    rows = []
+    for record in records:
+        if 'row_key' not in record: record['row_key'] = row_key(record) # Blank issue_time hashes as '', not as now()
+        issue_time = now if record['issue_time'] is None else record['issue_time'] # '发放时间' missing or invalid
+        record['expires_at'] = compute_expires_at(issue_time, record['validity_months'])
+        rows.append({**record, 'issue_time': issue_time})
+    db.session.execute(Order.__table__.insert(), rows) # executemany, no ORM objects
+    add_records(rows) # Supplier/customer totals, same transaction
+    DataVersion.bump('order')
+    inc('orders_ingested_rows_total', len(rows), source=source)
+    return len(rows)
+
+
+def import_records(records, mode='skip'):
+    """Inserts an uploaded chunk, skipping rows that already exist (or updating them with mode='upsert').
+
+    Returns (new, duplicate, updated) row counts; the caller commits.
+    Unless mode is 'off', the transaction first takes the order DataVersion
+    lock, so the duplicate check and the insert are atomic across gunicorn
+    workers too: another process importing the same rows waits, then sees
+    them as duplicates. (No unique index on row_key: mode 'off', the JSON API
+    and databases that already hold duplicates may legitimately repeat a key.)
+    """
+    if mode != 'off': DataVersion.lock('order')
+    new_records, duplicates, updates = classify(records, mode)
+    inserted = insert_records(new_records) if new_records else 0
+    updated = apply_updates(updates)
+    if updated and not inserted: DataVersion.bump('order') # insert_records bumps it otherwise
+    inc('orders_duplicate_rows_total', duplicates); inc('orders_updated_rows_total', updated)
+    return inserted, duplicates, updated
@@ -0,0 +1,332 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.utils import secure_filename
+
+from sqlalchemy import func, select
+
+from archive import archive_batch, archive_condition, delete_batch, next_id_batch
+from ingest import import_records, iter_spool, list_sheets, parse_sheet
+from keygen import retry_key_collisions, warn_if_key_space_filling
+from metrics import inc, observe
+from models import db, Order, OrderBulkJob, UploadJob, UploadJobPart, orders_changed
+
+
+def file_sha256(path):
+    """SHA-256 of a saved upload, read in 1 MB blocks (no parsing)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''): digest.update(block)
+    return digest.hexdigest()
+
+
+PARSE_ERROR_MESSAGE = '处理 Excel 文件时发生严重错误，请检查文件是否为有效的 Excel 工作簿。'
+IMPORT_ERROR_MESSAGE = '导入数据时发生严重错误，之前已提交的数据已保存。详细信息已记录在服务器日志中。'
+BULK_JOB_ERROR_MESSAGE = '处理时发生错误，任务已中止。详细信息已记录在服务器日志中。'
+ARCHIVE_NOT_CONFIGURED_MESSAGE = '归档条件未配置 (ARCHIVE_AFTER_DAYS / ARCHIVE_EXPIRED)。'
+
+
+class _InlineFuture:
+    """Stand-in for a Future when parsing runs in the coordinator thread (UPLOAD_PARSE_PROCESSES = 0)."""
+
+    def __init__(self, fn, *args):
+        self._fn = fn; self._args = args
+
+    def result(self):
+        return self._fn(*self._args)
+
+    def cancel(self):
+        return False
+
+
+class UploadJobRunner:
+    """Runs Excel imports in the background so /upload returns immediately.
+
+    A job holds one part per (file, worksheet). Parts are parsed and validated
+    in parallel on a process pool (UPLOAD_PARSE_PROCESSES); a single
+    coordinator thread per job (UPLOAD_JOB_WORKERS) then allocates keys and
+    inserts the results in order, chunk by chunk, so unique keys are
+    guaranteed across the whole batch. Coordinators of concurrent jobs take
+    turns per chunk (one writer per process, and import_records() locks the
+    duplicate check against other processes); a chunk that still collides
+    with another writer's keys is retried with fresh ones. State, counters
+    and each part's error list are persisted, so the report can be reopened
+    later. With UPLOAD_JOB_WORKERS = 0 jobs run inline in the request (handy
+    for tests).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._parse_pool = None
+        self._write_lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        os.makedirs(app.config['UPLOAD_JOB_FOLDER'], exist_ok=True)
+        app.extensions['upload_jobs'] = self
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.app.config['UPLOAD_JOB_WORKERS'],
+                                                thread_name_prefix='upload-job')
+        return self._executor
+
+    @property
+    def parse_pool(self):
+        if self._parse_pool is None and self.app.config['UPLOAD_PARSE_PROCESSES'] > 0:
+            # 'spawn' because the pool is started from a (multi-threaded) web worker
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.app.config['UPLOAD_PARSE_PROCESSES'],
+                                                   mp_context=multiprocessing.get_context('spawn'))
+        return self._parse_pool
+
+    # --- Queueing ---
+
+    def enqueue(self, file_storages, user_id=None, all_sheets=False, allow_duplicates=False):
+        """Saves the uploaded files, records a queued UploadJob with one part per sheet and schedules it.
+
+        Files whose SHA-256 matches a file already imported successfully (or an
+        earlier file of this upload) are dropped before parsing, unless
+        `allow_duplicates`. Returns (job, duplicates) where `duplicates` is a
+        list of (filename, earlier job id or None); job is None if no file is left.
+        """
+        saved = []; duplicates = []
+        for file_storage in file_storages:
+            _, ext = os.path.splitext(secure_filename(file_storage.filename) or '.xlsx')
+            stored_path = os.path.join(self.app.config['UPLOAD_JOB_FOLDER'], f'{uuid.uuid4().hex}{ext}')
+            file_storage.save(stored_path)
+            saved.append((file_storage.filename, stored_path, file_sha256(stored_path)))
+        if not allow_duplicates:
+            # One indexed lookup for the whole upload
+            imported = dict(db.session.execute(select(UploadJobPart.file_hash, UploadJobPart.job_id).where(
+                UploadJobPart.file_hash.in_([h for _, _, h in saved]), UploadJobPart.state == 'done')).all())
+            kept = []; seen = set()
+            for filename, stored_path, file_hash in saved:
+                if file_hash in imported or file_hash in seen:
+                    duplicates.append((filename, imported.get(file_hash))); self._remove(stored_path)
+                else:
+                    kept.append((filename, stored_path, file_hash)); seen.add(file_hash)
+            saved = kept
+            inc('upload_files_rejected_total', len(duplicates))
+        if not saved: return None, duplicates
+
+        job = UploadJob(user_id=user_id, state='queued', filename=', '.join(filename for filename, _, _ in saved)[:256])
+        for filename, stored_path, file_hash in saved:
+            try: sheets = list_sheets(stored_path) if all_sheets else [None]
+            except Exception: sheets = [None] # Unreadable workbook: let the parser report the error
+            for sheet_name in sheets:
+                job.parts.append(UploadJobPart(filename=filename, sheet_name=sheet_name, stored_path=stored_path, file_hash=file_hash))
+        db.session.add(job); db.session.commit()
+        self.submit(job.id)
+        return job, duplicates
+
+    def submit(self, job_id):
+        if self.app.config['UPLOAD_JOB_WORKERS'] > 0:
+            self.executor.submit(self._run_in_context, job_id)
+        else:
+            self.run(job_id)
+
+    def recover(self):
+        """Fails jobs interrupted by a restart and re-queues the ones that never started."""
+        for job in UploadJob.query.filter(UploadJob.state.in_(['queued', 'running'])).all():
+            files_present = all(part.stored_path and os.path.exists(part.stored_path) for part in job.parts)
+            if job.state == 'running' or not job.parts or not files_present:
+                job.state = 'failed'; job.message = '服务重启，任务被中断。请重新上传文件。'; job.finished_at = datetime.utcnow()
+                self._discard_files(job)
+        db.session.commit()
+        for job in UploadJob.query.filter_by(state='queued').all(): self.submit(job.id)
+
+    # --- Execution ---
+
+    def _run_in_context(self, job_id):
+        with self.app.app_context():
+            self.run(job_id)
+
+    def _parse(self, part, spool_path):
+        args = (part.stored_path, part.sheet_name, self.app.config['UPLOAD_CHUNK_SIZE'], spool_path)
+        if self.parse_pool is not None: return self.parse_pool.submit(parse_sheet, *args)
+        return _InlineFuture(parse_sheet, *args)
+
+    def run(self, job_id):
+        """Processes one job: fans parsing out to the pool, then inserts each part's rows in order."""
+        job = db.session.get(UploadJob, job_id)
+        if job is None or job.finished: return
+        job.state = 'running'; job.started_at = datetime.utcnow(); db.session.commit()
+
+        # Parse every sheet in parallel; inserting part N overlaps with parsing parts N+1...
+        spools = {part.id: os.path.join(self.app.config['UPLOAD_JOB_FOLDER'], f'{uuid.uuid4().hex}.spool') for part in job.parts}
+        futures = []
+        try:
+            # Submitting can fail too (broken/shut-down pool, spawn or pickling error): same failure path as the import
+            for part in job.parts: futures.append((part, self._parse(part, spools[part.id])))
+            for part, future in futures:
+                part.state = 'running'; db.session.commit()
+                try:
+                    summary = future.result()
+                except Exception:
+                    summary = {'valid': 0, 'skipped': 0, 'errors': [], 'message': PARSE_ERROR_MESSAGE}
+                    self.app.logger.exception(f"Excel parse error in upload job {job_id} ({part.filename}/{part.sheet_name})")
+                part.rows_skipped = summary['skipped']; part.error_count = len(summary['errors'])
+                part.errors_json = json.dumps(summary['errors'], ensure_ascii=False); part.message = summary['message']
+                job.rows_skipped += part.rows_skipped; job.error_count += part.error_count
+                db.session.commit()
+                inc('orders_skipped_rows_total', part.rows_skipped)
+
+                # Coordinated inserts: keys are allocated against everything committed so far
+                # Rows already in the database (same natural key) are skipped/updated set-wise, see dedup.py
+                for records in iter_spool(spools[part.id]):
+                    with self._write_lock: # Jobs of this process take turns here; import_records() locks against other processes
+                        inserted, updated = retry_key_collisions(lambda: self._import_chunk(job, part, records))
+                    if inserted or updated: orders_changed.send(self.app)
+                part.state = 'failed' if summary['message'] else 'done'
+                db.session.commit()
+            # Only fail the whole job if no part could be imported
+            job.state = 'failed' if all(part.state == 'failed' for part in job.parts) else 'done'
+            if job.state == 'failed': job.message = job.parts[0].message if len(job.parts) == 1 else '所有文件/工作表均处理失败。'
+            warn_if_key_space_filling()
+        except Exception:
+            db.session.rollback() # Rollback any partial changes of the current chunk
+            for _, future in futures: future.cancel() # Don't parse sheets that will never be inserted
+            # The report is shown in the UI: database errors carry the SQL and its parameters (phone numbers), so they only go to the log
+            job.state = 'failed'; job.message = IMPORT_ERROR_MESSAGE
+            self.app.logger.exception(f"Excel processing error in upload job {job_id}") # Log detailed error
+        finally:
+            for spool_path in spools.values(): self._remove(spool_path)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        self._discard_files(job)
+        elapsed = (job.finished_at - job.started_at).total_seconds()
+        inc('upload_jobs_total', state=job.state); observe('upload_job_duration_seconds', elapsed)
+        self.app.logger.info(f"Upload job {job_id} {job.state}: {job.rows_processed} rows imported, {job.rows_duplicate} duplicate, "
+                             f"{job.rows_updated} updated, {job.rows_skipped} skipped, {job.error_count} errors in {elapsed:.1f} s")
+
+    def _import_chunk(self, job, part, records):
+        """Inserts one spooled chunk and commits it together with the progress counters."""
+        inserted, duplicates, updated = import_records(records, self.app.config['UPLOAD_DEDUP_MODE'])
+        part.rows_processed += inserted; job.rows_processed += inserted
+        part.rows_duplicate += duplicates; job.rows_duplicate += duplicates
+        part.rows_updated += updated; job.rows_updated += updated
+        db.session.commit() # One short transaction per chunk: rows + progress counters
+        return inserted, updated
+
+    def _discard_files(self, job):
+        for path in {part.stored_path for part in job.parts}: self._remove(path)
+
+    def _remove(self, path):
+        if path and os.path.exists(path):
+            try: os.remove(path)
+            except OSError as e: self.app.logger.error(f"Error removing upload file {path}: {e}")
+
+
+class OrderBulkJobRunner:
+    """Runs bulk writes on the order table (delete all, delete selected, archive) in bounded chunks.
+
+    Each chunk of BULK_BATCH_SIZE rows is its own short transaction followed
+    by a BULK_BATCH_PAUSE sleep, so the SQLite write lock is released between
+    chunks and page views, uploads and edits interleave with a long delete
+    instead of stalling behind one huge statement. Progress is persisted on an
+    OrderBulkJob. A single worker thread (BULK_JOB_WORKERS = 1) serialises
+    the jobs; with 0 they run inline in the request.
+    """
+    KINDS = ('delete_all', 'delete_selected', 'archive')
+
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['order_bulk_jobs'] = self
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.app.config['BULK_JOB_WORKERS'],
+                                                thread_name_prefix='order-bulk-job')
+        return self._executor
+
+    def enqueue(self, kind, user_id=None, ids=None, wait=False):
+        """Records a queued OrderBulkJob and schedules it; `wait=True` runs it before returning."""
+        if kind not in self.KINDS: raise ValueError(f"Unknown bulk job kind: {kind}")
+        params = {'ids': ids} if ids is not None else None
+        if kind == 'delete_all': # Only rows that exist now; rows uploaded later are kept, also if the job is resumed after a restart
+            params = {'max_id': db.session.execute(select(func.max(Order.id))).scalar() or 0}
+        job = OrderBulkJob(kind=kind, user_id=user_id, state='queued', params_json=json.dumps(params) if params is not None else None)
+        db.session.add(job); db.session.commit()
+        if wait or self.app.config['BULK_JOB_WORKERS'] == 0:
+            self.run(job.id)
+        else:
+            self.executor.submit(self._run_in_context, job.id)
+        return job
+
+    def recover(self):
+        """Re-queues jobs interrupted by a restart; every kind can safely resume where it stopped."""
+        jobs = OrderBulkJob.query.filter(OrderBulkJob.state.in_(['queued', 'running'])).all()
+        for job in jobs: job.state = 'queued'
+        db.session.commit()
+        for job in jobs:
+            if self.app.config['BULK_JOB_WORKERS'] > 0: self.executor.submit(self._run_in_context, job.id)
+            else: self.run(job.id)
+
+    def _run_in_context(self, job_id):
+        with self.app.app_context():
+            self.run(job_id)
+
+    def _id_batches(self, job, condition):
+        batch_size = self.app.config['BULK_BATCH_SIZE']
+        if job.kind == 'delete_selected':
+            ids = job.params.get('ids', [])
+            for i in range(0, len(ids), batch_size): yield ids[i:i + batch_size]
+            return
+        while True:
+            ids = next_id_batch(batch_size, condition)
+            if not ids: return
+            yield ids
+
+    def run(self, job_id):
+        """Processes one job chunk by chunk, committing rows and progress together."""
+        job = db.session.get(OrderBulkJob, job_id)
+        if job is None or job.finished: return
+        config = self.app.config
+        if job.kind == 'archive' and archive_condition(config) is None:
+            job.state = 'failed'; job.message = ARCHIVE_NOT_CONFIGURED_MESSAGE; job.finished_at = datetime.utcnow()
+            db.session.commit(); return
+        try:
+            if job.kind == 'archive':
+                condition = archive_condition(config)
+            elif job.kind == 'delete_all':
+                # Only rows that existed when the job was requested (bound stored by enqueue()); rows uploaded meanwhile are kept
+                if 'max_id' not in job.params: # Job queued before the bound was stored
+                    job.params_json = json.dumps({'max_id': db.session.execute(select(func.max(Order.id))).scalar() or 0})
+                condition = Order.id <= job.params['max_id']
+            else:
+                condition = Order.id.in_(job.params.get('ids', []))
+            if job.started_at is None: job.started_at = datetime.utcnow()
+            job.state = 'running'
+            job.total = job.processed + (db.session.execute(select(func.count(Order.id)).where(condition)).scalar() or 0)
+            db.session.commit()
+
+            process = archive_batch if job.kind == 'archive' else delete_batch
+            for ids in self._id_batches(job, condition):
+                job.processed += process(ids)
+                db.session.commit() # One short write transaction per chunk
+                orders_changed.send(self.app)
+                if config['BULK_BATCH_PAUSE']: time.sleep(config['BULK_BATCH_PAUSE']) # Let waiting writers take the lock
+            job.state = 'done'
+        except Exception:
+            db.session.rollback()
+            # Shown on the job page and in its status JSON: the SQL and its parameters only go to the log
+            job.state = 'failed'; job.message = BULK_JOB_ERROR_MESSAGE
+            self.app.logger.exception(f"Order bulk job {job_id} ({job.kind}) failed")
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
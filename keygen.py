@@ -0,0 +1,214 @@
+import math
+import random
+import string
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from metrics import inc, timed
+from models import db, ArchivedOrder, KeySequence, Order
+
+ALPHABET = string.ascii_lowercase + string.digits # Same character set the old per-row generators used
+IN_CLAUSE_SIZE = 500 # Stay well below SQLite's bound-parameter limit
+KEY_COLLISION_ATTEMPTS = 5 # Inserts of one chunk before a collision with concurrent writers is given up
+
+
+class KeySpaceExhausted(RuntimeError):
+    """Raised when an allocator cannot hand out any more unique keys."""
+
+
+class KeyAllocator:
+    """Hands out batches of unique keys for one unique column (e.g. Order.order_id).
+
+    Keys are `prefix` + `length` characters. In 'random' mode candidates are
+    drawn at random; in 'sequence' mode they come from a persisted counter
+    (KeySequence) encoded in base 36. Either way a whole batch is checked
+    against the database with one IN query per IN_CLAUSE_SIZE candidates and
+    deduplicated within itself, instead of one SELECT per key. Keys moved to
+    `archive_column` (the same column on ArchivedOrder) are never reissued.
+
+    Sequence ranges are reserved with one atomic UPDATE ... RETURNING, so
+    concurrent writers never get the same range. Random keys are only
+    checked, not reserved: another writer can insert the same candidate
+    before this one commits, so callers run the allocating transaction
+    through retry_key_collisions(), which repeats it with fresh keys.
+    """
+
+    def __init__(self, column, prefix, length, mode='random', refresh_interval=60, archive_column=None):
+        if mode not in ('random', 'sequence'):
+            raise ValueError(f"Unknown key allocation mode: {mode}")
+        self.column = column
+        self.archive_column = archive_column
+        self.prefix = prefix
+        self.length = length
+        self.mode = mode
+        self.capacity = len(ALPHABET) ** length # Size of the key space
+        self.refresh_interval = refresh_interval # Seconds between COUNT(*) refreshes of the fill estimate
+        self._used_estimate = None
+        self._estimated_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, column, config, name, archive_column=None):
+        """Builds an allocator from <NAME>_PREFIX / _LENGTH / _MODE config values."""
+        return cls(column, config[f'{name}_PREFIX'], config[f'{name}_LENGTH'], config.get(f'{name}_MODE', 'random'),
+                   archive_column=archive_column)
+
+    @property
+    def columns(self):
+        return [self.column] + ([self.archive_column] if self.archive_column is not None else [])
+
+    # --- Key space reporting ---
+
+    def usage(self):
+        """Returns how full the key space is, using a fresh COUNT(*)."""
+        used = sum(db.session.execute(select(func.count(column))).scalar() or 0 for column in self.columns)
+        with self._lock:
+            self._used_estimate = used; self._estimated_at = time.monotonic()
+        return {'column': self.column.key, 'mode': self.mode, 'used': used,
+                'capacity': self.capacity, 'fill_ratio': used / self.capacity}
+
+    def used_estimate(self):
+        """Cheap count of used keys; refreshed with COUNT(*) at most every refresh_interval seconds."""
+        with self._lock:
+            stale = self._used_estimate is None or time.monotonic() - self._estimated_at > self.refresh_interval
+        if stale: return self.usage()['used']
+        return self._used_estimate
+
+    def fill_ratio(self):
+        """Cheap fill ratio estimate (see used_estimate()); also exported as key_space_fill_ratio on /metrics."""
+        return self.used_estimate() / self.capacity
+
+    # --- Allocation ---
+
+    def allocate(self, n):
+        """Returns `n` keys that are unique within the batch and not yet in the database."""
+        if n <= 0: return []
+        keys = []; seen = set()
+        with timed('key_allocation_duration_seconds', key=self.column.key):
+            while len(keys) < n:
+                candidates = [c for c in self._candidates(n - len(keys)) if c not in seen]
+                seen.update(candidates)
+                taken = self._existing(candidates)
+                keys.extend(c for c in candidates if c not in taken)
+        keys = keys[:n]
+        inc('key_allocation_keys_total', n, key=self.column.key)
+        with self._lock:
+            if self._used_estimate is not None: self._used_estimate += len(keys)
+        return keys
+
+    def _candidates(self, n):
+        if self.mode == 'sequence':
+            return [self.prefix + self._encode(value) for value in self._next_sequence_values(n)]
+        ratio = min(self.fill_ratio(), 0.99)
+        if ratio >= 0.99:
+            raise KeySpaceExhausted(f"{self.column.key} key space is {ratio:.0%} full; increase its length")
+        # Oversample so that, at the current fill ratio, one round usually yields enough free keys
+        draws = max(n, math.ceil(n / (1 - ratio) * 1.1))
+        return list({self.prefix + ''.join(random.choices(ALPHABET, k=self.length)) for _ in range(draws)})
+
+    def _existing(self, candidates):
+        """Returns the subset of `candidates` already present in the column (set-based lookups)."""
+        taken = set()
+        for i in range(0, len(candidates), IN_CLAUSE_SIZE):
+            batch = candidates[i:i + IN_CLAUSE_SIZE]
+            for column in self.columns:
+                taken.update(db.session.execute(select(column).where(column.in_(batch))).scalars())
+        return taken
+
+    def _next_sequence_values(self, n):
+        """Reserves `n` consecutive counter values (persisted in KeySequence).
+
+        The read and the increment are one UPDATE ... RETURNING statement, so
+        two transactions can never read the same next_value (SELECT ... FOR
+        UPDATE is a no-op on SQLite). The UPDATE holds the row (PostgreSQL) or
+        the write lock (SQLite) until the caller commits the rows using the range.
+        """
+        name = f'{self.column.class_.__tablename__}.{self.column.key}'
+        end = self._bump_sequence(name, n)
+        if end is None:
+            try:
+                with db.session.begin_nested(): # First allocation ever: create the counter
+                    db.session.add(KeySequence(name=name, next_value=n))
+                end = n
+            except IntegrityError: # Another writer created it first
+                end = self._bump_sequence(name, n)
+        start = end - n
+        if end > self.capacity:
+            raise KeySpaceExhausted(f"{name} sequence exhausted; increase its length")
+        return range(start, end)
+
+    def _bump_sequence(self, name, n):
+        """Adds `n` to the counter and returns its new value (None if the counter doesn't exist yet)."""
+        return db.session.execute(update(KeySequence).where(KeySequence.name == name)
+                                  .values(next_value=KeySequence.next_value + n).returning(KeySequence.next_value)
+                                  .execution_options(synchronize_session=False)).scalar()
+
+    def _encode(self, value):
+        digits = []
+        for _ in range(self.length):
+            value, rem = divmod(value, len(ALPHABET))
+            digits.append(ALPHABET[rem])
+        return ''.join(reversed(digits))
+
+
+# --- Application wiring ---
+
+def init_app(app):
+    """Creates the order_id / coupon_code allocators from the app config."""
+    app.extensions['key_allocators'] = {
+        'order_id': KeyAllocator.from_config(Order.order_id, app.config, 'ORDER_ID', ArchivedOrder.order_id),
+        'coupon_code': KeyAllocator.from_config(Order.coupon_code, app.config, 'COUPON_CODE', ArchivedOrder.coupon_code),
+    }
+
+
+def get_allocator(name):
+    """Returns the current app's allocator for 'order_id' or 'coupon_code'."""
+    return current_app.extensions['key_allocators'][name]
+
+
+def generate_order_id(n=1):
+    """Allocates `n` unique Order IDs (NMCFxxxx) with one set-based lookup per batch."""
+    return get_allocator('order_id').allocate(n)
+
+
+def generate_coupon_code(n=1):
+    """Allocates `n` unique Coupon Codes (CXxxxxxxx) with one set-based lookup per batch."""
+    return get_allocator('coupon_code').allocate(n)
+
+
+def is_key_collision(error):
+    """True if an IntegrityError is a unique violation on one of the allocated key columns."""
+    message = str(getattr(error, 'orig', error))
+    return any(name in message for name in current_app.extensions['key_allocators'])
+
+
+def retry_key_collisions(write, attempts=KEY_COLLISION_ATTEMPTS):
+    """Runs `write()`, a transaction that allocates keys, inserts and commits, and returns its result.
+
+    If a concurrent writer committed one of the allocated keys in between
+    (unique violation on order_id/coupon_code), the transaction is rolled
+    back and `write()` runs again, allocating fresh keys, up to `attempts`
+    times. A SAVEPOINT around the insert alone is not enough: on SQLite the
+    savepoint may be the statement that opened the transaction, and
+    releasing it would commit the rows without the rest of the chunk.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return write()
+        except IntegrityError as e:
+            db.session.rollback()
+            if attempt == attempts or not is_key_collision(e): raise
+            inc('key_allocation_retries_total')
+            current_app.logger.warning(f"Key collision with a concurrent writer, retrying the transaction (attempt {attempt})")
+
+
+def warn_if_key_space_filling():
+    """Logs a warning when an order_id/coupon_code key space passes KEY_SPACE_WARN_RATIO."""
+    for allocator in current_app.extensions['key_allocators'].values():
+        ratio = allocator.fill_ratio()
+        if ratio >= current_app.config['KEY_SPACE_WARN_RATIO']:
+            current_app.logger.warning(f"{allocator.column.key} key space is {ratio:.1%} full ({allocator.prefix} + {allocator.length} chars); consider a longer key")
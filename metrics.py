@@ -0,0 +1,255 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # Seconds (histogram upper bounds)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+JOB_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800)
+SLOW_SQL_KEPT = 50 # Statements remembered per request for the slow-request log
+
+# name -> (type, help, buckets). Metrics are per worker process; scrape each worker (or run one).
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint', LATENCY_BUCKETS),
+    'http_requests_total': ('counter', 'Requests by endpoint and status code', None),
+    'http_request_sql_statements_total': ('counter', 'SQL statements executed while serving requests, by endpoint', None),
+    'http_request_sql_seconds_total': ('counter', 'Time spent in SQL while serving requests, by endpoint', None),
+    'http_slow_requests_total': ('counter', 'Requests slower than METRICS_SLOW_REQUEST_MS', None),
+    'sql_statement_duration_seconds': ('histogram', 'Duration of every SQL statement (requests and background jobs)', SQL_BUCKETS),
+    'orders_ingested_rows_total': ('counter', 'Order rows inserted, by source (upload / api)', None),
+    'orders_skipped_rows_total': ('counter', 'Uploaded rows skipped by validation', None),
+    'orders_duplicate_rows_total': ('counter', 'Uploaded rows that already existed (natural-key match), not inserted', None),
+    'orders_updated_rows_total': ('counter', 'Existing orders updated by an upload (UPLOAD_DEDUP_MODE=upsert)', None),
+    'upload_files_rejected_total': ('counter', 'Uploaded files rejected as exact duplicates of an earlier import', None),
+    'upload_jobs_total': ('counter', 'Finished upload jobs by final state', None),
+    'upload_job_duration_seconds': ('histogram', 'Wall time of an upload job (parse + insert)', JOB_BUCKETS),
+    'key_allocation_duration_seconds': ('histogram', 'Time spent allocating order_id / coupon_code batches', SQL_BUCKETS),
+    'key_allocation_keys_total': ('counter', 'Keys handed out by each allocator', None),
+    'key_allocation_retries_total': ('counter', 'Chunks re-inserted with fresh keys after a collision with a concurrent writer', None),
+}
+
+
+class Histogram:
+    """Bucket counts + sum + count; rendered cumulatively like a Prometheus histogram."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot = +Inf
+        self.sum = 0.0; self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value; self.count += 1
+
+
+class Metrics:
+    """In-process request/SQL/ingest metrics, exported at /metrics in the Prometheus text format.
+
+    Recording is a dict lookup plus a few additions under one lock, and SQL
+    timing uses the engine's before/after_cursor_execute events, so it is
+    cheap enough to leave on. Cache, pool and password hashing numbers are
+    read from their owners at scrape time. Requests slower than
+    METRICS_SLOW_REQUEST_MS are logged with their slowest SQL statements.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.slow_request_seconds = None
+        self._values = {} # (name, labels) -> float or Histogram
+        self._lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['METRICS_ENABLED']
+        self.token = config['METRICS_TOKEN']
+        self.slow_request_seconds = config['METRICS_SLOW_REQUEST_MS'] / 1000 if config['METRICS_SLOW_REQUEST_MS'] else None
+        self.logger = app.logger
+        app.extensions['metrics'] = self
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        if not self.enabled: return
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request) # Also runs when the view raised
+        with app.app_context():
+            engines = {id(engine): engine for engine in (app.extensions['sqlalchemy'].engine, app.extensions['read_engine'])}
+        for engine in engines.values(): self._instrument_engine(engine)
+
+    # --- Recording ---
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None: histogram = self._values[key] = Histogram(METRICS[name][2])
+            histogram.observe(value)
+
+    # --- Request and SQL hooks ---
+
+    def _start_request(self):
+        g.metrics_started_at = time.perf_counter()
+        g.metrics_sql_count = 0; g.metrics_sql_seconds = 0.0; g.metrics_sql = []
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc):
+        started_at = g.pop('metrics_started_at', None)
+        if started_at is None: return
+        duration = time.perf_counter() - started_at
+        endpoint = request.endpoint or 'none' # Unmatched URLs share one label instead of one per path
+        if endpoint == 'metrics': return
+        status = 500 if exc is not None else g.get('metrics_status', 0)
+        self.observe('http_request_duration_seconds', duration, endpoint=endpoint)
+        self.inc('http_requests_total', endpoint=endpoint, status=str(status))
+        self.inc('http_request_sql_statements_total', g.metrics_sql_count, endpoint=endpoint)
+        self.inc('http_request_sql_seconds_total', g.metrics_sql_seconds, endpoint=endpoint)
+        if self.slow_request_seconds is not None and duration >= self.slow_request_seconds:
+            self.inc('http_slow_requests_total', endpoint=endpoint)
+            slowest = sorted(g.metrics_sql, key=lambda s: s[0], reverse=True)[:5]
+            statements = ''.join(f"\n  {seconds * 1000:.1f} ms: {' '.join(statement.split())[:500]}" for seconds, statement in slowest)
+            self.logger.warning(f"Slow request: {request.method} {request.full_path} ({endpoint}) took {duration * 1000:.0f} ms, "
+                                f"{g.metrics_sql_count} SQL statements / {g.metrics_sql_seconds * 1000:.0f} ms in the database"
+                                f"{statements}")
+
+    def _instrument_engine(self, engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            context._metrics_started_at = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            seconds = time.perf_counter() - context._metrics_started_at
+            self.observe('sql_statement_duration_seconds', seconds)
+            if has_request_context() and 'metrics_sql' in g:
+                g.metrics_sql_count += 1; g.metrics_sql_seconds += seconds
+                if len(g.metrics_sql) < SLOW_SQL_KEPT: g.metrics_sql.append((seconds, statement))
+
+    # --- Export ---
+
+    def view(self):
+        """GET /metrics. With METRICS_TOKEN set, requires 'Authorization: Bearer <token>'."""
+        if self.token and request.headers.get('Authorization') != f'Bearer {self.token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    def render(self):
+        """Returns every metric of this worker in the Prometheus text exposition format."""
+        with self._lock:
+            snapshot = {key: (value if not isinstance(value, Histogram) else
+                              (value.buckets, list(value.counts), value.sum, value.count)) for key, value in self._values.items()}
+        by_name = {}
+        for (name, labels), value in snapshot.items(): by_name.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, (kind, help_text, _) in METRICS.items():
+            samples = by_name.get(name)
+            if not samples: continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for labels, value in sorted(samples, key=lambda s: s[0]):
+                lines += _histogram_lines(name, labels, *value) if kind == 'histogram' else [f'{name}{_labels(labels)} {_number(value)}']
+        for name, kind, help_text, samples in self._collect():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{_labels(labels)} {_number(value)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+    def _collect(self):
+        """Scrape-time values owned by other components: startup time, result/user caches, key spaces, DB pools, password hashing."""
+        extensions = current_app.extensions
+        startup = extensions.get('startup')
+        if startup is not None:
+            yield 'app_startup_seconds', 'gauge', 'Time this worker took to import the app modules and run create_app()', \
+                [((('phase', 'import'),), startup['import_seconds']), ((('phase', 'create_app'),), startup['create_app_seconds'])]
+        cache = extensions.get('result_cache')
+        if cache is not None:
+            stats = cache.stats()
+            yield 'result_cache_requests_total', 'counter', 'Order list result cache lookups', \
+                [((('result', 'hit'),), stats['hits']), ((('result', 'miss'),), stats['misses'])]
+            yield 'result_cache_entries', 'gauge', 'Entries per cache tier', \
+                [((('tier', 'local'),), stats['local_entries'])] + \
+                ([((('tier', 'shared'),), stats['shared_entries'])] if stats.get('shared_entries') is not None else [])
+        users = extensions.get('user_cache')
+        if users is not None:
+            stats = users.stats()
+            yield 'user_cache_requests_total', 'counter', 'load_user cache lookups', \
+                [((('result', 'hit'),), stats['hits']), ((('result', 'miss'),), stats['misses'])]
+        allocators = extensions.get('key_allocators')
+        if allocators:
+            used = {name: allocator.used_estimate() for name, allocator in allocators.items()} # COUNT(*) at most once a minute
+            yield 'key_space_used', 'gauge', 'Keys in use per allocator (live + archived orders)', \
+                [((('key', name),), used[name]) for name in allocators]
+            yield 'key_space_capacity', 'gauge', 'Size of each key space (alphabet ** length)', \
+                [((('key', name),), allocator.capacity) for name, allocator in allocators.items()]
+            yield 'key_space_fill_ratio', 'gauge', 'Fraction of each key space in use; lengthen the key well before 1', \
+                [((('key', name),), used[name] / allocator.capacity) for name, allocator in allocators.items()]
+        pools = [('write', extensions['sqlalchemy'].engine.pool), ('read', extensions['read_engine'].pool)]
+        samples = []
+        for role, pool in pools[:1] if pools[0][1] is pools[1][1] else pools:
+            for state in ('checkedout', 'checkedin'):
+                if hasattr(pool, state): samples.append(((('pool', role), ('state', state)), getattr(pool, state)()))
+        if samples: yield 'db_pool_connections', 'gauge', 'Connections per engine pool and state', samples
+        hasher = extensions.get('password_hasher')
+        if hasher is not None:
+            operations = hasher.stats()['operations']
+            yield 'password_hash_operations_total', 'counter', 'Password hash/verify calls by outcome', \
+                [((('operation', op), ('outcome', 'done')), m['count']) for op, m in operations.items()] + \
+                [((('operation', op), ('outcome', 'rejected')), m['rejected']) for op, m in operations.items()]
+            yield 'password_hash_seconds_total', 'counter', 'Time spent hashing/verifying passwords', \
+                [((('operation', op),), m['seconds_sum']) for op, m in operations.items()]
+
+
+def _labels(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _histogram_lines(name, labels, buckets, counts, total, count):
+    lines = []; cumulative = 0
+    for bound, n in zip(buckets + ('+Inf',), counts):
+        cumulative += n
+        lines.append(f'{name}_bucket{_labels(labels + (("le", bound),))} {cumulative}')
+    return lines + [f'{name}_sum{_labels(labels)} {_number(total)}', f'{name}_count{_labels(labels)} {count}']
+
+
+# --- Helpers for code outside the request hooks ---
+
+def _metrics():
+    return current_app.extensions.get('metrics') if has_app_context() else None
+
+
+def inc(name, amount=1, **labels):
+    metrics = _metrics()
+    if metrics is not None: metrics.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    metrics = _metrics()
+    if metrics is not None: metrics.observe(name, value, **labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observes the duration of the `with` block in histogram `name`."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started_at, **labels)
@@ -1,28 +1,50 @@
 import datetime
+import functools
+import json
+from blinker import Namespace
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import String, case, func
+from sqlalchemy.schema import CreateColumn
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Sent (with the app as sender) after a write to the order table has been committed;
+# in-process caches subscribe to it. Other workers see the change via DataVersion.
+_signals = Namespace()
+orders_changed = _signals.signal('orders-changed')
+
+def _password_hasher():
+    return current_app.extensions.get('password_hasher') if has_app_context() else None
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     avatar = db.Column(db.String(128), default='default_avatar.png') # Store filename
 
+    # Hashing goes through the app's bounded PasswordHasher pool (auth.py) when there is one
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        hasher = _password_hasher()
+        self.password_hash = hasher.hash(password) if hasher else generate_password_hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        hasher = _password_hasher()
+        return hasher.verify(self.password_hash, password) if hasher else check_password_hash(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        """True if the stored hash predates the current PASSWORD_HASH_METHOD (KDF/cost) policy."""
+        hasher = _password_hasher()
+        return bool(hasher and hasher.needs_rehash(self.password_hash))
 
     def __repr__(self):
         return f'<User {self.username}>'
 
-class Order(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.String(10), index=True, unique=True, nullable=False) # NMCF + 4 chars = 8, let's use 10 just in case
+class OrderFields:
+    """Columns, serialisation and masking shared by Order and ArchivedOrder."""
+    order_id = db.Column(db.String(16), index=True, unique=True, nullable=False) # NMCF + 4 chars = 8 by default; ORDER_ID_LENGTH may lengthen it
     supplier_name = db.Column(db.String(128)) # Added as requested
     customer_name = db.Column(db.String(64), nullable=False)
     amount = db.Column(db.Float, nullable=False)
@@ -32,20 +54,310 @@ class Order(db.Model):
     validity_months = db.Column(db.Integer, nullable=False, default=12)
     status = db.Column(db.String(20), nullable=False, default='已激活') # Default status
     upload_timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    row_key = db.Column(db.String(40), index=True) # Hash of the natural key (UPLOAD_DEDUP_KEY), see dedup.py
+    expires_at = db.Column(db.DateTime, index=True) # issue_time + validity_months, kept in sync by expiry.py
 
-    def __repr__(self):
-        return f'<Order {self.order_id} for {self.customer_name}>'
+    def to_dict(self):
+        return {'id': self.id, 'order_id': self.order_id, 'supplier_name': self.supplier_name,
+                'customer_name': self.customer_name, 'amount': self.amount,
+                'issue_time': self.issue_time.isoformat() if self.issue_time else None,
+                'phone': self.phone, 'coupon_code': self.coupon_code,
+                'validity_months': self.validity_months, 'status': self.status,
+                'upload_timestamp': self.upload_timestamp.isoformat() if self.upload_timestamp else None,
+                'expires_at': self.expires_at.isoformat() if self.expires_at else None}
 
     # --- Masking properties for display ---
     @property
     def masked_phone(self):
-        if self.phone and len(self.phone) >= 11:
-            return f"{self.phone[:3]}****{self.phone[-4:]}"
-        return self.phone # Return original if too short
+        return mask_phone(self.phone)
 
     @property
     def masked_coupon_code(self):
-        if self.coupon_code and len(self.coupon_code) >= 9: # CX + 7 = 9
-             # Show first 5 chars (CX + 3 random), then 4 stars
-            return f"{self.coupon_code[:5]}****"
-        return self.coupon_code # Return original if too short
\ No newline at end of file
+        return mask_coupon_code(self.coupon_code)
+
+
+# Names of the OrderFields columns, i.e. what archiving copies from "order" to "archived_order"
+ORDER_FIELD_NAMES = ['order_id', 'supplier_name', 'customer_name', 'amount', 'issue_time', 'phone',
+                     'coupon_code', 'validity_months', 'status', 'upload_timestamp', 'row_key', 'expires_at']
+
+
+class Order(OrderFields, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_order_upload_timestamp_id', 'upload_timestamp', 'id'), # Backs keyset pagination of the order list
+        db.Index('ix_order_status_expires_at', 'status', 'expires_at'), # Expiry sweeper and the status filter
+    )
+
+    def __repr__(self):
+        return f'<Order {self.order_id} for {self.customer_name}>'
+
+
+class ArchivedOrder(OrderFields, db.Model):
+    """Cold tier: old/expired orders moved out of "order" in bounded batches (see archive.py).
+
+    Keeping them out of the hot table keeps its indexes, the search index and
+    every list/count query small; the list view only reads this table when
+    asked to (index?archived=1). order_id / coupon_code stay unique across
+    both tables, because the key allocators check the archive too.
+    """
+    __tablename__ = 'archived_order'
+    id = db.Column(db.Integer, primary_key=True)
+    original_id = db.Column(db.Integer, index=True) # Order.id before archiving (SQLite may reuse it later)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.Index('ix_archived_order_upload_timestamp_id', 'upload_timestamp', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<ArchivedOrder {self.order_id} for {self.customer_name}>'
+
+
+# --- Masking helpers (Order's properties; their SQL twins below serve the list and export queries) ---
+def mask_phone(phone):
+    if phone and len(phone) >= 11:
+        return f"{phone[:3]}****{phone[-4:]}"
+    return phone # Return original if too short
+
+def mask_coupon_code(coupon_code):
+    if coupon_code and len(coupon_code) >= 9: # CX + 7 = 9
+         # Show first 5 chars (CX + 3 random), then 4 stars
+        return f"{coupon_code[:5]}****"
+    return coupon_code # Return original if too short
+
+# The same masks as SQL expressions (substr/length/||, valid on SQLite and PostgreSQL): list and export
+# queries get display-ready values from the database and the raw phone/coupon never reach Python
+def masked_phone_expression(column):
+    return case((func.length(column) >= 11,
+                 func.substr(column, 1, 3, type_=String) + '****' + func.substr(column, func.length(column) - 3, 4, type_=String)),
+                else_=column)
+
+def masked_coupon_code_expression(column):
+    return case((func.length(column) >= 9, func.substr(column, 1, 5, type_=String) + '****'), else_=column)
+
+@functools.cache # Built once per model: constructing the CASE expressions costs more than a 10-row query
+def order_list_columns(model):
+    """What the order table in _order_results.html shows, plus the (upload_timestamp, id) cursor key.
+
+    index() selects these instead of whole ORM objects: rows come back as
+    plain Row tuples (attribute access, no identity map or instrumentation),
+    phone and coupon code already masked. `model` is Order or ArchivedOrder.
+    """
+    return (model.id, model.order_id, model.customer_name, model.supplier_name, model.amount, model.issue_time,
+            masked_phone_expression(model.phone).label('masked_phone'),
+            masked_coupon_code_expression(model.coupon_code).label('masked_coupon_code'),
+            model.validity_months, model.status, model.upload_timestamp)
+
+class DataVersion(db.Model):
+    """Per-table change counter, bumped in the same transaction as every write to that table.
+
+    Cheap to read (one primary-key lookup), so HTTP validators and caches can
+    tell whether anything changed without touching the data rows.
+    """
+    name = db.Column(db.String(64), primary_key=True) # e.g. 'order'
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    @classmethod
+    def bump(cls, name='order'):
+        """Increments the counter inside the current transaction (the caller commits)."""
+        now = datetime.datetime.utcnow()
+        updated = db.session.execute(db.update(cls).where(cls.name == name)
+                                     .values(version=cls.version + 1, updated_at=now)).rowcount
+        if not updated: db.session.add(cls(name=name, version=1, updated_at=now))
+
+    @classmethod
+    def lock(cls, name='order'):
+        """Takes the write lock of `name`'s counter row until the caller commits or rolls back, without changing it.
+
+        A no-op UPDATE: on SQLite it takes the database write lock, on PostgreSQL
+        the row lock, so transactions that start with lock() run one at a time
+        across every process and see each other's committed rows.
+        """
+        updated = db.session.execute(db.update(cls).where(cls.name == name).values(version=cls.version)).rowcount
+        if not updated: db.session.add(cls(name=name, version=0)); db.session.flush()
+
+    @classmethod
+    def current(cls, name='order'):
+        """Returns (version, updated_at) for `name`."""
+        row = db.session.execute(db.select(cls.version, cls.updated_at).where(cls.name == name)).first()
+        return (row.version, row.updated_at) if row else (0, None)
+
+    def __repr__(self):
+        return f'<DataVersion {self.name}={self.version}>'
+
+
+class SupplierSummary(db.Model):
+    """Running totals of the current (non-archived) orders per supplier, maintained by summaries.py."""
+    supplier_name = db.Column(db.String(128), primary_key=True) # '' = orders without a supplier
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_total = db.Column(db.Float, nullable=False, default=0.0)
+    active_count = db.Column(db.Integer, nullable=False, default=0) # status 已激活
+    expired_count = db.Column(db.Integer, nullable=False, default=0) # status 已过期
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {'supplier_name': self.supplier_name or None, 'order_count': self.order_count,
+                'amount_total': round(self.amount_total, 2), 'active_count': self.active_count,
+                'expired_count': self.expired_count}
+
+    def __repr__(self):
+        return f'<SupplierSummary {self.supplier_name!r} {self.order_count}>'
+
+
+class CustomerSummary(db.Model):
+    """Running totals of the current orders per customer (name + phone), maintained by summaries.py."""
+    customer_name = db.Column(db.String(64), primary_key=True)
+    phone = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_total = db.Column(db.Float, nullable=False, default=0.0)
+    active_count = db.Column(db.Integer, nullable=False, default=0)
+    expired_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_customer_summary_amount_total', 'amount_total'), # Summary page sorts by total amount
+    )
+
+    @property
+    def masked_phone(self):
+        return mask_phone(self.phone)
+
+    def to_dict(self):
+        return {'customer_name': self.customer_name, 'phone': self.masked_phone, 'order_count': self.order_count,
+                'amount_total': round(self.amount_total, 2), 'active_count': self.active_count,
+                'expired_count': self.expired_count}
+
+    def __repr__(self):
+        return f'<CustomerSummary {self.customer_name} {self.order_count}>'
+
+
+class KeySequence(db.Model):
+    """Persisted counter backing sequence-mode key allocation (see keygen.py)."""
+    name = db.Column(db.String(64), primary_key=True) # e.g. 'order.order_id'
+    next_value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<KeySequence {self.name}={self.next_value}>'
+
+
+class UploadJob(db.Model):
+    """A queued/running/finished Excel import (one or more files/sheets) and its persisted report."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    filename = db.Column(db.String(256), nullable=False) # Original name(s) shown to the user
+    state = db.Column(db.String(16), nullable=False, default='queued') # queued / running / done / failed
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    rows_duplicate = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Already in the database, not inserted
+    rows_updated = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Existing orders changed (upsert mode)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text) # Fatal error, if any
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    parts = db.relationship('UploadJobPart', backref='job', order_by='UploadJobPart.id',
+                            cascade='all, delete-orphan')
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    def to_dict(self):
+        return {'id': self.id, 'filename': self.filename, 'state': self.state,
+                'rows_processed': self.rows_processed, 'rows_skipped': self.rows_skipped,
+                'rows_duplicate': self.rows_duplicate, 'rows_updated': self.rows_updated,
+                'error_count': self.error_count, 'message': self.message,
+                'created_at': self.created_at.isoformat() if self.created_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+                'parts': [part.to_dict() for part in self.parts]}
+
+    def __repr__(self):
+        return f'<UploadJob {self.id} {self.state}>'
+
+
+class UploadJobPart(db.Model):
+    """One worksheet of one uploaded file within an UploadJob, with its own report."""
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('upload_job.id'), index=True, nullable=False)
+    filename = db.Column(db.String(256), nullable=False)
+    sheet_name = db.Column(db.String(128)) # None = first sheet
+    stored_path = db.Column(db.String(512)) # Saved upload (shared by parts of the same file)
+    file_hash = db.Column(db.String(64), index=True) # SHA-256 of the uploaded file: identical re-uploads are rejected
+    state = db.Column(db.String(16), nullable=False, default='queued')
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    rows_duplicate = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rows_updated = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+    errors_json = db.Column(db.Text) # Row-level warnings, JSON list
+    message = db.Column(db.Text) # Why the sheet was rejected, if it was
+
+    @property
+    def errors(self):
+        return json.loads(self.errors_json) if self.errors_json else []
+
+    def to_dict(self):
+        return {'filename': self.filename, 'sheet_name': self.sheet_name, 'state': self.state,
+                'rows_processed': self.rows_processed, 'rows_skipped': self.rows_skipped,
+                'rows_duplicate': self.rows_duplicate, 'rows_updated': self.rows_updated,
+                'error_count': self.error_count, 'message': self.message}
+
+    def __repr__(self):
+        return f'<UploadJobPart {self.filename}:{self.sheet_name} {self.state}>'
+
+
+class OrderBulkJob(db.Model):
+    """A chunked background write on the order table (delete all, delete selected, archive) and its progress."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    kind = db.Column(db.String(32), nullable=False) # delete_all / delete_selected / archive
+    state = db.Column(db.String(16), nullable=False, default='queued') # queued / running / done / failed
+    params_json = db.Column(db.Text) # e.g. the selected IDs for delete_selected, the highest id to delete for delete_all
+    total = db.Column(db.Integer) # Rows expected to be affected (estimate taken when the job starts)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text) # Fatal error, if any
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    @property
+    def params(self):
+        return json.loads(self.params_json) if self.params_json else {}
+
+    @property
+    def finished(self):
+        return self.state in ('done', 'failed')
+
+    def to_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'state': self.state, 'total': self.total,
+                'processed': self.processed, 'message': self.message,
+                'created_at': self.created_at.isoformat() if self.created_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None}
+
+    def __repr__(self):
+        return f'<OrderBulkJob {self.id} {self.kind} {self.state}>'
+
+
+def upgrade_schema():
+    """Creates missing tables, columns added to existing tables, and the indexes db.create_all() skips.
+
+    New columns on existing tables must be nullable or have a server_default
+    (ALTER TABLE ... ADD COLUMN can't fill existing rows otherwise).
+    """
+    db.create_all()
+    existing_columns = {}
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing_columns[table.name] = {column['name'] for column in inspector.get_columns(table.name)}
+    with db.engine.begin() as connection:
+        table_name = connection.dialect.identifier_preparer.format_table
+        for table in db.metadata.sorted_tables:
+            for column in table.columns:
+                if column.name in existing_columns[table.name]: continue
+                column_ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(db.text(f'ALTER TABLE {table_name(table)} ADD COLUMN {column_ddl}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from db_engine import read_session
+from models import DataVersion, orders_changed
+
+
+# --- Backends ---
+
+class MemoryBackend:
+    """In-process LRU cache with a per-entry TTL (thread-safe)."""
+    name = 'memory'
+
+    def __init__(self, ttl=60, max_entries=1024):
+        self.ttl = ttl; self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if now >= entry[1]:
+                del self._entries[key]; return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl); self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False); self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """Shared cache in a local SQLite file, so every worker process on the host reuses the same entries.
+
+    Values are stored as JSON. Each thread keeps its own connection; WAL lets
+    readers proceed while another worker writes an entry.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, ttl=60, max_entries=10000):
+        self.path = path; self.ttl = ttl; self.max_entries = max_entries
+        self._local = threading.local()
+        self.evictions = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid(): # Never reuse a connection opened before a fork (preloaded servers)
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None) # Autocommit: every statement is its own transaction
+            conn.execute('PRAGMA journal_mode=WAL'); conn.execute('PRAGMA synchronous=OFF') # Losing a cache entry is harmless
+            self._local.conn = conn; self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value, expires_at FROM result_cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] <= time.time(): return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connection(); now = time.time()
+        conn.execute('INSERT OR REPLACE INTO result_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, json.dumps(value, ensure_ascii=False), now + self.ttl))
+        # Keep the file bounded: drop expired rows, then the entries closest to expiry
+        self.evictions += conn.execute('DELETE FROM result_cache WHERE expires_at <= ?', (now,)).rowcount
+        excess = conn.execute('SELECT COUNT(*) FROM result_cache').fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.evictions += conn.execute('DELETE FROM result_cache WHERE key IN '
+                                           '(SELECT key FROM result_cache ORDER BY expires_at LIMIT ?)', (excess,)).rowcount
+
+    def clear(self):
+        self._connection().execute('DELETE FROM result_cache')
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM result_cache').fetchone()[0]
+
+
+# --- Result cache ---
+
+def current_data_version():
+    """The order table's DataVersion counter, read through the same (read-only) session as the page data."""
+    return read_session().execute(select(DataVersion.version).where(DataVersion.name == 'order')).scalar() or 0
+
+
+class ResultCache:
+    """Caches order list/search results: row IDs, total count and (optionally) the rendered table fragment.
+
+    Keys include the order table's DataVersion counter, which every write path
+    (upload, edit_order, batch/all delete, the JSON API) bumps in its own
+    transaction. A write therefore invalidates every cached page in every
+    worker at once; stale entries are never read again and simply age out.
+    The in-process LRU is always consulted first; RESULT_CACHE_BACKEND =
+    'sqlite' adds a shared file-backed tier behind it. The version is read
+    before the data, so an entry is never newer-stamped than its contents.
+    """
+
+    def __init__(self, app=None):
+        self.local = None
+        self.shared = None
+        self.enabled = False
+        self.store_fragments = False
+        self._stats = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        if app is not None: self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config['RESULT_CACHE_BACKEND'] != 'none'
+        self.store_fragments = config['RESULT_CACHE_FRAGMENTS']
+        self.local = MemoryBackend(ttl=config['RESULT_CACHE_TTL'], max_entries=config['RESULT_CACHE_MAX_ENTRIES'])
+        if config['RESULT_CACHE_BACKEND'] == 'sqlite':
+            self.shared = SqliteBackend(config['RESULT_CACHE_PATH'], ttl=config['RESULT_CACHE_TTL'],
+                                        max_entries=config['RESULT_CACHE_SHARED_MAX_ENTRIES'])
+        self.logger = app.logger
+        # Entries of older versions are dead anyway; free this worker's memory right after its own writes
+        orders_changed.connect(lambda sender: self.local.clear(), sender=app, weak=False)
+        app.extensions['result_cache'] = self
+
+    @staticmethod
+    def make_key(version, *parts):
+        """Builds the cache key string from the data version and the request's filters/page/cursor."""
+        digest = hashlib.sha1(json.dumps(parts, ensure_ascii=False, default=str).encode()).hexdigest()
+        return f'orders:{version}:{digest}'
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None on a miss."""
+        if not self.enabled: return None
+        value = self.local.get(key)
+        if value is not None:
+            self._count('hits'); return value
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except sqlite3.Error as e:
+                self._count('errors'); self.logger.warning(f"Result cache read failed: {e}")
+            if value is not None:
+                self.local.set(key, value) # Promote to the in-process tier
+                self._count('hits'); self._count('shared_hits'); return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        if not self.enabled: return
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except sqlite3.Error as e:
+                self._count('errors'); self.logger.warning(f"Result cache write failed: {e}")
+        self._count('stores')
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None: self.shared.clear()
+
+    def stats(self):
+        """Hit/miss counters of this worker plus the current tier sizes."""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        stats['backend'] = self.shared.name if self.shared is not None else ('memory' if self.enabled else 'none')
+        stats['local_entries'] = len(self.local); stats['local_evictions'] = self.local.evictions
+        if self.shared is not None:
+            try: stats['shared_entries'] = len(self.shared)
+            except sqlite3.Error: stats['shared_entries'] = None
+            stats['shared_evictions'] = self.shared.evictions
+        return stats
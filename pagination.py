@@ -0,0 +1,148 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from math import ceil
+
+from sqlalchemy import tuple_
+
+
+# --- Cursor encoding ---
+
+def encode_cursor(timestamp, row_id):
+    """Encodes an (upload_timestamp, id) position as an opaque URL-safe token."""
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decodes a cursor token; returns None if it is missing or malformed."""
+    if not token: return None
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+
+# --- Page objects (same attributes the index template reads from Flask-SQLAlchemy's Pagination) ---
+
+class OffsetPage:
+    """Classic numbered page; used while the result set is small enough for OFFSET to be cheap."""
+    cursor_mode = False
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items; self.page = page; self.per_page = per_page; self.total = total
+
+    @property
+    def pages(self):
+        return ceil(self.total / self.per_page) if self.per_page else 0
+
+    @property
+    def has_prev(self): return self.page > 1
+
+    @property
+    def has_next(self): return self.page < self.pages
+
+    @property
+    def prev_num(self): return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self): return self.page + 1 if self.has_next else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
+        """Yields page numbers for the pagination widget, with None marking gaps."""
+        last = 0
+        for num in range(1, self.pages + 1):
+            if (num <= left_edge or self.page - left_current - 1 < num < self.page + right_current
+                    or num > self.pages - right_edge):
+                if last + 1 != num: yield None
+                yield num; last = num
+
+    def cache_state(self):
+        """Everything but the rows, for the result cache (see restore_page())."""
+        return {'cursor_mode': self.cursor_mode, 'page': self.page, 'per_page': self.per_page, 'total': self.total,
+                'has_prev': self.has_prev, 'has_next': self.has_next}
+
+
+class KeysetPage(OffsetPage):
+    """Page fetched by seeking past a cursor on (upload_timestamp, id) instead of OFFSET."""
+    cursor_mode = True
+
+    def __init__(self, items, page, per_page, total, has_prev, has_next):
+        super().__init__(items, page, per_page, total)
+        self._has_prev = has_prev; self._has_next = has_next
+        self.prev_cursor = encode_cursor(items[0].upload_timestamp, items[0].id) if items else None
+        self.next_cursor = encode_cursor(items[-1].upload_timestamp, items[-1].id) if items else None
+
+    @property
+    def has_prev(self): return self._has_prev
+
+    @property
+    def has_next(self): return self._has_next
+
+
+def restore_page(state, items):
+    """Rebuilds a page object from cache_state() and the re-fetched rows."""
+    if state['cursor_mode']:
+        return KeysetPage(items, state['page'], state['per_page'], state['total'], state['has_prev'], state['has_next'])
+    return OffsetPage(items, state['page'], state['per_page'], state['total'])
+
+
+def paginate_keyset(query, model, cursor, direction, page, per_page, total):
+    """Fetches one page ordered by (upload_timestamp, id) descending using a seek predicate.
+
+    `direction` is 'next' (rows after the cursor) or 'prev' (rows before it).
+    Backed by the (upload_timestamp, id) index, so deep pages cost the same as the first.
+    """
+    position = decode_cursor(cursor)
+    key = tuple_(model.upload_timestamp, model.id)
+    if position is None:
+        rows = query.order_by(model.upload_timestamp.desc(), model.id.desc()).limit(per_page + 1).all()
+        return KeysetPage(rows[:per_page], 1, per_page, total, has_prev=False, has_next=len(rows) > per_page)
+    if direction == 'prev':
+        rows = (query.filter(key > tuple_(*position))
+                .order_by(model.upload_timestamp.asc(), model.id.asc()).limit(per_page + 1).all())
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        return KeysetPage(rows, max(page, 1) if has_prev else 1, per_page, total, has_prev=has_prev, has_next=True)
+    rows = (query.filter(key < tuple_(*position))
+            .order_by(model.upload_timestamp.desc(), model.id.desc()).limit(per_page + 1).all())
+    return KeysetPage(rows[:per_page], page, per_page, total, has_prev=True, has_next=len(rows) > per_page)
+
+
+# --- Cached total counts ---
+
+class CountCache:
+    """Small thread-safe cache of COUNT(*) results per filter, with a TTL.
+
+    Callers put the order table's DataVersion in the key, so a write in any
+    worker makes every cached total unreachable at once. Write routes also
+    call invalidate() to free this worker's old entries right away.
+    """
+
+    def __init__(self, ttl=30, max_entries=1024):
+        self.ttl = ttl; self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached count for `key`, running `compute()` on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[0]
+        count = compute()
+        with self._lock:
+            self._entries[key] = (count, now); self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+        return count
+
+    def invalidate(self):
+        """Drops every cached count (called after any write to the order table)."""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,132 @@
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, literal_column, or_, select, text
+
+from models import db, Order
+from summaries import ACTIVE_STATUS
+
+# SQLite FTS5 trigram index over the searchable order columns. It is an
+# external-content table: the text lives only in "order", the FTS table just
+# holds the trigram postings, kept in sync by the triggers below. This covers
+# every write path (upload's bulk insert, edit, batch delete, delete-all).
+SEARCH_TABLE = 'order_search'
+MIN_TRIGRAM_TERM = 3 # Trigram MATCH needs at least 3 characters
+
+_SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        supplier_name, customer_name, content='order', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS order_search_ai AFTER INSERT ON "order" BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, supplier_name, customer_name) VALUES (new.id, new.supplier_name, new.customer_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS order_search_ad AFTER DELETE ON "order" BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, supplier_name, customer_name) VALUES ('delete', old.id, old.supplier_name, old.customer_name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS order_search_au AFTER UPDATE OF supplier_name, customer_name ON "order" BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, supplier_name, customer_name) VALUES ('delete', old.id, old.supplier_name, old.customer_name);
+        INSERT INTO {SEARCH_TABLE}(rowid, supplier_name, customer_name) VALUES (new.id, new.supplier_name, new.customer_name);
+    END""",
+]
+
+_index_available = None # Set by ensure_search_index(); None means "not checked yet"
+
+
+def ensure_search_index():
+    """Creates the FTS5 table and its sync triggers if missing, and backfills existing rows.
+
+    Returns False (and searches fall back to ILIKE) when the database is not
+    SQLite or its SQLite build lacks FTS5 trigram support.
+    """
+    global _index_available
+    if db.engine.dialect.name != 'sqlite':
+        _index_available = False; return False
+    try:
+        with db.engine.begin() as conn:
+            existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE}).first()
+            for statement in _SEARCH_DDL: conn.execute(text(statement))
+            if not existed: # Index the rows that were there before the search table existed
+                conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+        _index_available = True
+    except Exception:
+        _index_available = False
+    return _index_available
+
+
+def search_index_available():
+    """Returns True if searches can use the FTS5 trigram index."""
+    global _index_available
+    if _index_available is None: # e.g. a worker that did not run initialize_database()
+        _index_available = db.engine.dialect.name == 'sqlite' and db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': SEARCH_TABLE}).first() is not None
+    return _index_available
+
+
+def parse_customer_query(customer_query_string):
+    """Splits the customer search box into names (comma, semicolon or space separated)."""
+    # Normalize delimiters (commas, semicolons, etc.) to spaces
+    normalized_query = customer_query_string.replace(',', ' ').replace(';', ' ')
+    # Add more .replace() if other delimiters like '|' are expected
+    return [name.strip() for name in normalized_query.split(' ') if name.strip()]
+
+
+def _indexable(term):
+    # Short terms can't be matched by trigrams; LIKE wildcards keep their old ILIKE meaning
+    return len(term) >= MIN_TRIGRAM_TERM and '%' not in term and '_' not in term
+
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"' # FTS5 string literal; a trigram phrase is a substring match
+
+
+def _substring_condition(column, terms):
+    """OR of "column contains term" for `terms`, served by the trigram index where possible."""
+    # Only the hot "order" table is indexed; the archive is searched with ILIKE
+    indexed = [t for t in terms if _indexable(t)] if column.class_ is Order and search_index_available() else []
+    conditions = [column.ilike(f'%{t}%') for t in terms if t not in indexed]
+    if indexed:
+        match = f"{column.key} : ({' OR '.join(_phrase(t) for t in indexed)})"
+        matching_ids = select(literal_column('rowid')).select_from(text(SEARCH_TABLE)).where(
+            literal_column(SEARCH_TABLE).op('MATCH')(match))
+        conditions.append(Order.id.in_(matching_ids))
+    return or_(*conditions) if len(conditions) > 1 else conditions[0]
+
+
+def apply_order_filters(query, supplier_query='', customer_names=(), model=Order, status_filter=''):
+    """Applies the order-list search filters (supplier substring AND any-of customer substrings AND status).
+
+    `model` is Order, or ArchivedOrder when browsing the archive. `status_filter`
+    is a STATUS_FILTERS key; unknown values are ignored.
+    """
+    if supplier_query:
+        query = query.filter(_substring_condition(model.supplier_name, [supplier_query]))
+    if customer_names:
+        query = query.filter(_substring_condition(model.customer_name, list(customer_names)))
+    if status_filter in STATUS_FILTERS:
+        query = query.filter(status_condition(status_filter, model))
+    return query
+
+
+# --- Status / expiry filter (range conditions on the indexed expires_at column, see expiry.py) ---
+
+STATUS_FILTERS = {'active': '有效', 'expiring': '即将过期', 'expired': '已过期'}
+STATUS_CLOCK_SECONDS = 60 # Cached/validated results of a status filter are reused for at most this long
+
+
+def status_clock(status_filter):
+    """Time bucket for cache keys and ETags: status filters change results as time passes, without any write.
+
+    None for '' (no filter), whose results only change with the data version.
+    """
+    return int(time.time() // STATUS_CLOCK_SECONDS) if status_filter in STATUS_FILTERS else None
+
+
+def status_condition(status_filter, model=Order, now=None):
+    """WHERE clause for a STATUS_FILTERS key. Expiry is judged by expires_at, so it is right even before the sweeper runs."""
+    now = now or datetime.utcnow()
+    if status_filter == 'expired':
+        return model.expires_at <= now
+    condition = and_(model.status == ACTIVE_STATUS, model.expires_at > now)
+    if status_filter == 'expiring':
+        condition = and_(condition, model.expires_at <= now + timedelta(days=current_app.config['EXPIRING_SOON_DAYS']))
+    return condition
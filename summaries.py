@@ -0,0 +1,159 @@
+import datetime
+
+from sqlalchemy import case, delete, event, func, inspect, literal, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, CustomerSummary, Order, SupplierSummary
+
+ACTIVE_STATUS = '已激活'
+EXPIRED_STATUS = '已过期'
+COUNTERS = ['order_count', 'amount_total', 'active_count', 'expired_count']
+# (summary model, its key columns, the Order columns they come from)
+TABLES = [(SupplierSummary, ['supplier_name'], ['supplier_name']),
+          (CustomerSummary, ['customer_name', 'phone'], ['customer_name', 'phone'])]
+TOLERANCE = 0.005 # Amount drift (float sums) that verify() still accepts
+
+
+# --- Deltas: what a write adds to / removes from each summary row ---
+
+class SummaryDelta:
+    """Accumulates per-key counter changes for both summary tables; apply() writes them in one upsert per table.
+
+    Every write path on "order" feeds one of these within its own transaction:
+    insert_records() (uploads, API create), delete_batch() (batch/all delete,
+    archiving), the API delete, upsert updates, and ORM edits via before_flush.
+    """
+
+    def __init__(self):
+        self.rows = {model: {} for model, _, _ in TABLES}
+
+    def add(self, values, sign=1):
+        """Counts one order (dict-like with supplier/customer/phone/amount/status) with sign +1 or -1."""
+        status = values['status'] or ACTIVE_STATUS # Column default for ORM objects not flushed yet
+        counters = (sign, sign * float(values['amount']), sign * (status == ACTIVE_STATUS), sign * (status == EXPIRED_STATUS))
+        for model, _, source in TABLES:
+            key = tuple(values[c] or '' for c in source)
+            row = self.rows[model].setdefault(key, [0, 0.0, 0, 0])
+            for i, value in enumerate(counters): row[i] += value
+
+    def add_grouped(self, condition, sign=1):
+        """Adds the orders matching `condition`, aggregated by SQL GROUP BY (no per-row transfer)."""
+        for model, _, source in TABLES:
+            columns = [func.coalesce(getattr(Order, c), '') for c in source]
+            statement = select(*columns, *_counter_expressions()).where(condition).group_by(*columns)
+            for row in db.session.execute(statement):
+                counters = self.rows[model].setdefault(tuple(row[:len(source)]), [0, 0.0, 0, 0])
+                for i, value in enumerate(row[len(source):]): counters[i] += sign * (value or 0)
+
+    def apply(self, session=None):
+        """Upserts the accumulated changes and drops summary rows whose order count fell to zero."""
+        session = session or db.session
+        now = datetime.datetime.utcnow()
+        dialect = session.get_bind().dialect.name
+        for model, keys, _ in TABLES:
+            rows = [dict(zip(keys, key), **dict(zip(COUNTERS, counters)), updated_at=now)
+                    for key, counters in self.rows[model].items() if any(counters)]
+            if not rows: continue
+            table = model.__table__
+            statement = (postgresql.insert(table) if dialect == 'postgresql' else sqlite.insert(table))
+            statement = statement.on_conflict_do_update(
+                index_elements=keys,
+                set_={**{c: table.c[c] + statement.excluded[c] for c in COUNTERS}, 'updated_at': statement.excluded.updated_at})
+            session.execute(statement, rows)
+            emptied = [tuple(row[k] for k in keys) for row in rows if row['order_count'] < 0]
+            if emptied:
+                session.execute(delete(table).where(tuple_(*[table.c[k] for k in keys]).in_(emptied), table.c.order_count <= 0))
+        self.rows = {model: {} for model, _, _ in TABLES}
+
+
+def _counter_expressions():
+    return [func.count(), func.coalesce(func.sum(Order.amount), 0.0),
+            func.sum(case((Order.status == ACTIVE_STATUS, 1), else_=0)),
+            func.sum(case((Order.status == EXPIRED_STATUS, 1), else_=0))]
+
+
+# --- Hooks for the Core write paths ---
+
+def add_records(records):
+    """Counts freshly inserted order dicts (insert_records); the caller commits."""
+    delta = SummaryDelta()
+    for record in records: delta.add(record)
+    delta.apply()
+
+
+def subtract_orders(condition):
+    """Uncounts the orders matching `condition`; call right before deleting/changing them."""
+    delta = SummaryDelta(); delta.add_grouped(condition, -1); delta.apply()
+
+
+def add_orders(condition):
+    """Counts the orders matching `condition`; call right after changing them."""
+    delta = SummaryDelta(); delta.add_grouped(condition, 1); delta.apply()
+
+
+# --- ORM edits (edit page, JSON API update) ---
+
+TRACKED = ['supplier_name', 'customer_name', 'phone', 'amount', 'status']
+
+
+def _old_values(state):
+    values = {}
+    for name in TRACKED:
+        history = state.attrs[name].history
+        values[name] = history.deleted[0] if history.deleted else (history.unchanged[0] if history.unchanged else state.attrs[name].value)
+    return values
+
+
+@event.listens_for(db.session, 'before_flush')
+def _track_orm_changes(session, flush_context, instances):
+    delta = SummaryDelta()
+    for obj in session.new:
+        if isinstance(obj, Order): delta.add({name: getattr(obj, name) for name in TRACKED})
+    for obj in session.deleted:
+        if isinstance(obj, Order): delta.add(_old_values(inspect(obj)), -1)
+    for obj in session.dirty:
+        if isinstance(obj, Order) and session.is_modified(obj):
+            state = inspect(obj)
+            if not any(state.attrs[name].history.has_changes() for name in TRACKED): continue
+            delta.add(_old_values(state), -1); delta.add({name: getattr(obj, name) for name in TRACKED})
+    delta.apply(session)
+
+
+# --- Rebuild / verify ---
+
+def _fresh_totals():
+    """{model: {key: [counters]}} computed from "order" with one GROUP BY per summary table."""
+    delta = SummaryDelta(); delta.add_grouped(Order.id.isnot(None))
+    return delta.rows
+
+
+def verify():
+    """Compares the summary tables with a full recount; returns a list of (table, key, stored, expected) mismatches."""
+    mismatches = []; fresh = _fresh_totals()
+    for model, keys, _ in TABLES:
+        expected = fresh[model]
+        stored = {tuple(getattr(row, k) for k in keys): [getattr(row, c) for c in COUNTERS] for row in db.session.query(model)}
+        for key in expected.keys() | stored.keys():
+            want = expected.get(key, [0, 0.0, 0, 0]); have = stored.get(key, [0, 0.0, 0, 0])
+            if want[0] != have[0] or want[2:] != have[2:] or abs(want[1] - have[1]) > TOLERANCE:
+                mismatches.append((model.__tablename__, key, have, want))
+    return mismatches
+
+
+def rebuild():
+    """Recomputes both summary tables from "order" in one transaction (INSERT ... SELECT ... GROUP BY)."""
+    now = datetime.datetime.utcnow()
+    for model, keys, source in TABLES:
+        db.session.execute(delete(model))
+        columns = [func.coalesce(getattr(Order, c), '') for c in source]
+        db.session.execute(model.__table__.insert().from_select(
+            keys + COUNTERS + ['updated_at'],
+            select(*columns, *_counter_expressions(), literal(now, db.DateTime)).group_by(*columns)))
+    db.session.commit()
+    return {model.__tablename__: db.session.query(model).count() for model, _, _ in TABLES}
+
+
+def ensure_summaries():
+    """Builds the summary tables on first start against a database that already holds orders."""
+    if db.session.query(SupplierSummary).first() is None and db.session.query(Order.id).first() is not None:
+        rebuild()
@@ -0,0 +1,53 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The app's modules live in the repo root
+
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    """An app on a throwaway SQLite database; jobs run inline unless a test raises the worker counts."""
+    import app as app_module
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        DATABASE_READ_URL = None
+        UPLOAD_FOLDER = str(tmp_path / 'avatars')
+        UPLOAD_JOB_FOLDER = str(tmp_path / 'upload_jobs')
+        RESULT_CACHE_BACKEND = 'memory'
+        UPLOAD_JOB_WORKERS = 0
+        UPLOAD_PARSE_PROCESSES = 0
+        BULK_JOB_WORKERS = 0
+        BULK_BATCH_PAUSE = 0
+        EXPIRY_SWEEP_INTERVAL = 0
+        PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+
+    app = app_module.create_app(TestConfig)
+    with app.app_context(): app_module.initialize_database()
+    yield app
+    with app.app_context(): app_module.db.engine.dispose()
+
+
+def write_workbook(path, rows, header=('供应商名称', '客户名称', '金额', '发放时间', '电话')):
+    """Saves `rows` under the Excel header the upload expects."""
+    from openpyxl import Workbook
+    workbook = Workbook(); sheet = workbook.active
+    sheet.append(list(header))
+    for row in rows: sheet.append(list(row))
+    workbook.save(path)
+    return str(path)
+
+
+def insert_orders(app, count):
+    """Inserts orders the way another worker would: committed, but without this worker's orders_changed signal."""
+    from ingest import insert_records
+    from models import db
+    with app.app_context():
+        insert_records([{'supplier_name': 'S1', 'customer_name': f'客户{i}', 'amount': 10.0, 'phone': '13800138000',
+                         'issue_time': datetime(2024, 1, 1), 'validity_months': 12, 'status': '已激活'} for i in range(count)])
+        db.session.commit()
@@ -0,0 +1,39 @@
+import time
+
+import search
+
+
+def _login(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'password'})
+    return client
+
+
+def test_status_filter_etag_changes_with_the_clock(app, monkeypatch):
+    client = _login(app)
+    now = time.time()
+    monkeypatch.setattr(search.time, 'time', lambda: now)
+    etag = client.get('/api/orders?status=expired').headers['ETag']
+    assert client.get('/api/orders?status=expired', headers={'If-None-Match': etag}).status_code == 304
+    monkeypatch.setattr(search.time, 'time', lambda: now + search.STATUS_CLOCK_SECONDS)
+    assert client.get('/api/orders?status=expired', headers={'If-None-Match': etag}).status_code == 200
+    # Without a status filter only writes change the validators
+    etag = client.get('/api/orders').headers['ETag']
+    monkeypatch.setattr(search.time, 'time', lambda: now + 10 * search.STATUS_CLOCK_SECONDS)
+    assert client.get('/api/orders', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_bulk_delete_is_limited_to_api_max_batch(app):
+    client = _login(app)
+    app.config['API_MAX_BATCH'] = 2
+    assert client.delete('/api/orders', json={'ids': [1, 2, 3]}).status_code == 400
+    assert client.delete('/api/orders', json={'ids': [1, 2]}).json == {'deleted': 0}
+
+
+def test_bulk_update_reports_non_string_order_ids(app):
+    client = _login(app)
+    response = client.patch('/api/orders', json={'orders': [{'order_id': ['NMCF0001']}, {'order_id': {'a': 1}}, {'order_id': 'NMCFnone'}]})
+    assert response.status_code == 200
+    assert response.json['errors'] == [{'order_id': ['NMCF0001'], 'errors': ['order_id must be a string']},
+                                       {'order_id': {'a': 1}, 'errors': ['order_id must be a string']},
+                                       {'order_id': 'NMCFnone', 'errors': ['order not found']}]
@@ -0,0 +1,28 @@
+import math
+from datetime import datetime
+
+from ingest import validate_chunk
+
+COLUMNS = ['supplier_name', 'customer_name', 'amount', 'issue_time', 'phone']
+
+
+def _row(customer, phone, issue_time='2024-01-01', amount=100):
+    return {'supplier_name': 'S1', 'customer_name': customer, 'amount': amount, 'issue_time': issue_time, 'phone': phone}
+
+
+def test_integer_phones_stay_integral_next_to_a_blank_phone():
+    chunk = [(2, _row('张三', 13800138000)), (3, _row('李四', math.nan)), (4, _row('王五', 13800138001.0))]
+    records, errors, skipped = validate_chunk(chunk, COLUMNS)
+    assert [r['phone'] for r in records] == ['13800138000', '13800138001']
+    assert skipped == 1 and '第 3 行' in errors[0]
+
+
+def test_mixed_timezone_issue_times_are_parsed_per_value():
+    chunk = [(2, _row('张三', '1', issue_time='2024-01-01T10:00:00+08:00')),
+             (3, _row('李四', '2', issue_time=datetime(2024, 2, 1, 9, 30))),
+             (4, _row('王五', '3', issue_time='notadate'))]
+    records, errors, skipped = validate_chunk(chunk, COLUMNS)
+    assert skipped == 0
+    assert [r['issue_time'] for r in records[:2]] == [datetime(2024, 1, 1, 10, 0), datetime(2024, 2, 1, 9, 30)]
+    assert records[0]['issue_time'].tzinfo is None and records[2]['issue_time'] is None # Stored as the upload time
+    assert errors == ["第 4 行：发放时间 'notadate' 无效或格式错误，已使用当前时间。"]
@@ -0,0 +1,152 @@
+import contextlib
+import os
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import FileStorage
+
+import ingest
+import jobs
+from conftest import insert_orders, write_workbook
+from models import db, Order, OrderBulkJob, UploadJob
+
+
+def _enqueue(runner, path):
+    with open(path, 'rb') as f:
+        job, _ = runner.enqueue([FileStorage(f, filename=os.path.basename(path))])
+    return job.id
+
+
+def test_parallel_upload_jobs_get_unique_keys(app, tmp_path):
+    app.config.update(UPLOAD_JOB_WORKERS=2, UPLOAD_CHUNK_SIZE=100)
+    paths = [write_workbook(tmp_path / f'orders{n}.xlsx',
+                            [(f'S{n}', f'客户{n}-{i}', i + 1, datetime(2024, 1, 1), 13800000000 + i) for i in range(1500)])
+             for n in range(2)]
+    runner = app.extensions['upload_jobs']
+    with app.app_context():
+        job_ids = [_enqueue(runner, path) for path in paths]
+    runner.executor.shutdown(wait=True); runner._executor = None # The runner is a module-level singleton
+    with app.app_context():
+        for job_id in job_ids:
+            job = db.session.get(UploadJob, job_id)
+            assert (job.state, job.message, job.rows_processed) == ('done', None, 1500)
+        assert Order.query.count() == 3000
+        assert Order.query.with_entities(Order.order_id).distinct().count() == 3000
+        assert Order.query.with_entities(Order.coupon_code).distinct().count() == 3000
+
+
+def test_database_errors_are_logged_not_shown(app, tmp_path, monkeypatch):
+    def failing_import(records, mode):
+        raise IntegrityError('INSERT INTO "order" ...', [{'phone': records[0]['phone']}], Exception('UNIQUE constraint failed'))
+    monkeypatch.setattr(jobs, 'import_records', failing_import)
+    path = write_workbook(tmp_path / 'orders.xlsx', [('S1', '张三', 100, datetime(2024, 1, 1), 13912345678)])
+    with app.app_context():
+        job = db.session.get(UploadJob, _enqueue(app.extensions['upload_jobs'], path))
+        assert job.state == 'failed'
+        assert job.message == jobs.IMPORT_ERROR_MESSAGE and '13912345678' not in job.message
+
+
+def test_resumed_delete_all_keeps_rows_inserted_after_the_request(app, monkeypatch):
+    runner = app.extensions['order_bulk_jobs']
+    insert_orders(app, 3)
+    with app.app_context():
+        monkeypatch.setattr(runner, 'run', lambda job_id: None) # The process dies before the job runs
+        job = runner.enqueue('delete_all')
+        monkeypatch.undo()
+        job.state = 'running'; db.session.commit(); job_id = job.id
+    insert_orders(app, 2) # Uploaded after the delete was requested
+    with app.app_context():
+        runner.recover()
+        assert db.session.get(OrderBulkJob, job_id).state == 'done'
+        assert Order.query.count() == 2
+
+
+class _Later(datetime):
+    @classmethod
+    def utcnow(cls):
+        return datetime(2030, 1, 1)
+
+
+def test_reuploading_the_same_file_inserts_nothing(app, tmp_path, monkeypatch):
+    rows = [('S1', '张三', 100, None, 13800138000), # Blank issue time: stored as the upload time
+            ('S1', '李四', 200, 'notadate', 13800138001),
+            ('S2', '王五', 300, datetime(2024, 1, 1), None), # Blank phone: skipped, and no longer turns phones into floats
+            ('S2', '赵六', 400, datetime(2024, 1, 2), 13800138003)]
+    path = write_workbook(tmp_path / 'orders.xlsx', rows)
+    runner = app.extensions['upload_jobs']
+    with app.app_context():
+        app.config['UPLOAD_CHUNK_SIZE'] = 1000
+        first = db.session.get(UploadJob, _enqueue(runner, path))
+        assert (first.rows_processed, first.rows_skipped) == (3, 1)
+        app.config['UPLOAD_CHUNK_SIZE'] = 1 # Each row in a chunk of its own this time
+        monkeypatch.setattr(ingest, 'datetime', _Later) # ... and at a later upload time
+        with open(path, 'rb') as f:
+            second, _ = runner.enqueue([FileStorage(f, filename='orders.xlsx')], allow_duplicates=True)
+        assert (second.rows_processed, second.rows_duplicate) == (0, 3)
+        assert Order.query.count() == 3
+
+
+def test_job_fails_when_parsing_cannot_be_submitted(app, tmp_path, monkeypatch):
+    runner = app.extensions['upload_jobs']
+    def broken_pool(part, spool_path):
+        raise RuntimeError('A process in the process pool was terminated abruptly')
+    monkeypatch.setattr(runner, '_parse', broken_pool)
+    path = write_workbook(tmp_path / 'orders.xlsx', [('S1', '张三', 100, datetime(2024, 1, 1), 13800138000)])
+    with app.app_context():
+        job = db.session.get(UploadJob, _enqueue(runner, path))
+        assert (job.state, job.message) == ('failed', jobs.IMPORT_ERROR_MESSAGE)
+        assert job.finished_at is not None
+
+
+def test_bulk_job_errors_are_logged_not_shown(app, monkeypatch):
+    def failing_delete(ids):
+        raise IntegrityError('DELETE FROM "order" WHERE ...', [{'phone': '13912345678'}], Exception('constraint failed'))
+    monkeypatch.setattr(jobs, 'delete_batch', failing_delete)
+    insert_orders(app, 1)
+    with app.app_context():
+        job = app.extensions['order_bulk_jobs'].enqueue('delete_all')
+        assert (job.state, job.message) == ('failed', jobs.BULK_JOB_ERROR_MESSAGE)
+        app.config.update(ARCHIVE_AFTER_DAYS=0, ARCHIVE_EXPIRED=False)
+        job = app.extensions['order_bulk_jobs'].enqueue('archive')
+        assert (job.state, job.message) == ('failed', jobs.ARCHIVE_NOT_CONFIGURED_MESSAGE)
+
+
+def test_retried_chunk_keeps_the_row_key_of_a_blank_issue_time(app, tmp_path, monkeypatch):
+    from dedup import row_key
+    from keygen import get_allocator
+    insert_orders(app, 1)
+    path = write_workbook(tmp_path / 'orders.xlsx', [('S9', '张三', 100, None, 13800138000)])
+    runner = app.extensions['upload_jobs']
+    with app.app_context():
+        allocator = get_allocator('order_id'); original = allocator._candidates
+        draws = iter([[Order.query.first().order_id]]) # One forced collision with a committed key
+        monkeypatch.setattr(allocator, '_candidates', lambda n: next(draws, None) or original(n))
+        monkeypatch.setattr(allocator, '_existing', lambda candidates: set())
+        first = db.session.get(UploadJob, _enqueue(runner, path))
+        assert (first.state, first.rows_processed) == ('done', 1)
+        monkeypatch.undo()
+        stored = Order.query.filter_by(supplier_name='S9').one()
+        assert stored.row_key == row_key({'supplier_name': 'S9', 'customer_name': '张三', 'phone': '13800138000',
+                                          'amount': 100.0, 'issue_time': None})
+        with open(path, 'rb') as f:
+            second, _ = runner.enqueue([FileStorage(f, filename='orders.xlsx')], allow_duplicates=True)
+        assert (second.rows_processed, second.rows_duplicate) == (0, 1)
+
+
+def test_same_file_imported_concurrently_without_the_process_lock_is_deduplicated(app, tmp_path, monkeypatch):
+    app.config.update(UPLOAD_JOB_WORKERS=2, UPLOAD_CHUNK_SIZE=50)
+    path = write_workbook(tmp_path / 'orders.xlsx',
+                          [('S1', f'客户{i}', i + 1, datetime(2024, 1, 1), 13800000000 + i) for i in range(1000)])
+    runner = app.extensions['upload_jobs']
+    monkeypatch.setattr(runner, '_write_lock', contextlib.nullcontext()) # As if the jobs ran in two gunicorn workers
+    with app.app_context():
+        job_ids = []
+        for _ in range(2):
+            with open(path, 'rb') as f:
+                job_ids.append(runner.enqueue([FileStorage(f, filename='orders.xlsx')], allow_duplicates=True)[0].id)
+    runner.executor.shutdown(wait=True); runner._executor = None
+    with app.app_context():
+        jobs_done = [db.session.get(UploadJob, job_id) for job_id in job_ids]
+        assert [job.state for job in jobs_done] == ['done', 'done']
+        assert sum(job.rows_processed for job in jobs_done) == 1000
+        assert Order.query.count() == 1000
@@ -0,0 +1,52 @@
+import threading
+from datetime import datetime
+
+from ingest import insert_records
+from keygen import get_allocator, retry_key_collisions
+from models import db, Order, SupplierSummary
+
+
+def _record(customer='张三'):
+    return {'supplier_name': 'S1', 'customer_name': customer, 'amount': 10.0, 'phone': '13800138000',
+            'issue_time': datetime(2024, 1, 1), 'validity_months': 12, 'status': '已激活'}
+
+
+def test_sequence_ranges_never_overlap_across_threads(app):
+    with app.app_context(): get_allocator('order_id').mode = 'sequence'
+    ranges = []; errors = []
+
+    def allocate():
+        try:
+            with app.app_context():
+                for _ in range(20):
+                    keys = get_allocator('order_id').allocate(50); db.session.commit()
+                    ranges.append(keys)
+        except Exception as e: # Surfaced by the assertion below
+            errors.append(e)
+
+    threads = [threading.Thread(target=allocate) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert not errors
+    keys = [key for keys in ranges for key in keys]
+    assert len(keys) == 4 * 20 * 50 and len(set(keys)) == len(keys)
+
+
+def test_chunk_is_retried_when_a_concurrent_writer_took_a_key(app, monkeypatch):
+    with app.app_context():
+        taken = Order(order_id='NMCFaaaa', coupon_code='CXaaaaaaa', **_record('李四'))
+        db.session.add(taken); db.session.commit()
+        allocator = get_allocator('order_id')
+        draws = iter([['NMCFaaaa']]) # The first draw returns the committed key, as if it was inserted after the check
+        original = allocator._candidates
+        monkeypatch.setattr(allocator, '_candidates', lambda n: next(draws, None) or original(n))
+        monkeypatch.setattr(allocator, '_existing', lambda candidates: set())
+
+        metrics = app.extensions['metrics']; retries = ('key_allocation_retries_total', ())
+        retried_before = metrics._values.get(retries, 0)
+        records = [_record()]
+        assert retry_key_collisions(lambda: (insert_records(records), db.session.commit())[0]) == 1
+        assert records[0]['order_id'] != 'NMCFaaaa'
+        assert Order.query.count() == 2
+        assert db.session.get(SupplierSummary, 'S1').order_count == 2 # Rows and totals committed together
+        assert metrics._values[retries] == retried_before + 1
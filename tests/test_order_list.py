@@ -0,0 +1,10 @@
+from conftest import insert_orders
+
+
+def test_total_count_follows_writes_of_other_workers(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'password'})
+    insert_orders(app, 1)
+    assert b'page=2' not in client.get('/index?per_page=1').data
+    insert_orders(app, 2)
+    assert b'page=2' in client.get('/index?per_page=1').data
@@ -0,0 +1,23 @@
+"""Production entry point: the WSGI app for gunicorn / waitress.
+
+Linux (several worker processes, app preloaded once in the master, see gunicorn.conf.py):
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Windows (waitress: one process, a pool of request threads):
+
+    python wsgi.py
+
+Run `python app.py db create` once per deploy first; neither server touches the schema.
+"""
+import os
+
+from app import create_app, start_background_tasks
+
+app = create_app()
+
+if __name__ == '__main__':
+    from waitress import serve # pip install waitress
+    start_background_tasks(app) # One process: it recovers the jobs and runs the sweep itself
+    serve(app, host=os.environ.get('WAITRESS_HOST', '0.0.0.0'), port=int(os.environ.get('WAITRESS_PORT', 5000)),
+          threads=int(os.environ.get('WAITRESS_THREADS', 8)))